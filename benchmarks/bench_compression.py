@@ -0,0 +1,82 @@
+"""
+Benchmark of the payload compression pipeline on SparkStage events.
+
+Compares the previous json.dumps + gzip.compress of whole payloads against the streaming EventBatcher for
+every available JSON backend and a range of compression levels. Reports CPU time per MB of JSON, the
+compressed size and the number of payloads. Run from the repository root:
+
+    python benchmarks/bench_compression.py [--stages 20000] [--levels 1,3,6,9]
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import codec  # noqa: E402
+from batcher import MAX_EVENTS, Attributes, EventBatcher  # noqa: E402
+from bench_projection import LABELS, make_stages  # noqa: E402
+from integration import stage_keys  # noqa: E402
+from projection import Projector  # noqa: E402
+
+
+def legacy(events, labels):
+    payloads = []
+    for i in range(0, len(events), MAX_EVENTS):
+        batch = []
+        for event in events[i:i + MAX_EVENTS]:
+            event = dict(event)
+            event.update(labels)
+            batch.append(event)
+        payloads.append(gzip.compress(json.dumps(batch).encode()))
+    return payloads
+
+
+def legacy_events(events):
+    return [dict(event, **LABELS) for event in events]
+
+
+def batched(events, attributes, level):
+    payloads = []
+    batcher = EventBatcher(lambda payload, count: payloads.append(payload), compression_level=level)
+    for event in events:
+        batcher.add(event, attributes)
+    batcher.flush()
+    return payloads
+
+
+def measure(name, json_bytes, fn):
+    start = time.process_time()
+    payloads = fn()
+    elapsed = time.process_time() - start
+    compressed = sum(len(payload) for payload in payloads)
+    print(f'{name:<32} {elapsed * 1e3 / (json_bytes / 1e6):>10,.1f} ms/MB {compressed:>12,} bytes '
+          f'{json_bytes / compressed:>7.1f}x {len(payloads):>5} payloads')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stages', type=int, default=20000)
+    parser.add_argument('--levels', default='1,3,6,9')
+    args = parser.parse_args()
+
+    stage_projector = Projector('SparkStage', stage_keys)
+    events = [stage_projector(stage) for stage in make_stages(args.stages)]
+    attributes = Attributes(LABELS)
+    json_bytes = len(json.dumps(legacy_events(events)).encode())
+
+    print(f'{args.stages} stages, {json_bytes / 1e6:.1f} MB of JSON')
+    measure('json.dumps + gzip.compress(9)', json_bytes, lambda: legacy(events, LABELS))
+    backends = ['json'] + (['orjson'] if codec.orjson is not None else [])
+    for backend in backends:
+        codec.set_json_backend(backend)
+        attributes = Attributes(LABELS)
+        for level in (int(level) for level in args.levels.split(',')):
+            measure(f'batcher {backend} level {level}', json_bytes, lambda: batched(events, attributes, level))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+End to end benchmark of Integration.run against a local fake spark driver and a fake ingest sink.
+
+Each poll collects every application of the fake driver, after which the driver completes new jobs and
+stages. Reports polls/s, poll latency percentiles, peak RSS, CPU time per event and bytes on the wire.
+The fake servers run in a child process, so only the integration's own CPU time and memory are measured.
+With the --max-* and --min-* options the benchmark exits with status 1 when a result crosses the limit,
+so it can be used as a regression gate. Run from the repository root:
+
+    python benchmarks/bench_integration.py [--apps 4] [--stages 500] [--executors 50] [--polls 20]
+    python benchmarks/bench_integration.py --fixtures recorded/ --latency 0.02 --json
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import resource
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from fake_spark import FakeServers  # noqa: E402
+from integration import Integration  # noqa: E402
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+def make_config(servers, args):
+    return {
+        'run_as_service': False,
+        'poll_interval': 30,
+        'collection_workers': args.workers,
+        'self_metrics_interval': 0,
+        'spark': {'cluster_name': 'bench', 'driver_host': '127.0.0.1', 'conf_ui_port': servers.spark_port,
+                  'master_ui_port': '<<MASTER_UI_PORT>>', 'app_list_ttl': 0},
+        'newrelic': {'account_id': 1, 'api_key': 'bench', 'output': args.output,
+                     'api_endpoint': f'http://127.0.0.1:{servers.sink_port}/v1/accounts/{{account_id}}/events',
+                     'metrics_api_endpoint': f'http://127.0.0.1:{servers.sink_port}/metric/v1',
+                     'compression_level': args.compression_level, 'json_backend': args.json_backend},
+        'labels': {'environment': 'bench'},
+        'tags': {},
+    }
+
+
+def run(args):
+    servers = FakeServers({'apps': args.apps, 'jobs': args.jobs, 'stages': args.stages,
+                           'executors': args.executors, 'latency': args.latency, 'fixtures': args.fixtures},
+                          {'decode': True})
+    try:
+        integration = Integration(make_config(servers, args))
+        durations = []
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for _ in range(args.polls):
+            start = time.perf_counter()
+            integration.run()
+            durations.append(time.perf_counter() - start)
+            servers.advance(jobs=args.churn, stages=args.churn * 2)
+        integration.close(timeout=30)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        with urllib.request.urlopen(f'http://127.0.0.1:{servers.sink_port}/stats') as response:
+            sink = json.load(response)
+    finally:
+        servers.close()
+
+    records = sink['events'] + sink['metrics']
+    return {
+        'polls': args.polls,
+        'polls_per_second': args.polls / wall,
+        'poll_p50_seconds': percentile(durations, 0.5),
+        'poll_p99_seconds': percentile(durations, 0.99),
+        'peak_rss_mb': peak_rss_mb(),
+        'cpu_seconds': cpu,
+        'cpu_us_per_event': cpu * 1e6 / records if records else None,
+        'events': sink['events'],
+        'metrics': sink['metrics'],
+        'payloads': sink['payloads'],
+        'wire_bytes': sink['bytes'],
+        'wire_bytes_per_event': sink['bytes'] / records if records else None,
+    }
+
+
+def check(results, args):
+    """Returns the violated regression gates."""
+    failures = []
+    for option, name, higher_is_worse in (('max_p99', 'poll_p99_seconds', True),
+                                          ('min_polls_per_second', 'polls_per_second', False),
+                                          ('max_rss_mb', 'peak_rss_mb', True),
+                                          ('max_cpu_us_per_event', 'cpu_us_per_event', True),
+                                          ('max_bytes_per_event', 'wire_bytes_per_event', True)):
+        limit = getattr(args, option)
+        value = results[name]
+        if limit is None or value is None:
+            continue
+        if (value > limit) if higher_is_worse else (value < limit):
+            failures.append(f'{name} {value:.3f} is {"above" if higher_is_worse else "below"} the limit of {limit}')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apps', type=int, default=4)
+    parser.add_argument('--jobs', type=int, default=200)
+    parser.add_argument('--stages', type=int, default=500)
+    parser.add_argument('--executors', type=int, default=50)
+    parser.add_argument('--fixtures', help='directory with recorded applications.json, jobs.json, stages.json '
+                                           'and executors.json, served for every application')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every spark request')
+    parser.add_argument('--churn', type=int, default=5, help='jobs completed per application between polls')
+    parser.add_argument('--polls', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--output', default='events', choices=('events', 'metrics', 'both'))
+    parser.add_argument('--compression-level', type=int, default=9)
+    parser.add_argument('--json-backend', default='auto', choices=('auto', 'json', 'orjson'))
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--max-p99', type=float)
+    parser.add_argument('--min-polls-per-second', type=float)
+    parser.add_argument('--max-rss-mb', type=float)
+    parser.add_argument('--max-cpu-us-per-event', type=float)
+    parser.add_argument('--max-bytes-per-event', type=float)
+    args = parser.parse_args()
+
+    logging.getLogger('nri-databricks').setLevel(logging.ERROR)
+    results = run(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f'{args.polls} polls of {args.apps} apps x {args.stages} stages x {args.executors} executors')
+        print(f'polls/s              {results["polls_per_second"]:>12.2f}')
+        print(f'poll p50 / p99       {results["poll_p50_seconds"] * 1e3:>9.1f} ms {results["poll_p99_seconds"] * 1e3:>9.1f} ms')
+        print(f'peak RSS             {results["peak_rss_mb"]:>12.1f} MB')
+        print(f'CPU                  {results["cpu_seconds"]:>12.3f} s')
+        print(f'events / metrics     {results["events"]:>12,} {results["metrics"]:>12,}')
+        if results['cpu_us_per_event'] is not None:
+            print(f'CPU per event        {results["cpu_us_per_event"]:>12.1f} us')
+            print(f'wire bytes           {results["wire_bytes"]:>12,} ({results["wire_bytes_per_event"]:.1f} per event, '
+                  f'{results["payloads"]} payloads)')
+
+    failures = check(results, args)
+    for failure in failures:
+        print(f'FAIL {failure}', file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Microbenchmark of the event projection of spark stages.
+
+Compares the compiled Projector, with labels serialized once by the batcher, against the previous
+per-record dict comprehension plus labels update. Besides the throughput it counts what the projector
+removes per event: the key operations on the spark record and the key map (iterating every field of the
+record and testing it against the key map, against reading the selected fields), and the labels copied
+into every event dict. Run from the repository root:
+
+    python benchmarks/bench_projection.py [--stages 100000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from batcher import Attributes, serialize  # noqa: E402
+from filters import EventFilter  # noqa: E402
+from integration import stage_keys  # noqa: E402
+from projection import Projector  # noqa: E402
+
+LABELS = {'environment': 'prod', 'team': 'data-platform', 'driverHost': '10.0.0.1',
+          'clusterName': 'interactive-shared-01'}
+
+
+class CountingDict(dict):
+    """A dict counting the key operations made on it, for records and key maps."""
+
+    operations = 0
+
+    def __getitem__(self, key):
+        CountingDict.operations += 1
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        CountingDict.operations += 1
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        CountingDict.operations += 1
+        return super().get(key, default)
+
+    def items(self):
+        for item in super().items():
+            CountingDict.operations += 1
+            yield item
+
+
+def make_stages(count):
+    """Stages shaped like /api/v1/applications/{id}/stages responses."""
+    stages = []
+    for stage_id in range(count, 0, -1):
+        stages.append({
+            'status': 'COMPLETE', 'stageId': stage_id, 'attemptId': 0, 'numTasks': 200,
+            'numActiveTasks': 0, 'numCompleteTasks': 200, 'numFailedTasks': 0, 'numKilledTasks': 0,
+            'numCompletedIndices': 200, 'submissionTime': '2024-01-01T00:00:00.000GMT',
+            'firstTaskLaunchedTime': '2024-01-01T00:00:00.010GMT',
+            'completionTime': '2024-01-01T00:00:05.000GMT', 'executorDeserializeTime': 1200,
+            'executorDeserializeCpuTime': 900000000, 'executorRunTime': 48000 + stage_id % 1000,
+            'executorCpuTime': 41000000000, 'resultSize': 480000, 'jvmGcTime': 320,
+            'resultSerializationTime': 12, 'memoryBytesSpilled': 0, 'diskBytesSpilled': 0,
+            'peakExecutionMemory': 0, 'inputBytes': 134217728, 'inputRecords': 1000000,
+            'outputBytes': 0, 'outputRecords': 0, 'shuffleRemoteBlocksFetched': 0,
+            'shuffleLocalBlocksFetched': 0, 'shuffleFetchWaitTime': 0, 'shuffleRemoteBytesRead': 0,
+            'shuffleRemoteBytesReadToDisk': 0, 'shuffleLocalBytesRead': 0, 'shuffleReadBytes': 0,
+            'shuffleReadRecords': 0, 'shuffleWriteBytes': 52428800, 'shuffleWriteTime': 81000000,
+            'shuffleWriteRecords': 1000000, 'name': f'save at NativeMethodAccessorImpl.java:{stage_id}',
+            'description': f'Job group for statement {stage_id}',
+            'details': 'org.apache.spark.sql.Dataset.save(Dataset.scala:1)\n' * 8,
+            'schedulingPool': 'default', 'rddIds': [stage_id * 3, stage_id * 3 + 1, stage_id * 3 + 2],
+            'accumulatorUpdates': [], 'killedTasksSummary': {}, 'resourceProfileId': 0,
+            'peakExecutorMetrics': {'JVMHeapMemory': 0, 'JVMOffHeapMemory': 0, 'OnHeapExecutionMemory': 0,
+                                    'OffHeapExecutionMemory': 0, 'OnHeapStorageMemory': 0,
+                                    'OffHeapStorageMemory': 0},
+        })
+    return stages
+
+
+def legacy(stage, labels, keys=stage_keys):
+    nr_event = {key: value for key,
+                value in stage.items() if key in keys}
+    nr_event['eventType'] = 'SparkStage'
+    nr_event.update(labels)
+    return nr_event
+
+
+def filtered(projector, stage, attributes):
+    event = projector(stage)
+    return serialize(event, attributes) if event is not None else None
+
+
+def measure(name, stages, fn, counted=None):
+    """Prints the throughput of fn and, with counted, the key operations and label copies per event of it."""
+    start = time.perf_counter()
+    for stage in stages:
+        fn(stage)
+    elapsed = time.perf_counter() - start
+    line = f'{name:<40} {len(stages) / elapsed:>14,.0f} events/s'
+
+    if counted is not None:
+        sample = [CountingDict(stage) for stage in stages[:1000]]
+        CountingDict.operations = 0
+        events = [counted(stage) for stage in sample]
+        events = [event for event in events if event is not None]
+        label_copies = sum(sum(1 for key in LABELS if key in event) for event in events)
+        line += f' {CountingDict.operations / len(sample):>8.1f} key ops/event ' \
+                f'{label_copies / len(sample):>5.1f} label copies/event'
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stages', type=int, default=100000)
+    args = parser.parse_args()
+
+    stages = make_stages(args.stages)
+    attributes = Attributes(LABELS)
+    stage_projector = Projector('SparkStage', stage_keys)
+    # drops a tenth of the stages and keeps eight fields of the rest
+    filtered_projector = Projector('SparkStage', stage_keys, event_filter=EventFilter(
+        'SparkStage', include=['stageId', 'attemptId', 'status', 'numTasks', 'executorRunTime', 'executorCpuTime',
+                               'inputBytes', 'shuffleWriteBytes'],
+        drop=[{'numTasks': 0}], sample={'rate': 0.9, 'key': ['stageId']}))
+
+    print(f'{args.stages} stages')
+    counting_keys = CountingDict(stage_keys)
+    measure('dict comprehension + labels', stages, lambda stage: legacy(stage, LABELS),
+            lambda stage: legacy(stage, LABELS, counting_keys))
+    # labels are serialized once per cluster and appended to the JSON of each event by serialize()
+    measure('compiled projector', stages, stage_projector, stage_projector)
+    measure('dict comprehension + labels + json', stages, lambda stage: json.dumps(legacy(stage, LABELS)).encode())
+    measure('compiled projector + serialize', stages, lambda stage: serialize(stage_projector(stage), attributes))
+    measure('filtered projector + serialize', stages, lambda stage: filtered(filtered_projector, stage, attributes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Cold start benchmark of single-shot runs, as started from cron or a job-end hook: every run is a new
+`python src/__main__.py` process collecting once from a local fake spark driver and posting to a fake ingest
+sink. Reports the wall time from process start to exit, the CPU time and the peak RSS of every process.
+
+With --baseline REV, the src directory of that git revision is run the same way for comparison. Run from the
+repository root:
+
+    python benchmarks/bench_startup.py [--runs 20] [--apps 1] [--stages 50] [--baseline HEAD~1]
+"""
+import argparse
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+from fake_spark import FakeServers
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CONFIG = """run_as_service: False
+poll_interval: 30
+log_level: info
+log_file: {log_file}
+spark:
+  cluster_name: bench
+  driver_host: 127.0.0.1
+  conf_ui_port: {spark_port}
+  master_ui_port: <<MASTER_UI_PORT>>
+newrelic:
+  account_id: 1
+  api_key: bench
+  api_endpoint: http://127.0.0.1:{sink_port}/v1/accounts/{{account_id}}/events
+labels:
+  environment: bench
+tags: {{}}
+"""
+
+
+def extract(revision, directory):
+    """Writes the src directory of a git revision below directory and returns its path."""
+    archive = subprocess.run(['git', 'archive', revision, 'src'], cwd=ROOT, check=True, capture_output=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return os.path.join(directory, 'src')
+
+
+def run_once(src, config_dir):
+    """Runs one single-shot process and returns its wall time, CPU time and peak RSS in MB."""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(src, '__main__.py'), '-c', config_dir],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # reaped with wait4 rather than by Popen, for the resource usage of this one process
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise RuntimeError(f'{src}/__main__.py exited with status {process.returncode}')
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    rss = usage.ru_maxrss / 1024 ** 2 if sys.platform == 'darwin' else usage.ru_maxrss / 1024
+    return wall, usage.ru_utime + usage.ru_stime, rss
+
+
+def measure(name, src, config_dir, runs):
+    results = [run_once(src, config_dir) for _ in range(runs)]
+    walls, cpus, rsss = zip(*results)
+    return {'name': name, 'first_seconds': walls[0], 'wall_p50_seconds': statistics.median(walls),
+            'wall_min_seconds': min(walls), 'cpu_p50_seconds': statistics.median(cpus), 'peak_rss_mb': max(rsss)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--apps', type=int, default=1)
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--stages', type=int, default=50)
+    parser.add_argument('--executors', type=int, default=4)
+    parser.add_argument('--baseline', help='git revision whose src directory is run for comparison')
+    args = parser.parse_args()
+
+    servers = FakeServers({'apps': args.apps, 'jobs': args.jobs, 'stages': args.stages,
+                           'executors': args.executors}, {'decode': False})
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            sources = [('current', os.path.join(ROOT, 'src'))]
+            if args.baseline:
+                sources.insert(0, (args.baseline, extract(args.baseline, os.path.join(directory, 'baseline'))))
+            results = []
+            for name, src in sources:
+                # every source gets its own config directory, so that a config cache starts out empty
+                config_dir = os.path.join(directory, f'config-{len(results)}')
+                os.makedirs(config_dir)
+                with open(os.path.join(config_dir, 'config.yml'), 'w') as f:
+                    f.write(CONFIG.format(log_file=os.path.join(config_dir, 'nri-databricks.log'),
+                                          spark_port=servers.spark_port, sink_port=servers.sink_port))
+                results.append(measure(name, src, config_dir, args.runs))
+    finally:
+        servers.close()
+
+    print(f'{args.runs} single-shot runs of {args.apps} apps x {args.stages} stages x {args.executors} executors')
+    print(f'{"":<12} {"first":>10} {"p50":>10} {"min":>10} {"cpu p50":>10} {"peak RSS":>10}')
+    for result in results:
+        print(f'{result["name"]:<12} {result["first_seconds"] * 1e3:>7.1f} ms {result["wall_p50_seconds"] * 1e3:>7.1f} ms '
+              f'{result["wall_min_seconds"] * 1e3:>7.1f} ms {result["cpu_p50_seconds"] * 1e3:>7.1f} ms '
+              f'{result["peak_rss_mb"]:>7.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
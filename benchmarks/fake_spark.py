@@ -0,0 +1,225 @@
+"""
+Local stand-ins for a spark driver's REST API and the New Relic ingest APIs, used by the benchmarks.
+
+FakeSpark serves /api/v1/applications and the jobs, stages and executors of every application, either
+generated at a configurable scale or loaded from recorded fixtures, with an optional latency per request.
+advance() completes new jobs and stages as a busy cluster would between two polls.
+
+FakeSink accepts event and metric API posts and counts payloads, bytes on the wire and events. GET /stats
+returns the counters as JSON.
+
+FakeServers runs both in a separate process, so that their CPU time and memory are not attributed to the
+integration under test.
+"""
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def make_job(job_id, status):
+    return {'jobId': job_id, 'name': f'save at NativeMethodAccessorImpl.java:{job_id}',
+            'submissionTime': '2024-01-01T00:00:00.000GMT', 'completionTime': '2024-01-01T00:00:05.000GMT',
+            'stageIds': [job_id * 2, job_id * 2 + 1], 'jobGroup': f'group-{job_id}', 'status': status,
+            'numTasks': 400, 'numActiveTasks': 0, 'numCompletedTasks': 400, 'numSkippedTasks': 0,
+            'numFailedTasks': 0, 'numKilledTasks': 0, 'numCompletedIndices': 400, 'numActiveStages': 0,
+            'numCompletedStages': 2, 'numSkippedStages': 0, 'numFailedStages': 0, 'killedTasksSummary': {}}
+
+
+def make_stage(stage_id, status):
+    return {'status': status, 'stageId': stage_id, 'attemptId': 0, 'numTasks': 200, 'numActiveTasks': 0,
+            'numCompleteTasks': 200, 'numFailedTasks': 0, 'numKilledTasks': 0, 'numCompletedIndices': 200,
+            'submissionTime': '2024-01-01T00:00:00.000GMT', 'firstTaskLaunchedTime': '2024-01-01T00:00:00.010GMT',
+            'completionTime': '2024-01-01T00:00:05.000GMT', 'executorDeserializeTime': 1200,
+            'executorDeserializeCpuTime': 900000000, 'executorRunTime': 48000 + stage_id % 1000,
+            'executorCpuTime': 41000000000, 'resultSize': 480000, 'jvmGcTime': 320, 'resultSerializationTime': 12,
+            'memoryBytesSpilled': 0, 'diskBytesSpilled': 0, 'peakExecutionMemory': 0, 'inputBytes': 134217728,
+            'inputRecords': 1000000, 'outputBytes': 0, 'outputRecords': 0, 'shuffleReadBytes': 0,
+            'shuffleReadRecords': 0, 'shuffleWriteBytes': 52428800, 'shuffleWriteTime': 81000000,
+            'shuffleWriteRecords': 1000000, 'name': f'save at NativeMethodAccessorImpl.java:{stage_id}',
+            'description': f'Job group for statement {stage_id}',
+            'details': 'org.apache.spark.sql.Dataset.save(Dataset.scala:1)\n' * 8, 'schedulingPool': 'default',
+            'rddIds': [stage_id * 3, stage_id * 3 + 1, stage_id * 3 + 2], 'accumulatorUpdates': [],
+            'killedTasksSummary': {}, 'resourceProfileId': 0}
+
+
+def make_executor(executor_id):
+    return {'id': executor_id, 'hostPort': f'10.0.0.{len(executor_id)}:40000', 'isActive': True, 'rddBlocks': 0,
+            'memoryUsed': 1024 * 1024, 'diskUsed': 0, 'totalCores': 8, 'maxTasks': 8, 'activeTasks': 4,
+            'failedTasks': 0, 'completedTasks': 1000, 'totalTasks': 1004, 'totalDuration': 3600000,
+            'totalGCTime': 12000, 'totalInputBytes': 10 ** 10, 'totalShuffleRead': 10 ** 9,
+            'totalShuffleWrite': 10 ** 9, 'isBlacklisted': False, 'maxMemory': 8 * 1024 ** 3,
+            'addTime': '2024-01-01T00:00:00.000GMT', 'executorLogs': {}, 'blacklistedInStages': [],
+            'memoryMetrics': {'usedOnHeapStorageMemory': 1024, 'usedOffHeapStorageMemory': 0,
+                              'totalOnHeapStorageMemory': 4 * 1024 ** 3, 'totalOffHeapStorageMemory': 0}}
+
+
+class FakeSpark:
+    def __init__(self, apps=1, jobs=100, stages=200, executors=10, running=2, latency=0.0, fixtures=None):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.apps = {}
+        if fixtures:
+            with open(os.path.join(fixtures, 'applications.json')) as f:
+                applications = json.load(f)
+            recorded = {}
+            for kind in ('jobs', 'stages', 'executors'):
+                with open(os.path.join(fixtures, f'{kind}.json')) as f:
+                    recorded[kind] = json.load(f)
+            for application in applications:
+                self.apps[application['id']] = {kind: list(items) for kind, items in recorded.items()}
+            return
+        for app in range(apps):
+            # spark lists jobs and stages with the newest first
+            self.apps[f'app-20240101000000-{app:04d}'] = {
+                'jobs': [make_job(job_id, 'RUNNING' if job_id >= jobs - running else 'SUCCEEDED')
+                         for job_id in range(jobs - 1, -1, -1)],
+                'stages': [make_stage(stage_id, 'ACTIVE' if stage_id >= stages - running else 'COMPLETE')
+                           for stage_id in range(stages - 1, -1, -1)],
+                'executors': [make_executor('driver')] + [make_executor(str(executor_id))
+                                                          for executor_id in range(1, executors)],
+            }
+
+    def advance(self, jobs=1, stages=2):
+        """Completes the running jobs and active stages and starts new ones, for every application."""
+        with self.lock:
+            for app in self.apps.values():
+                for kind, count, make, open_status, done_status, key in (
+                        ('jobs', jobs, make_job, 'RUNNING', 'SUCCEEDED', 'jobId'),
+                        ('stages', stages, make_stage, 'ACTIVE', 'COMPLETE', 'stageId')):
+                    items = app[kind]
+                    for item in items:
+                        if item['status'] == open_status:
+                            item['status'] = done_status
+                    next_id = items[0][key] + 1 if items else 0
+                    app[kind] = [make(next_id + i, open_status) for i in range(count - 1, -1, -1)] + items
+                for executor in app['executors']:
+                    executor['totalDuration'] += 1000
+                    executor['completedTasks'] += 10
+
+    def handler(self):
+        spark = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if spark.latency:
+                    time.sleep(spark.latency)
+                url = urlparse(self.path)
+                parts = url.path.strip('/').split('/')
+                with spark.lock:
+                    if parts[:3] == ['api', 'v1', 'applications'] and len(parts) == 3:
+                        body = [{'id': app_id, 'name': app_id} for app_id in spark.apps]
+                    elif len(parts) == 5 and parts[3] in spark.apps and parts[4] in ('jobs', 'stages', 'executors'):
+                        body = spark.apps[parts[3]][parts[4]]
+                        statuses = {status.upper() for status in parse_qs(url.query).get('status', ())}
+                        if statuses:
+                            body = [item for item in body if item.get('status') in statuses]
+                    else:
+                        body = None
+                    data = json.dumps(body).encode() if body is not None else b''
+                self.send_response(200 if body is not None else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+class FakeSink:
+    def __init__(self, decode=True):
+        self.decode = decode
+        self.lock = threading.Lock()
+        self.stats = {'payloads': 0, 'bytes': 0, 'events': 0, 'metrics': 0}
+
+    def handler(self):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                payload = self.rfile.read(int(self.headers['Content-Length']))
+                metrics = self.path.startswith('/metric')
+                count = 0
+                if sink.decode:
+                    body = json.loads(gzip.decompress(payload))
+                    count = sum(len(block['metrics']) for block in body) if metrics else len(body)
+                with sink.lock:
+                    sink.stats['payloads'] += 1
+                    sink.stats['bytes'] += len(payload)
+                    sink.stats['metrics' if metrics else 'events'] += count
+                self.send_response(202 if metrics else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                with sink.lock:
+                    data = json.dumps(sink.stats).encode()
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # the integration closes streamed listings early once it has read what it needs
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def _serve(connection, spark_options, sink_options):
+    spark = FakeSpark(**spark_options)
+    sink = FakeSink(**sink_options)
+    servers = []
+    for fake in (spark, sink):
+        server = _Server(('127.0.0.1', 0), fake.handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    connection.send((servers[0].server_address[1], servers[1].server_address[1]))
+    # commands from the benchmark: ('advance', kwargs) or ('stop', None)
+    while True:
+        command, arguments = connection.recv()
+        if command == 'advance':
+            spark.advance(**arguments)
+            connection.send(True)
+        else:
+            break
+
+
+class FakeServers:
+    """Runs a FakeSpark and a FakeSink in a child process. spark_port and sink_port are set once started."""
+
+    def __init__(self, spark_options=None, sink_options=None):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve, args=(child, spark_options or {}, sink_options or {}),
+                                               daemon=True)
+        self.process.start()
+        self.spark_port, self.sink_port = self.connection.recv()
+
+    def advance(self, **arguments):
+        self.connection.send(('advance', arguments))
+        self.connection.recv()
+
+    def close(self):
+        self.connection.send(('stop', None))
+        self.process.join(5)
@@ -88,6 +88,9 @@ newrelic:
   api_endpoint: \$NEWRELIC_ENDPOINT_REGION
   account_id: \$NEWRELIC_ACCOUNT_ID
   api_key: \$NEWRELIC_LICENSE_KEY
+spool:
+  dir: /tmp/nri-databricks-spool
+  max_bytes: 104857600
 labels:
   environment: prod
 tags: \$NEWRELIC_TAGS
@@ -3,17 +3,16 @@ import getopt
 import logging
 import logging.handlers
 import os
+import signal
 import sys
 
-from apscheduler.executors.pool import ThreadPoolExecutor
-from apscheduler.jobstores.memory import MemoryJobStore
-from apscheduler.schedulers.background import BlockingScheduler
-from pytz import utc
-from yaml import Loader, load
-
+from configfile import load_config
 from integration import Integration
 
-# Configure root logging
+# The scheduler, pytz and the YAML parser are only imported where they are needed, so that single-shot
+# runs from job hooks start quickly
+
+# Configure root logging, for the service and the backfill
 def setup_root_logger():
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.DEBUG)
@@ -26,18 +25,22 @@ def setup_root_logger():
     formatter = logging.Formatter('%(asctime)s %(levelname)-8s %(message)s')
     handler.setFormatter(formatter)
     root_logger.addHandler(handler)
-
-setup_root_logger()
-logging.debug('Starting nri-databricks...')
+    logging.debug('Starting nri-databricks...')
 
 config_dir = None
+backfill = False
+once = False
 argv = sys.argv[1:]
 print(f'using program arguments {argv}')
 try:
-    opts, args = getopt.getopt(argv, 'c:', ['config_dir='])
+    opts, args = getopt.getopt(argv, 'c:bo', ['config_dir=', 'backfill', 'once'])
     for opt, arg in opts:
         if opt in ('-c', '--config_dir'):
             config_dir = arg
+        elif opt in ('-b', '--backfill'):
+            backfill = True
+        elif opt in ('-o', '--once'):
+            once = True
 
 except getopt.GetoptError as e:
     sys.exit(f'error parsing command line options: {e}')
@@ -54,10 +57,11 @@ if not os.path.exists(config_file):
 
 
 def main():
-    with open(config_file) as stream:
-        config = load(stream, Loader=Loader)
+    config = load_config(config_file)
 
-    run_as_service = config.get('run_as_service', False)
+    run_as_service = config.get('run_as_service', False) and not once
+    if run_as_service or backfill:
+        setup_root_logger()
 
     logger = logging.getLogger('nri-databricks')
     log_level = config.get('log_level', 'info')
@@ -86,17 +90,33 @@ def main():
     logger.addHandler(handler)
 
     try:
-        if not run_as_service:
+        if backfill:
+            from backfill import run_backfill
+            run_backfill(config)
+        elif not run_as_service:
             integration = Integration(config)
-            integration.run()
+            ok = integration.run_once(config.get('deadline', config.get('poll_interval', 30)))
+            # collection requests still running after the deadline would hold up the interpreter's exit
+            logging.shutdown()
+            os._exit(0 if ok else 1)
         else:
+            from apscheduler.executors.pool import ThreadPoolExecutor
+            from apscheduler.jobstores.memory import MemoryJobStore
+            from apscheduler.schedulers.background import BlockingScheduler
+            from pytz import utc
+
+            from scheduling import AdaptivePoller, FixedPoller
+
             poll_interval = config.get('poll_interval', 30)  # default to 30 seconds if not specified
+            polling_config = config.get('polling') or {}
             integration = Integration(config)
             jobstores = {
                 'default': MemoryJobStore(),
             }
+            # polls do not overlap in adaptive mode, at most max_instances of them do in fixed mode; the
+            # collection itself runs on the integration's own worker pool
             executors = {
-                'default': ThreadPoolExecutor(20),
+                'default': ThreadPoolExecutor(config.get('scheduler_workers', 3)),
             }
             job_defaults = {
                 'coalesce': False,
@@ -104,12 +124,26 @@ def main():
             }
             scheduler = BlockingScheduler(jobstores=jobstores, executors=executors, job_defaults=job_defaults, timezone=utc)
             logging.info("Adding integration job to scheduler")
-            scheduler.add_job(integration.run, trigger='interval', seconds=poll_interval)
+            if polling_config.get('mode', 'fixed') == 'adaptive':
+                AdaptivePoller(scheduler, integration,
+                               min_interval=polling_config.get('min_interval', 5),
+                               max_interval=polling_config.get('max_interval', poll_interval * 10),
+                               backoff=polling_config.get('backoff', 2)).start()
+            else:
+                FixedPoller(scheduler, integration, poll_interval).start()
+            # nrdatabricksd stops the service with SIGTERM, exit through the finally block so that
+            # undelivered events are spooled
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
             logging.info("Starting scheduler")
-            scheduler.start()
-            print('Press Ctrl+{0} to exit'.format('Break' if os.name == 'nt' else 'C'))
+            try:
+                scheduler.start()
+                print('Press Ctrl+{0} to exit'.format('Break' if os.name == 'nt' else 'C'))
+            finally:
+                logging.info("Stopping integration")
+                integration.close(timeout=5)
     except Exception as e:
         logging.exception("Error occurred while executing the main function: %s", e)
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
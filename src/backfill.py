@@ -0,0 +1,624 @@
+import concurrent.futures
+import gzip
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+import zlib
+from datetime import datetime, timezone
+
+try:
+    import zstandard
+except ImportError:  # optional, zstd compressed event logs are skipped without it
+    zstandard = None
+
+from integration import Integration
+from newrelic import NewRelicApiException
+from streaming import COMPRESSED_SUFFIXES, DEFAULT_EVENT_LOG_DIR
+from telemetry import telemetry
+
+logger = logging.getLogger('nri-databricks')
+
+DEFAULT_CHECKPOINT_DIR = '/tmp/nri-databricks-backfill'
+
+# leading bytes of a file that recognize it after it was renamed or compressed when the log was rolled
+FINGERPRINT_BYTES = 64 * 1024
+
+# lines replayed between two checkpoints within a file
+CHECKPOINT_LINES = 100000
+
+SKIP_SIZE = 1024 * 1024
+
+INPROGRESS_SUFFIX = '.inprogress'
+
+EVENT_PREFIX = b'{"Event":"'
+
+# task metrics summed into the stage's REST fields
+stage_task_metrics = (('executorRunTime', ('Executor Run Time',)),
+                      ('executorCpuTime', ('Executor CPU Time',)),
+                      ('inputBytes', ('Input Metrics', 'Bytes Read')),
+                      ('inputRecords', ('Input Metrics', 'Records Read')),
+                      ('outputBytes', ('Output Metrics', 'Bytes Written')),
+                      ('outputRecords', ('Output Metrics', 'Records Written')),
+                      ('shuffleReadBytes', ('Shuffle Read Metrics', 'Remote Bytes Read')),
+                      ('shuffleReadBytes', ('Shuffle Read Metrics', 'Local Bytes Read')),
+                      ('shuffleReadRecords', ('Shuffle Read Metrics', 'Total Records Read')),
+                      ('shuffleWriteBytes', ('Shuffle Write Metrics', 'Shuffle Bytes Written')),
+                      ('shuffleWriteRecords', ('Shuffle Write Metrics', 'Shuffle Records Written')),
+                      ('memoryBytesSpilled', ('Memory Bytes Spilled',)),
+                      ('diskBytesSpilled', ('Disk Bytes Spilled',)))
+
+# task metrics summed into the executor's REST fields
+executor_task_metrics = (('totalGCTime', ('JVM GC Time',)),
+                         ('totalInputBytes', ('Input Metrics', 'Bytes Read')),
+                         ('totalShuffleRead', ('Shuffle Read Metrics', 'Remote Bytes Read')),
+                         ('totalShuffleRead', ('Shuffle Read Metrics', 'Local Bytes Read')),
+                         ('totalShuffleWrite', ('Shuffle Write Metrics', 'Shuffle Bytes Written')))
+
+
+def rest_time(millis):
+    """Formats epoch milliseconds like the spark REST API, e.g. 2024-01-01T00:00:00.000GMT."""
+    if millis is None:
+        return None
+    return datetime.fromtimestamp(millis // 1000, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.') + f'{millis % 1000:03d}GMT'
+
+
+def _metric(metrics, path):
+    for key in path:
+        metrics = metrics.get(key) if isinstance(metrics, dict) else None
+    return metrics if isinstance(metrics, (int, float)) else 0
+
+
+def _set(entity, key, value):
+    if value is not None:
+        entity[key] = value
+
+
+class EventLogReplay:
+    """
+    Rebuilds the jobs, stages and executors of the spark REST API from the listener events of an event log,
+    as they were when they ended, and passes every one to emit(kind, entity, timestamp, app_id) with kind
+    'jobs', 'stages' or 'executors' and timestamp the epoch milliseconds of its end. Stage and executor totals
+    are summed from the task end events. Only entities that have not ended are kept, in a plain dict that
+    can be checkpointed and passed back in to continue the replay with the next line.
+    """
+
+    def __init__(self, emit, state=None):
+        self.emit = emit
+        self.state = state or {'appId': None, 'ended': False, 'jobs': {}, 'stages': {}, 'stageJobs': {},
+                               'executors': {}}
+        self._handlers = {b'SparkListenerApplicationStart': self.application_start,
+                          b'SparkListenerApplicationEnd': self.application_end,
+                          b'SparkListenerJobStart': self.job_start,
+                          b'SparkListenerJobEnd': self.job_end,
+                          b'SparkListenerStageSubmitted': self.stage_submitted,
+                          b'SparkListenerStageCompleted': self.stage_completed,
+                          b'SparkListenerTaskEnd': self.task_end,
+                          b'SparkListenerExecutorAdded': self.executor_added,
+                          b'SparkListenerExecutorRemoved': self.executor_removed,
+                          b'SparkListenerBlockManagerAdded': self.block_manager_added}
+
+    def feed(self, line):
+        # spark writes the event name first, which spares parsing the many events that are not replayed
+        if not line.startswith(EVENT_PREFIX):
+            return
+        handler = self._handlers.get(line[len(EVENT_PREFIX):line.find(b'"', len(EVENT_PREFIX))])
+        if handler is None:
+            return
+        try:
+            handler(json.loads(line))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            logger.warning(f'ignoring malformed {handler.__name__} event of app {self.state["appId"]}')
+
+    def _emit(self, kind, entity, timestamp):
+        self.emit(kind, entity, timestamp, self.state['appId'])
+
+    def application_start(self, event):
+        self.state['appId'] = event.get('App ID')
+
+    def application_end(self, event):
+        for executor in self.state['executors'].values():
+            executor['isActive'] = False
+            self._emit('executors', executor, event.get('Timestamp'))
+        # jobs and stages still open at the end of the application never complete
+        for key in ('jobs', 'stages', 'stageJobs', 'executors'):
+            self.state[key] = {}
+        self.state['ended'] = True
+
+    def job_start(self, event):
+        infos = event.get('Stage Infos') or []
+        stages = {str(info['Stage ID']): [info.get('Stage Name'), info.get('Number of Tasks', 0)] for info in infos}
+        job = {'jobId': event['Job ID'], 'numTasks': sum(tasks for _, tasks in stages.values()),
+               'numActiveTasks': 0, 'numCompletedTasks': 0, 'numSkippedTasks': 0, 'numFailedTasks': 0,
+               'numKilledTasks': 0, 'numCompletedIndices': 0, 'numActiveStages': 0, 'numCompletedStages': 0,
+               'numSkippedStages': 0, 'numFailedStages': 0, 'stages': stages, 'submitted': []}
+        # spark names a job after its last stage
+        if infos:
+            _set(job, 'name', max(infos, key=lambda info: info['Stage ID']).get('Stage Name'))
+        _set(job, 'submissionTime', rest_time(event.get('Submission Time')))
+        _set(job, 'jobGroup', (event.get('Properties') or {}).get('spark.jobGroup.id'))
+        self.state['jobs'][str(job['jobId'])] = job
+        for stage_id in stages:
+            self.state['stageJobs'].setdefault(stage_id, []).append(job['jobId'])
+
+    def job_end(self, event):
+        job = self.state['jobs'].pop(str(event['Job ID']), None)
+        if job is None:
+            return
+        stages = job.pop('stages')
+        submitted = set(job.pop('submitted'))
+        completion_time = event.get('Completion Time')
+        job['status'] = 'SUCCEEDED' if (event.get('Job Result') or {}).get('Result') == 'JobSucceeded' else 'FAILED'
+        _set(job, 'completionTime', rest_time(completion_time))
+        for stage_id, (name, tasks) in stages.items():
+            jobs = self.state['stageJobs'].get(stage_id)
+            if jobs is not None:
+                jobs.remove(job['jobId'])
+                if not jobs:
+                    del self.state['stageJobs'][stage_id]
+            if stage_id not in submitted:
+                job['numSkippedStages'] += 1
+                job['numSkippedTasks'] += tasks
+                stage = {'stageId': int(stage_id), 'attemptId': 0, 'status': 'SKIPPED', 'numTasks': tasks}
+                _set(stage, 'name', name)
+                self._emit('stages', stage, completion_time)
+        self._emit('jobs', job, completion_time)
+
+    def _new_stage(self, info, properties):
+        stage = {'stageId': info['Stage ID'], 'attemptId': info.get('Stage Attempt ID', 0), 'status': 'ACTIVE',
+                 'numTasks': info.get('Number of Tasks', 0),
+                 'schedulingPool': (properties or {}).get('spark.scheduler.pool', 'default'),
+                 'numActiveTasks': 0, 'numCompleteTasks': 0, 'numFailedTasks': 0, 'numKilledTasks': 0,
+                 'numCompletedIndices': 0, 'firstTaskLaunchedTime': None}
+        _set(stage, 'name', info.get('Stage Name'))
+        _set(stage, 'submissionTime', rest_time(info.get('Submission Time')))
+        for name, _ in stage_task_metrics:
+            stage[name] = 0
+        return stage
+
+    def stage_submitted(self, event):
+        info = event['Stage Info']
+        stage = self._new_stage(info, event.get('Properties'))
+        self.state['stages'][f'{stage["stageId"]}.{stage["attemptId"]}'] = stage
+        stage_id = str(stage['stageId'])
+        for job_id in self.state['stageJobs'].get(stage_id, ()):
+            job = self.state['jobs'][str(job_id)]
+            if stage_id not in job['submitted']:
+                job['submitted'].append(stage_id)
+
+    def stage_completed(self, event):
+        info = event['Stage Info']
+        stage = self.state['stages'].pop(f'{info["Stage ID"]}.{info.get("Stage Attempt ID", 0)}', None)
+        if stage is None:
+            stage = self._new_stage(info, None)
+        failed = 'Failure Reason' in info
+        stage['status'] = 'FAILED' if failed else 'COMPLETE'
+        stage['firstTaskLaunchedTime'] = rest_time(stage['firstTaskLaunchedTime'])
+        if stage['firstTaskLaunchedTime'] is None:
+            del stage['firstTaskLaunchedTime']
+        _set(stage, 'completionTime', rest_time(info.get('Completion Time')))
+        _set(stage, 'failureReason', info.get('Failure Reason'))
+        for job_id in self.state['stageJobs'].get(str(stage['stageId']), ()):
+            self.state['jobs'][str(job_id)]['numFailedStages' if failed else 'numCompletedStages'] += 1
+        self._emit('stages', stage, info.get('Completion Time'))
+
+    def task_end(self, event):
+        info = event.get('Task Info') or {}
+        metrics = event.get('Task Metrics') or {}
+        if info.get('Killed'):
+            outcome = 'Killed'
+        elif info.get('Failed'):
+            outcome = 'Failed'
+        else:
+            outcome = 'Completed'
+
+        stage = self.state['stages'].get(f'{event.get("Stage ID")}.{event.get("Stage Attempt ID", 0)}')
+        if stage is not None:
+            stage['numCompleteTasks' if outcome == 'Completed' else f'num{outcome}Tasks'] += 1
+            if outcome == 'Completed':
+                stage['numCompletedIndices'] += 1
+            launch_time = info.get('Launch Time')
+            if launch_time and (stage['firstTaskLaunchedTime'] is None or launch_time < stage['firstTaskLaunchedTime']):
+                stage['firstTaskLaunchedTime'] = launch_time
+            for name, path in stage_task_metrics:
+                stage[name] += _metric(metrics, path)
+
+        for job_id in self.state['stageJobs'].get(str(event.get('Stage ID')), ()):
+            job = self.state['jobs'][str(job_id)]
+            job[f'num{outcome}Tasks'] += 1
+            if outcome == 'Completed':
+                job['numCompletedIndices'] += 1
+
+        executor_id = info.get('Executor ID')
+        if executor_id is not None:
+            executor = self._executor(executor_id)
+            executor['totalTasks'] += 1
+            if outcome == 'Completed':
+                executor['completedTasks'] += 1
+            elif outcome == 'Failed':
+                executor['failedTasks'] += 1
+            if info.get('Launch Time') and info.get('Finish Time'):
+                executor['totalDuration'] += info['Finish Time'] - info['Launch Time']
+            for name, path in executor_task_metrics:
+                executor[name] += _metric(metrics, path)
+
+    def _executor(self, executor_id):
+        executor = self.state['executors'].get(executor_id)
+        if executor is None:
+            executor = self.state['executors'][executor_id] = {
+                'id': executor_id, 'isActive': True, 'failedTasks': 0, 'completedTasks': 0, 'totalTasks': 0,
+                'totalDuration': 0, 'totalGCTime': 0, 'totalInputBytes': 0, 'totalShuffleRead': 0,
+                'totalShuffleWrite': 0}
+        return executor
+
+    def executor_added(self, event):
+        executor = self._executor(event['Executor ID'])
+        info = event.get('Executor Info') or {}
+        _set(executor, 'totalCores', info.get('Total Cores'))
+        _set(executor, 'maxTasks', info.get('Total Cores'))
+        _set(executor, 'addTime', rest_time(event.get('Timestamp')))
+
+    def block_manager_added(self, event):
+        block_manager = event.get('Block Manager ID') or {}
+        if block_manager.get('Executor ID') is None:
+            return
+        executor = self._executor(block_manager['Executor ID'])
+        executor['hostPort'] = f'{block_manager.get("Host")}:{block_manager.get("Port")}'
+        _set(executor, 'maxMemory', event.get('Maximum Memory'))
+        if 'addTime' not in executor:
+            _set(executor, 'addTime', rest_time(event.get('Timestamp')))
+        memory_metrics = {}
+        _set(memory_metrics, 'totalOnHeapStorageMemory', event.get('Maximum Onheap Memory'))
+        _set(memory_metrics, 'totalOffHeapStorageMemory', event.get('Maximum Offheap Memory'))
+        if memory_metrics:
+            executor['memoryMetrics'] = memory_metrics
+
+    def executor_removed(self, event):
+        executor = self.state['executors'].pop(event['Executor ID'], None)
+        if executor is not None:
+            executor['isActive'] = False
+            self._emit('executors', executor, event.get('Timestamp'))
+
+
+def open_event_log(path):
+    """Opens an event log for reading its decompressed bytes, or returns None if its codec is not supported."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith(('.zstd', '.zst')):
+        if zstandard is None:
+            logger.warning(f'skipping {path}, reading zstd compressed event logs requires the zstandard package')
+            return None
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+        return io.BufferedReader(reader)
+    if path.endswith(COMPRESSED_SUFFIXES):
+        # spark writes lz4, lzf and snappy with the block formats of its JVM codec libraries
+        logger.warning(f'skipping {path}, event logs compressed with {os.path.splitext(path)[1]} are not supported')
+        return None
+    return open(path, 'rb')
+
+
+def _natural(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+class LogGroup:
+    """
+    The event log files of one spark application, or of one spark context on databricks, in the order they
+    were written. The rolled files of a log come first, and a file whose name is the prefix of the others,
+    like the eventlog next to eventlog-2024-01-01--00-00.gz, is the one still being written.
+    """
+
+    def __init__(self, key, directory, names):
+        self.key = key
+        self.directory = directory
+        self.names = sorted(names, key=lambda name: (any(other != name and other.startswith(name) for other in names),
+                                                     _natural(name)))
+
+    def __str__(self):
+        return self.key
+
+    @property
+    def size(self):
+        return sum(os.path.getsize(path) for path in self.paths() if os.path.exists(path))
+
+    @property
+    def mtime(self):
+        return max((os.path.getmtime(path) for path in self.paths() if os.path.exists(path)), default=0)
+
+    def paths(self):
+        return [os.path.join(self.directory, name) for name in self.names]
+
+    @property
+    def in_progress(self):
+        """
+        Whether spark is still writing the log: a file with the .inprogress suffix, or a rolling log directory
+        with an in-progress appstatus file. The eventlog of a databricks spark context can not be told apart.
+        """
+        if len(self.names) == 1 and self.names[0].endswith(INPROGRESS_SUFFIX):
+            return True
+        if os.path.basename(self.directory).startswith('eventlog_v2_'):
+            try:
+                return any(name.startswith('appstatus') and name.endswith(INPROGRESS_SUFFIX)
+                           for name in os.listdir(self.directory))
+            except OSError:
+                return False
+        return False
+
+
+def find_groups(directory):
+    """
+    Returns the event logs below directory. A databricks directory holding an eventlog file and a spark
+    rolling log directory (eventlog_v2_<app id>) are one log each; every other file is the log of one
+    application, known by its name without the .inprogress suffix spark removes once the application ends.
+    """
+    groups = []
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        names = [name for name in names if not name.startswith(('appstatus', '.'))]
+        if not names:
+            continue
+        if 'eventlog' in names or os.path.basename(root).startswith('eventlog_v2_'):
+            groups.append(LogGroup(root, root, names))
+            continue
+        for name in sorted(names):
+            key = os.path.join(root, name[:-len(INPROGRESS_SUFFIX)] if name.endswith(INPROGRESS_SUFFIX) else name)
+            groups.append(LogGroup(key, root, [name]))
+    return groups
+
+
+class Backfill:
+    """
+    Replays event log groups through the integration's projectors and event batcher, so that the events are
+    filtered, batched and posted like collected ones, timestamped with the end of the job, stage or executor
+    and tagged with their appId.
+
+    The replay of every group is checkpointed in checkpoint_dir: the byte offset of the decompressed lines
+    replayed from each file, the leading bytes of the file to recognize it when it is renamed or compressed
+    as the log is rolled, and the jobs, stages and executors that have not ended. A later run continues
+    where the previous one stopped, also with the lines appended since to logs that are still written.
+    Jobs, stages and executors that ended at or after until (epoch milliseconds) are left to the live
+    collection and not posted. A checkpoint is only written once the sender delivered or spooled every event up to it; the replay of a
+    group whose events could not be delivered stops at its last checkpoint.
+    """
+
+    def __init__(self, integration, checkpoint_dir=DEFAULT_CHECKPOINT_DIR, until=None):
+        self.integration = integration
+        self.checkpoint_dir = checkpoint_dir
+        self.until = until
+        self.projectors = {'jobs': integration.job_projector, 'stages': integration.stage_projector,
+                           'executors': integration.executor_projector}
+        self.events = 0
+
+    def run(self, groups):
+        """Replays the groups and returns the number of events posted."""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        # the events are tagged with the driver host of the spark section
+        for cluster in self.integration.clusters:
+            cluster.resolve()
+        for group in groups:
+            try:
+                self.replay(group)
+            except (OSError, NewRelicApiException):
+                logger.exception(f'error replaying event log {group}')
+        self.integration.batcher.flush()
+        return self.events
+
+    def emit(self, kind, entity, timestamp, app_id):
+        if self.until is not None and timestamp and timestamp >= self.until:
+            telemetry.increment('backfill_events_skipped', kind)
+            return
+        projector = self.projectors[kind]
+        nr_event = projector(entity)
+        if nr_event is None:
+            telemetry.increment('events_filtered', projector.event_type)
+            return
+        if timestamp:
+            nr_event['timestamp'] = timestamp
+        if app_id:
+            nr_event['appId'] = app_id
+        self.integration.batcher.add(nr_event, self.integration.attributes)
+        self.events += 1
+
+    def checkpoint_path(self, group):
+        return os.path.join(self.checkpoint_dir, hashlib.sha1(group.key.encode()).hexdigest()[:16] + '.json')
+
+    def load_checkpoint(self, group):
+        try:
+            with open(self.checkpoint_path(group)) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return {'group': group.key, 'files': {}, 'state': None}
+        except (OSError, ValueError):
+            logger.exception(f'ignoring unreadable checkpoint of event log {group}')
+            return {'group': group.key, 'files': {}, 'state': None}
+        return checkpoint
+
+    def save_checkpoint(self, group, checkpoint):
+        # the events up to the checkpoint are delivered before it is written
+        self.integration.batcher.flush()
+        if not self.integration.sender.drain():
+            raise NewRelicApiException(f'events of event log {group} were not delivered, '
+                                       f'keeping its previous checkpoint')
+        path = self.checkpoint_path(group)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(f'{path}.tmp', path)
+
+    def replay(self, group):
+        checkpoint = self.load_checkpoint(group)
+        previous = checkpoint['files']
+        files = {}
+        replay = EventLogReplay(self.emit, checkpoint['state'])
+        heads = {}
+        for name in group.names:
+            path = os.path.join(group.directory, name)
+            entry = previous.get(name)
+            if entry is not None and entry.get('complete') and entry.get('size') == _size(path):
+                # rolled, compressed files do not change once they are complete
+                files[name] = entry
+                continue
+            f = open_event_log(path)
+            if f is not None:
+                with f:
+                    heads[name] = f.read(FINGERPRINT_BYTES)
+
+        # a file continues the entry of the same name, or otherwise that of a file that was renamed
+        matched = {}
+        orphans = [old for old in previous if old not in files]
+        for name, head in heads.items():
+            entry = previous.get(name)
+            if entry is not None and _matches(entry, head):
+                matched[name] = entry
+                orphans.remove(name)
+        for name, head in heads.items():
+            if name in matched:
+                continue
+            for old in orphans:
+                if _matches(previous[old], head):
+                    logger.info(f'continuing {old} of event log {group} in {name}')
+                    matched[name] = previous[old]
+                    orphans.remove(old)
+                    break
+
+        checkpoint = {'group': group.key, 'files': files, 'state': replay.state}
+        for name in group.names:
+            if name in heads:
+                entry = matched.get(name) or {'offset': 0}
+                self.replay_file(group, name, heads[name], entry['offset'], replay, checkpoint)
+        self.save_checkpoint(group, checkpoint)
+
+    def replay_file(self, group, name, head, offset, replay, checkpoint):
+        path = os.path.join(group.directory, name)
+        compressed = path.endswith(COMPRESSED_SUFFIXES)
+        size = _size(path)
+        start = offset
+        f = open_event_log(path)
+        if f is None:
+            return
+        with f:
+            if not compressed:
+                f.seek(offset)
+            else:
+                _skip(f, offset)
+            lines = 0
+            for line in f:
+                if not line.endswith(b'\n') and not compressed:
+                    # the rest of this line has not been written yet
+                    break
+                offset += len(line)
+                replay.feed(line)
+                lines += 1
+                if lines % CHECKPOINT_LINES == 0:
+                    checkpoint['files'][name] = _entry(head, offset)
+                    self.save_checkpoint(group, checkpoint)
+        entry = _entry(head, offset)
+        if compressed:
+            entry.update(complete=True, size=size)
+        checkpoint['files'][name] = entry
+        if offset > start:
+            logger.info(f'replayed {offset - start} bytes of {path}, {self.events} events so far')
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def _entry(head, offset):
+    length = min(offset, len(head))
+    return {'offset': offset, 'length': length, 'crc': zlib.crc32(head[:length])}
+
+
+def _matches(entry, head):
+    length = entry.get('length', 0)
+    return 0 < length <= len(head) and zlib.crc32(head[:length]) == entry.get('crc')
+
+
+def _skip(f, offset):
+    while offset > 0:
+        data = f.read(min(offset, SKIP_SIZE))
+        if not data:
+            break
+        offset -= len(data)
+
+
+def parse_until(value):
+    """Returns the backfill until setting, an ISO 8601 time or epoch seconds, in epoch milliseconds."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError(f'backfill until is not an ISO 8601 time: {value!r}') from None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp() * 1000)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value * 1000)
+    raise ValueError(f'backfill until must be an ISO 8601 time or epoch seconds: {value!r}')
+
+
+def _replay_groups(config, groups, checkpoint_dir, until=None):
+    # a full queue must hold the replay back rather than drop the events of a checkpoint
+    if 'newrelic' in config:
+        config = {**config, 'newrelic': {**config['newrelic'], 'queue_full_policy': 'block'}}
+    integration = Integration(config)
+    try:
+        return Backfill(integration, checkpoint_dir, until).run(groups)
+    finally:
+        integration.close()
+
+
+def run_backfill(config):
+    """
+    Replays the spark event logs of the backfill section's event_log_dir, with the logs spread over workers
+    processes, and returns the number of events posted. Logs of running applications are skipped unless
+    include_in_progress is set, as the live collection reports them.
+    """
+    backfill_config = config.get('backfill') or {}
+    directory = backfill_config.get('event_log_dir',
+                                    (config.get('streaming') or {}).get('event_log_dir', DEFAULT_EVENT_LOG_DIR))
+    checkpoint_dir = backfill_config.get('checkpoint_dir', DEFAULT_CHECKPOINT_DIR)
+    try:
+        until = parse_until(backfill_config.get('until'))
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(str(e))
+    groups = find_groups(directory)
+    if not backfill_config.get('include_in_progress', False):
+        running = [group for group in groups if group.in_progress]
+        if running:
+            logger.info(f'skipping {len(running)} event logs of running applications')
+            groups = [group for group in groups if not group.in_progress]
+    max_age_hours = backfill_config.get('max_age_hours')
+    if max_age_hours:
+        oldest = time.time() - max_age_hours * 3600
+        groups = [group for group in groups if group.mtime >= oldest]
+    workers = min(backfill_config.get('workers', os.cpu_count() or 1), len(groups))
+    logger.info(f'backfilling {len(groups)} event logs from {directory} with {workers} workers')
+    start = time.monotonic()
+    if workers <= 1:
+        events = _replay_groups(config, groups, checkpoint_dir, until)
+    else:
+        # the largest logs first, each to the worker with the fewest bytes so far
+        shares = [[] for _ in range(workers)]
+        loads = [0] * workers
+        for group, size in sorted(((group, group.size) for group in groups), key=lambda item: -item[1]):
+            worker = loads.index(min(loads))
+            shares[worker].append(group)
+            loads[worker] += size
+        # forked before the integration starts any threads, so that the workers inherit the logging setup
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            events = sum(pool.map(_replay_groups, [config] * workers, shares, [checkpoint_dir] * workers,
+                                  [until] * workers))
+    logger.info(f'backfilled {events} events from {len(groups)} event logs in {time.monotonic() - start:.3f}s')
+    return events
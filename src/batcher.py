@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+
+import codec
+from telemetry import telemetry
+
+logger = logging.getLogger('nri-databricks')
+
+# limits of a single New Relic event API payload
+MAX_EVENTS = 2000
+MAX_PAYLOAD_BYTES = 1000000  # compressed
+
+# room for the closing bracket, the final deflate block and the gzip trailer
+_TRAILER_BYTES = 64
+
+
+class Attributes:
+    """
+    Attributes shared by many events, such as the configured labels. They are serialized once and appended
+    to the JSON of every event they are added with, instead of being copied into each event dict.
+    """
+
+    __slots__ = 'attributes', 'fragment'
+
+    def __init__(self, attributes):
+        self.attributes = dict(attributes or {})
+        self.fragment = codec.dumps(attributes)[1:-1] if attributes else b''
+
+
+def serialize(event, attributes=None):
+    if attributes is None or not attributes.fragment:
+        return codec.dumps(event)
+    if not attributes.attributes.keys().isdisjoint(event):
+        # a label named like a field of the event, like dict.update the label takes precedence
+        return codec.dumps({**event, **attributes.attributes})
+    data = codec.dumps(event)
+    return b'%s,%s}' % (data[:-1], attributes.fragment) if len(data) > 2 else b'{%s}' % attributes.fragment
+
+
+class _Payload:
+    """A gzip compressed JSON array that is built one event at a time."""
+
+    def __init__(self, level, staging, output):
+        self.writer = codec.GzipWriter(level, staging, output)
+        self.pending_size = 0
+        self.uncompressed_size = 0
+        self.compress_seconds = 0
+        self.count = 0
+
+    def write(self, data):
+        start = time.perf_counter()
+        self.writer.write(data)
+        self.compress_seconds += time.perf_counter() - start
+        self.pending_size += len(data)
+        self.uncompressed_size += len(data)
+
+    def sync(self):
+        start = time.perf_counter()
+        self.writer.sync()
+        self.compress_seconds += time.perf_counter() - start
+        self.pending_size = 0
+
+    def upper_bound(self, extra):
+        # deflate never grows data by more than a few bytes per block, so data that is still buffered inside
+        # the writer and the compressor is bounded by its uncompressed size
+        pending = self.pending_size + extra
+        return self.writer.compressed_size + pending + pending // 1000 + _TRAILER_BYTES
+
+    def finish(self):
+        start = time.perf_counter()
+        self.writer.write(b']')
+        payload = self.writer.finish()
+        self.compress_seconds += time.perf_counter() - start
+        telemetry.record('gzip_seconds', self.compress_seconds)
+        telemetry.record('gzip_ratio', (self.uncompressed_size + 1) / len(payload))
+        telemetry.record('payload_events', self.count)
+        return payload
+
+
+class EventBatcher:
+    """
+    Buffers events of all applications and event types into payloads of at most MAX_EVENTS events and
+    MAX_PAYLOAD_BYTES compressed bytes. Events are serialized and compressed as they are added, so the size of
+    the payload is known at every point and an oversized body is never built. Full payloads are handed to
+    the flush callback together with their event count. Payloads are built one at a time in the same
+    compression buffers. filters maps event types to EventFilters applied before events are serialized.
+    """
+
+    def __init__(self, flush_callback, max_events=MAX_EVENTS, max_payload_bytes=MAX_PAYLOAD_BYTES,
+                 compression_level=codec.DEFAULT_COMPRESSION_LEVEL, filters=None):
+        self.flush_callback = flush_callback
+        self.filters = filters or {}
+        self.max_events = max_events
+        self.max_payload_bytes = max_payload_bytes
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        self._payload = None
+        self._staging = bytearray(codec.BLOCK_SIZE)
+        self._output = bytearray(codec.BLOCK_SIZE)
+
+    def add(self, event, attributes=None):
+        event_type = event.get('eventType')
+        if self.filters:
+            event_filter = self.filters.get(event_type)
+            if event_filter is not None:
+                event = event_filter.apply(event)
+                if event is None:
+                    telemetry.increment('events_filtered', event_type)
+                    return
+        data = serialize(event, attributes)
+        telemetry.increment('events', event_type)
+        with self._lock:
+            ready = self._add(data)
+        for payload, count in ready:
+            self.flush_callback(payload, count)
+
+    def add_all(self, events, attributes=None):
+        for event in events:
+            self.add(event, attributes)
+
+    def flush(self):
+        with self._lock:
+            full = self._finish()
+        if full:
+            self.flush_callback(*full)
+
+    def _add(self, data):
+        ready = []
+        payload = self._payload
+        if payload is not None and payload.upper_bound(len(data) + 1) > self.max_payload_bytes:
+            # the estimate is too coarse, get the exact compressed size before giving up on this payload
+            payload.sync()
+            if payload.upper_bound(len(data) + 1) > self.max_payload_bytes:
+                ready.append(self._finish())
+                payload = None
+
+        if payload is None:
+            if len(data) + 1 + _TRAILER_BYTES > self.max_payload_bytes and \
+                    len(codec.compress(data, self.compression_level)) + _TRAILER_BYTES > self.max_payload_bytes:
+                logger.error(f'dropping event of {len(data)} bytes exceeding the maximum payload size')
+                return ready
+            payload = self._payload = _Payload(self.compression_level, self._staging, self._output)
+            payload.write(b'[')
+        else:
+            payload.write(b',')
+        payload.write(data)
+        payload.count += 1
+
+        if payload.count >= self.max_events:
+            ready.append(self._finish())
+        return ready
+
+    def _finish(self):
+        payload = self._payload
+        if payload is None:
+            return None
+        self._payload = None
+        return payload.finish(), payload.count
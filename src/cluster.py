@@ -0,0 +1,274 @@
+import logging
+import os
+
+from batcher import Attributes
+from configfile import read_yaml
+from streaming import DEFAULT_EVENT_LOG_DIR, EventLogTail, QueryProgressBuffer
+from watermark import WatermarkStore
+
+logger = logging.getLogger('nri-databricks')
+
+CONF_PUBLIC_DNS_PLACEHOLDER = '<<CONF_PUBLIC_DNS>>'
+CONF_UI_PORT_PLACEHOLDER = '<<CONF_UI_PORT>>'
+MASTER_UI_PORT_PLACEHOLDER = '<<MASTER_UI_PORT>>'
+
+# written by the databricks driver, see install-nr.py
+DRIVER_ENV_FILE = '/tmp/driver-env.sh'
+MASTER_PARAMS_FILE = '/tmp/master-params'
+
+
+class Cluster:
+    """
+    One spark driver polled by the integration. Each cluster keeps its own endpoint, labels, watermarks and
+    executor samples, while the sessions, collector, batcher and sender are shared by all clusters.
+
+    labels are the attributes of every event of the cluster. dimensions are the part of them that tells this
+    cluster apart from the others (cluster name, driver host and per-cluster labels); they are added to the
+    metric API metrics, whose shared labels are sent once per payload.
+
+    With driver_files, endpoints configured with the install script placeholders are resolved from the
+    driver's files once and only resolved again when one of the files changes or after a request to the
+    cluster failed. The files belong to the driver the integration is installed on, so only the cluster of
+    the spark section uses them. A cluster without a master UI port runs in single node mode. The list of
+    active applications is cached for app_list_ttl seconds.
+    """
+
+    def __init__(self, cluster_name, driver_host, conf_ui_port, master_ui_port, labels, executor_samples,
+                 cluster_labels=None, app_list_ttl=60, event_log_dir=None, streaming_history=100,
+                 driver_files=False):
+        self.cluster_name = cluster_name
+        self.configured = driver_host, conf_ui_port, master_ui_port
+        self.driver_host = driver_host
+        self.spark_conf_ui_port = conf_ui_port
+        self.spark_master_ui_port = master_ui_port
+        self.needs_files = driver_files and (driver_host == CONF_PUBLIC_DNS_PLACEHOLDER or
+                                             conf_ui_port == CONF_UI_PORT_PLACEHOLDER or
+                                             master_ui_port == MASTER_UI_PORT_PLACEHOLDER)
+        self.file_mtimes = None
+        self.resolved = False
+        self.app_list_ttl = app_list_ttl
+        self.app_ids = None
+        self.app_ids_listed = 0
+        # older spark versions do not serve the taskSummary endpoint
+        self.task_summary = True
+        self.watermarks = WatermarkStore()
+        self.executor_samples = executor_samples
+        # structured streaming progress is read from the event logs of the driver
+        self.progress_tail = EventLogTail(event_log_dir) if event_log_dir else None
+        self.progress = QueryProgressBuffer(streaming_history)
+        self.set_labels(labels, cluster_labels)
+
+    def __str__(self):
+        return f'{self.cluster_name} ({self.driver_host})'
+
+    @property
+    def key(self):
+        driver_host, conf_ui_port, _ = self.configured
+        return driver_host, str(conf_ui_port)
+
+    @property
+    def multi_node(self):
+        return self.spark_master_ui_port not in (None, MASTER_UI_PORT_PLACEHOLDER)
+
+    @property
+    def conf_ui_url(self):
+        return f'http://{self.driver_host}:{self.spark_conf_ui_port}'
+
+    def set_labels(self, labels, cluster_labels=None):
+        self.base_labels = labels
+        self.cluster_labels = cluster_labels
+        self.dimensions = dict(cluster_labels or {})
+        self.dimensions['driverHost'] = self.driver_host
+        self.dimensions['clusterName'] = self.cluster_name
+        self.labels = {**labels, **self.dimensions}
+        self.attributes = Attributes(self.labels)
+
+    def cached_app_ids(self, now):
+        """Returns the cached active application ids, or None if they have to be listed again."""
+        if self.app_ids is not None and now - self.app_ids_listed < self.app_list_ttl:
+            return self.app_ids
+        return None
+
+    def cache_app_ids(self, app_ids, now):
+        self.app_ids = app_ids
+        self.app_ids_listed = now
+
+    def invalidate(self):
+        """Called after a failed request: the endpoint is resolved and the applications are listed again."""
+        self.resolved = False
+        self.app_ids = None
+
+    def resolve(self):
+        """
+        Replaces the install script placeholders of the endpoint with the values of the driver's files. The
+        files are only read on the first call, after invalidate() and when their modification time changed.
+        """
+        if not self.needs_files:
+            return
+        file_mtimes = _mtime(MASTER_PARAMS_FILE), _mtime(DRIVER_ENV_FILE)
+        if self.resolved and file_mtimes == self.file_mtimes:
+            return
+        self.file_mtimes = file_mtimes
+        self.resolved = True
+        driver_host, spark_conf_ui_port, spark_master_ui_port = self.configured
+
+        if spark_master_ui_port == MASTER_UI_PORT_PLACEHOLDER:
+            try:
+                with open(MASTER_PARAMS_FILE, mode='rt', encoding='utf-8') as f:
+                    data = f.read()
+                    tokens = data.split(' ')
+                    if len(tokens) > 1:
+                        logger.info(
+                            f"setting spark master_ui_port = {tokens[1]}")
+                    spark_master_ui_port = tokens[1]
+            except OSError:
+                logger.info(
+                    f'error opening {MASTER_PARAMS_FILE} file - cluster in single node mode', exc_info=True)
+            except IndexError:
+                logger.info(
+                    f'error reading {MASTER_PARAMS_FILE} file - cluster in single node mode', exc_info=True)
+
+        if driver_host == CONF_PUBLIC_DNS_PLACEHOLDER or spark_conf_ui_port == CONF_UI_PORT_PLACEHOLDER:
+            try:
+                with open(DRIVER_ENV_FILE, mode='rt', encoding='utf-8') as f:
+                    lines = f.readlines()
+                    for line in lines:
+                        tokens = line.split("=")
+                        if len(tokens) > 1:
+                            if tokens[0].strip() == 'CONF_PUBLIC_DNS':
+                                driver_host = tokens[1].strip()
+                                logger.info(
+                                    f"extracting driver_host = {driver_host}")
+                            elif tokens[0].strip() == 'CONF_UI_PORT':
+                                spark_conf_ui_port = tokens[1].strip()
+                                logger.info(
+                                    f"extracting conf_public_dns = {spark_conf_ui_port}")
+            except OSError:
+                logger.error(f'error opening {DRIVER_ENV_FILE} file', exc_info=True)
+
+        endpoint = driver_host, spark_conf_ui_port, spark_master_ui_port
+        if endpoint != (self.driver_host, self.spark_conf_ui_port, self.spark_master_ui_port):
+            self.driver_host, self.spark_conf_ui_port, self.spark_master_ui_port = endpoint
+            self.app_ids = None
+            self.set_labels(self.base_labels, self.cluster_labels)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ClusterRegistry:
+    """
+    The clusters polled by one integration process: either the single cluster of the spark section, or the
+    list of the clusters section plus the clusters of the clusters_file discovery file. The discovery file is
+    read again whenever its modification time changes, so clusters can be added and removed without a
+    restart. Clusters that stay listed keep their watermarks and executor samples.
+    """
+
+    def __init__(self, config, new_executor_samples):
+        self.new_executor_samples = new_executor_samples
+        self.labels = config['labels']
+        self.spark_config = config.get('spark') or {}
+        self.app_list_ttl = self.spark_config.get('app_list_ttl', 60)
+        streaming_config = config.get('streaming') or {}
+        self.event_log_dir = streaming_config.get('event_log_dir', DEFAULT_EVENT_LOG_DIR) \
+            if streaming_config.get('enabled', False) else None
+        self.streaming_history = streaming_config.get('history', 100)
+        self.static = config.get('clusters') or []
+        self.clusters_file = config.get('clusters_file')
+        self.clusters_file_mtime = None
+        self.loaded = False
+        self.clusters = {}
+        if self.static or self.clusters_file:
+            self.refresh()
+        else:
+            cluster = self.new_cluster(self.spark_config, driver_files=True)
+            self.clusters[cluster.key] = cluster
+
+    @property
+    def multi_cluster(self):
+        return bool(self.static or self.clusters_file)
+
+    def __iter__(self):
+        return iter(list(self.clusters.values()))
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def new_cluster(self, cluster_config, driver_files=False):
+        """
+        Creates the cluster of a config section. Only the cluster of the spark section (driver_files) may use
+        the install script placeholders, which default its master UI port to the one of the driver's files.
+        """
+        endpoint = (cluster_config['driver_host'], cluster_config['conf_ui_port'],
+                    cluster_config.get('master_ui_port', MASTER_UI_PORT_PLACEHOLDER if driver_files else None))
+        if not driver_files and {CONF_PUBLIC_DNS_PLACEHOLDER, CONF_UI_PORT_PLACEHOLDER,
+                                 MASTER_UI_PORT_PLACEHOLDER}.intersection(map(str, endpoint)):
+            raise ValueError('install script placeholders are only resolved for the cluster of the spark section')
+        return Cluster(cluster_config['cluster_name'], *endpoint,
+                       self.labels, self.new_executor_samples(), cluster_config.get('labels'),
+                       cluster_config.get('app_list_ttl', self.app_list_ttl),
+                       cluster_config.get('event_log_dir', self.event_log_dir) if self.event_log_dir else None,
+                       self.streaming_history, driver_files)
+
+    def refresh(self):
+        """Re-reads the discovery file if it changed and updates the clusters accordingly."""
+        if not self.multi_cluster:
+            return
+        if self.loaded and not self.clusters_file_changed():
+            return
+        cluster_configs = list(self.static)
+        if self.clusters_file:
+            discovered = self.read_clusters_file()
+            if discovered is None:
+                # keep polling the known clusters, the file may be in the middle of being rewritten
+                return
+            cluster_configs.extend(discovered)
+        self.loaded = True
+
+        clusters = {}
+        for cluster_config in cluster_configs:
+            try:
+                cluster = self.new_cluster(cluster_config)
+            except (KeyError, TypeError):
+                logger.error(f'ignoring cluster without cluster_name, driver_host and conf_ui_port: '
+                             f'{cluster_config}')
+                continue
+            except ValueError as e:
+                logger.error(f'ignoring cluster {cluster_config.get("cluster_name")}: {e}')
+                continue
+            existing = self.clusters.get(cluster.key)
+            if existing is not None:
+                existing.cluster_name = cluster.cluster_name
+                existing.set_labels(self.labels, cluster_config.get('labels'))
+                cluster = existing
+            clusters[cluster.key] = cluster
+        added = clusters.keys() - self.clusters.keys()
+        removed = self.clusters.keys() - clusters.keys()
+        self.clusters = clusters
+        logger.info(f'polling {len(clusters)} clusters, {len(added)} added, {len(removed)} removed')
+
+    def clusters_file_changed(self):
+        if not self.clusters_file:
+            return False
+        try:
+            mtime = os.stat(self.clusters_file).st_mtime_ns
+        except OSError:
+            mtime = None
+        return mtime != self.clusters_file_mtime
+
+    def read_clusters_file(self):
+        """Returns the clusters listed in the discovery file, or None if it can not be read."""
+        try:
+            self.clusters_file_mtime = os.stat(self.clusters_file).st_mtime_ns
+            clusters = read_yaml(self.clusters_file) or []
+        except (OSError, ValueError):
+            logger.exception(f'error reading clusters file {self.clusters_file}')
+            self.clusters_file_mtime = None
+            return None
+        if isinstance(clusters, dict):
+            clusters = clusters.get('clusters') or []
+        return clusters
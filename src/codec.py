@@ -0,0 +1,119 @@
+import json
+import logging
+import zlib
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library encoder is used without it
+    orjson = None
+
+logger = logging.getLogger('nri-databricks')
+
+# zlib levels: 1 is fastest, 9 compresses best
+DEFAULT_COMPRESSION_LEVEL = 9
+
+# uncompressed bytes collected before they are handed to the compressor
+BLOCK_SIZE = 64 * 1024
+
+JSON_BACKENDS = ('auto', 'json', 'orjson')
+
+_encoder = json.JSONEncoder(check_circular=False, separators=(',', ':'))
+_encode = _encoder.encode
+
+
+def _json_dumps(obj):
+    return _encode(obj).encode()
+
+
+def _orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        # values orjson refuses, such as integers beyond 64 bits or non-string keys
+        return _json_dumps(obj)
+
+
+dumps = _json_dumps
+backend = 'json'
+
+
+def set_json_backend(name):
+    """
+    Selects the JSON encoder used for payloads: 'json' for the standard library, 'orjson' when it is
+    installed, or 'auto' for orjson if available and the standard library otherwise.
+    """
+    global dumps, backend
+    if name not in JSON_BACKENDS:
+        raise ValueError(f'unknown json backend "{name}", expected one of {JSON_BACKENDS}')
+    if name == 'orjson' and orjson is None:
+        logger.warning('json backend orjson is not installed, using json')
+        name = 'json'
+    if name == 'auto':
+        name = 'json' if orjson is None else 'orjson'
+    dumps = _orjson_dumps if name == 'orjson' else _json_dumps
+    backend = name
+    logger.info(f'Using json backend {backend}')
+
+
+def compress(data, level=DEFAULT_COMPRESSION_LEVEL):
+    """gzip compresses data in one go."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH)
+
+
+class GzipWriter:
+    """
+    Streams data into a gzip member. Small writes are collected in a staging buffer and compressed in blocks
+    of block_size bytes, and the compressed output is copied into an output buffer. Both buffers are
+    preallocated bytearrays that keep their size, so a writer that is passed the buffers of the previous one
+    reuses their memory instead of growing new buffers and joining chunk lists for every payload.
+    """
+
+    __slots__ = 'compressor', 'staging', 'staged', 'output', 'compressed_size', 'block_size'
+
+    def __init__(self, level=DEFAULT_COMPRESSION_LEVEL, staging=None, output=None, block_size=BLOCK_SIZE):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        self.staging = bytearray(block_size) if staging is None else staging
+        self.staged = 0
+        self.output = bytearray(block_size) if output is None else output
+        self.compressed_size = 0
+        self.block_size = min(block_size, len(self.staging))
+
+    def write(self, data):
+        size = len(data)
+        staged = self.staged
+        if staged + size <= self.block_size:
+            self.staging[staged:staged + size] = data
+            self.staged = staged + size
+            return
+        self._compress_staged()
+        if size >= self.block_size:
+            self._append(self.compressor.compress(data))
+        else:
+            self.staging[:size] = data
+            self.staged = size
+
+    def sync(self):
+        """Compresses everything written so far, so that compressed_size is exact up to the trailer."""
+        self._compress_staged()
+        self._append(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def finish(self):
+        """Returns the complete gzip member. The buffers are free for the next writer afterwards."""
+        self._compress_staged()
+        self._append(self.compressor.flush(zlib.Z_FINISH))
+        return bytes(memoryview(self.output)[:self.compressed_size])
+
+    def _compress_staged(self):
+        if self.staged:
+            self._append(self.compressor.compress(memoryview(self.staging)[:self.staged]))
+            self.staged = 0
+
+    def _append(self, chunk):
+        if not chunk:
+            return
+        end = self.compressed_size + len(chunk)
+        if end > len(self.output):
+            self.output.extend(bytes(max(end, 2 * len(self.output)) - len(self.output)))
+        self.output[self.compressed_size:end] = chunk
+        self.compressed_size = end
@@ -0,0 +1,135 @@
+import concurrent.futures
+import logging
+import threading
+import time
+
+logger = logging.getLogger('nri-databricks')
+
+
+class CollectionTask:
+    def __init__(self, app_id, kind, fn, cluster=None):
+        self.app_id = app_id
+        self.kind = kind
+        self.fn = fn
+        self.cluster = cluster
+        self.duration = None
+
+    @property
+    def key(self):
+        return self.cluster, self.app_id, self.kind
+
+    @property
+    def name(self):
+        if self.cluster is None:
+            return f'app {self.app_id}'
+        if self.app_id is None:
+            return f'cluster {self.cluster}'
+        return f'app {self.app_id} of cluster {self.cluster}'
+
+    def __call__(self):
+        start = time.monotonic()
+        try:
+            if self.cluster is None:
+                self.fn(self.app_id)
+            else:
+                self.fn(self.cluster, self.app_id)
+        finally:
+            self.duration = time.monotonic() - start
+
+
+class CollectionEngine:
+    """
+    Runs the per application collection tasks of one poll on a bounded worker pool. Tasks feed their events
+    into the event batcher themselves. The poll stops waiting for tasks once the deadline has passed; tasks
+    still running finish in the background, their events go out with a later flush, and the same application
+    and kind is not scheduled again until they are done.
+    """
+
+    def __init__(self, workers, deadline):
+        self.deadline = deadline
+        # monotonic time no poll waits beyond, set for single-shot runs
+        self.until = None
+        self.workers = workers
+        self.executor = self._new_executor(workers)
+        self._lock = threading.Lock()
+        self._in_flight = set()
+
+    @staticmethod
+    def _new_executor(workers):
+        return concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='nri-databricks-collector')
+
+    def resize(self, workers):
+        """Replaces the worker pool with one of workers threads. Tasks already submitted finish on the old pool."""
+        with self._lock:
+            if workers == self.workers:
+                return
+            logger.info(f'resizing the collection worker pool from {self.workers} to {workers} workers')
+            executor, self.executor = self.executor, self._new_executor(workers)
+            self.workers = workers
+        executor.shutdown(wait=False)
+
+    def run(self, tasks):
+        start = time.monotonic()
+        futures = {}
+        for task in tasks:
+            with self._lock:
+                if task.key in self._in_flight:
+                    logger.warning(f'collecting {task.kind} for {task.name} from a previous poll '
+                                   f'is still running, skipping')
+                    continue
+                self._in_flight.add(task.key)
+                future = self.executor.submit(task)
+            future.add_done_callback(lambda f, key=task.key: self._done(key))
+            futures[future] = task
+        done, not_done = concurrent.futures.wait(futures, timeout=self._timeout())
+
+        timings = {}
+        for future in done:
+            task = futures[future]
+            timings.setdefault(task.name, {})[task.kind] = task.duration
+            exception = future.exception()
+            if exception:
+                logger.error(f'error collecting {task.kind} for {task.name}', exc_info=exception)
+
+        for future in not_done:
+            task = futures[future]
+            timings.setdefault(task.name, {})[task.kind] = None
+            logger.warning(f'collecting {task.kind} for {task.name} did not finish within the '
+                           f'poll deadline of {self.deadline}s')
+
+        for name, kinds in timings.items():
+            durations = ', '.join(f'{kind}: {"timeout" if duration is None else f"{duration:.3f}s"}'
+                                  for kind, duration in sorted(kinds.items()))
+            logger.info(f'{name} collection times - {durations}')
+        apps = len({(task.cluster, task.app_id) for task in futures.values() if task.app_id is not None})
+        logger.info(f'collected {apps} apps in {time.monotonic() - start:.3f}s')
+
+    def map(self, fn, items):
+        """
+        Calls fn for every item on the worker pool and returns the results in order, with None for items
+        that failed or did not finish within the poll deadline.
+        """
+        with self._lock:
+            futures = [self.executor.submit(fn, item) for item in items]
+        concurrent.futures.wait(futures, timeout=self._timeout())
+        results = []
+        for item, future in zip(items, futures):
+            if not future.done():
+                logger.warning(f'{fn.__name__} for {item} did not finish within the poll deadline of '
+                               f'{self.deadline}s')
+                results.append(None)
+            elif future.exception():
+                logger.error(f'error in {fn.__name__} for {item}', exc_info=future.exception())
+                results.append(None)
+            else:
+                results.append(future.result())
+        return results
+
+    def _timeout(self):
+        if self.until is None:
+            return self.deadline
+        return max(0, min(self.deadline, self.until - time.monotonic()))
+
+    def _done(self, key):
+        with self._lock:
+            self._in_flight.discard(key)
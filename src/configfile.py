@@ -0,0 +1,63 @@
+import contextlib
+import json
+import logging
+import os
+
+logger = logging.getLogger('nri-databricks')
+
+
+def read_yaml(path):
+    """Parses a YAML file, with the C loader of PyYAML where it is available. Raises ValueError for invalid YAML."""
+    # imported here, runs with a cached config do not need the YAML parser at all
+    import yaml
+    loader = getattr(yaml, 'CLoader', yaml.Loader)
+    with open(path, mode='rt', encoding='utf-8') as f:
+        try:
+            return yaml.load(f, Loader=loader)
+        except yaml.YAMLError as e:
+            raise ValueError(f'invalid YAML in {path}: {e}') from e
+
+
+def cache_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f'.{name}.json')
+
+
+def load_config(path):
+    """
+    Returns the parsed config file. The parsed config is cached as JSON next to the file and read instead of
+    the YAML while the file's size and modification time are unchanged, which spares single-shot runs the
+    YAML parser. The cache is only trusted if it belongs to the current user and is not writable by others.
+    """
+    stat = os.stat(path)
+    key = [stat.st_size, stat.st_mtime_ns]
+    cache = cache_path(path)
+    try:
+        cache_stat = os.stat(cache)
+        if cache_stat.st_uid == os.getuid() and not cache_stat.st_mode & 0o022:
+            with open(cache, encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('key') == key:
+                return cached['config']
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+
+    config = read_yaml(path)
+    try:
+        data = json.dumps({'key': key, 'config': config})
+    except (TypeError, ValueError):
+        # values JSON can not represent, like dates, are not cached
+        return config
+    if json.loads(data)['config'] != config:
+        # JSON would turn tuples into lists or keys into strings
+        return config
+    tmp = f'{cache}.{os.getpid()}.tmp'
+    try:
+        with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp, cache)
+    except OSError as e:
+        logger.debug(f'not caching config {path}: {e}')
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+    return config
@@ -0,0 +1,73 @@
+import collections
+import threading
+import time
+
+
+def add_deltas(event, deltas):
+    """Adds the deltas and rates of the counters that the event kept."""
+    for counter, (delta, per_second) in deltas.items():
+        if counter in event:
+            event[f'{counter}Delta'] = delta
+            if per_second is not None:
+                event[f'{counter}PerSecond'] = per_second
+
+
+class CounterCache:
+    """
+    Remembers the last sample of cumulative counters per key (application id, executor id) and returns the
+    change since that sample and the per second rate for the next sample of the same key, which add_deltas
+    adds to an event as <counter>Delta and <counter>PerSecond. A counter that went down was reset, for example
+    by an executor re-registering under the same id, and its current value is taken as the delta. Keys that
+    have not been seen for max_idle seconds are evicted, and at most max_entries keys are kept.
+    """
+
+    def __init__(self, counters, max_idle=300, max_entries=10000):
+        self.counters = tuple(counters)
+        self.max_idle = max_idle
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._samples = collections.OrderedDict()
+
+    def deltas(self, key, values, now=None):
+        """
+        Samples the counters of values, a spark entity, and returns a dict of counter to its delta and per
+        second rate, which is None if no time passed.
+        """
+        now = time.monotonic() if now is None else now
+        sample = {}
+        for counter in self.counters:
+            value = values.get(counter)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                sample[counter] = value
+
+        with self._lock:
+            previous = self._samples.pop(key, None)
+            self._samples[key] = (now, sample)
+            while len(self._samples) > self.max_entries:
+                self._samples.popitem(last=False)
+
+        deltas = {}
+        if previous is None:
+            return deltas
+        previous_time, previous_sample = previous
+        elapsed = now - previous_time
+        for counter, value in sample.items():
+            previous_value = previous_sample.get(counter)
+            if previous_value is None:
+                continue
+            delta = value - previous_value
+            if delta < 0:
+                delta = value
+            deltas[counter] = delta, (delta / elapsed if elapsed > 0 else None)
+        return deltas
+
+    def evict(self, now=None, keep=None):
+        """
+        Drops keys not seen for max_idle seconds. If keep is given, keys whose first element (the application
+        id) is not in keep are dropped as well.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for key in [key for key, (seen, _) in self._samples.items()
+                        if now - seen > self.max_idle or (keep is not None and key[0] not in keep)]:
+                del self._samples[key]
@@ -0,0 +1,102 @@
+import zlib
+
+# resolution of the sampling rates
+_SAMPLE_BUCKETS = 10000
+
+
+class EventFilter:
+    """
+    Configured selection of the events of one event type:
+
+    - include: only these attributes are kept (eventType is always kept)
+    - exclude: these attributes are removed
+    - drop: list of rules, each a mapping of field to value or list of values. An event is dropped when all
+      fields of any rule match.
+    - sample: rate between 0 and 1 of entities to keep, and key, the fields identifying an entity. Entities are
+      selected by a hash of their key, so the same entities are kept on every poll and by every process.
+
+    Projectors compile the filter into their projection; apply() filters events that were built otherwise.
+    """
+
+    def __init__(self, event_type, include=None, exclude=None, drop=None, sample=None):
+        self.event_type = event_type
+        self.include = frozenset(include) if include is not None else None
+        self.exclude = frozenset(exclude or ())
+        self.drop = []
+        for rule in drop or ():
+            if not isinstance(rule, dict) or not rule:
+                raise ValueError(f'drop rule of {event_type} must map fields to values: {rule!r}')
+            self.drop.append({field: _values(event_type, field, value) for field, value in rule.items()})
+        sample = sample or {}
+        self.sample_rate = float(sample.get('rate', 1.0))
+        if not 0 <= self.sample_rate <= 1:
+            raise ValueError(f'sample rate of {event_type} must be between 0 and 1: {self.sample_rate}')
+        self.sample_key = tuple(sample.get('key') or ())
+        if self.sample_rate < 1 and not self.sample_key:
+            raise ValueError(f'sampling of {event_type} needs the key fields identifying an entity')
+        self.sample_threshold = int(self.sample_rate * _SAMPLE_BUCKETS)
+
+    @classmethod
+    def from_config(cls, config):
+        """Returns the filters of the filters config section by event type."""
+        filters = {}
+        for event_type, rules in (config or {}).items():
+            rules = rules or {}
+            filters[event_type] = cls(event_type, rules.get('include'), rules.get('exclude'), rules.get('drop'),
+                                      rules.get('sample'))
+        return filters
+
+    def keeps(self, name):
+        if name == 'eventType':
+            return True
+        if self.include is not None and name not in self.include:
+            return False
+        return name not in self.exclude
+
+    def sampled(self, *values):
+        return zlib.crc32(repr(values).encode()) % _SAMPLE_BUCKETS < self.sample_threshold
+
+    def condition_lines(self, get):
+        """
+        Python source lines returning None for dropped or unsampled items, with get the item's get method. The
+        lines refer to the names of compiled_globals().
+        """
+        lines = []
+        for i, rule in enumerate(self.drop):
+            # the values are bound as globals, their repr is not always valid source (nan, inf)
+            condition = ' and '.join(f'{get}({field!r}) in drop_{i}_{j}' for j, field in enumerate(rule))
+            lines.append(f'if {condition}:')
+            lines.append('    return None')
+        if self.sample_rate < 1:
+            key = ', '.join(f'{get}({field!r})' for field in self.sample_key)
+            lines.append(f'if not sampled({key}):')
+            lines.append('    return None')
+        return lines
+
+    def compiled_globals(self):
+        """Returns the globals that the projection compiled with this filter refers to."""
+        names = {'sampled': self.sampled, 'keeps': self.keeps}
+        for i, rule in enumerate(self.drop):
+            for j, values in enumerate(rule.values()):
+                names[f'drop_{i}_{j}'] = values
+        return names
+
+    def apply(self, event):
+        """Returns the filtered event, or None if it is dropped."""
+        get = event.get
+        for rule in self.drop:
+            if all(get(field) in values for field, values in rule.items()):
+                return None
+        if self.sample_rate < 1 and not self.sampled(*(get(field) for field in self.sample_key)):
+            return None
+        if self.include is None and not self.exclude:
+            return event
+        return {name: value for name, value in event.items() if self.keeps(name)}
+
+
+def _values(event_type, field, value):
+    values = tuple(value) if isinstance(value, (list, tuple)) else (value,)
+    for value in values:
+        if value is not None and not isinstance(value, (str, int, float, bool)):
+            raise ValueError(f'drop rule of {event_type} compares {field} with unsupported value {value!r}')
+    return values
@@ -0,0 +1,122 @@
+import logging
+import os
+import resource
+import sys
+import time
+
+logger = logging.getLogger('nri-databricks')
+
+# degradation levels, each one includes the ones before it
+NORMAL, WITHOUT_OPTIONAL, LONGER_INTERVAL, FEWER_WORKERS = range(4)
+LEVEL_NAMES = ('normal', 'without optional collectors', 'longer interval', 'fewer workers')
+
+
+def rss_bytes():
+    """Returns the resident set size of the process, or its peak where the current size is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on linux and in bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class ResourceGovernor:
+    """
+    Keeps the integration within a CPU and memory budget on the driver it shares with the customer's spark
+    application. measure() is called after every poll and returns the share of one core the process used
+    since the previous poll, including its sender threads and the idle time in between, and its resident
+    set size. Every poll exceeding a budget moves one level down:
+
+    1. the optional collectors (tasks, structured streaming progress, DStream statistics) are skipped
+    2. the poll interval is multiplied by interval_factor
+    3. the collection worker pool is multiplied by worker_factor
+
+    After recover_after consecutive polls below headroom times both budgets it moves one level up again.
+    Python rarely returns freed memory to the system, so an exceeded memory budget may keep the integration
+    degraded until it is restarted.
+    """
+
+    def __init__(self, cpu_percent=None, max_rss_mb=None, recover_after=3, headroom=0.8, interval_factor=2,
+                 worker_factor=0.5):
+        self.cpu_percent = cpu_percent
+        self.max_rss_mb = max_rss_mb
+        self.recover_after = recover_after
+        self.headroom = headroom
+        self.level_interval_factor = interval_factor
+        self.level_worker_factor = worker_factor
+        self.level = NORMAL
+        self._within = 0
+        self._cpu = time.process_time()
+        self._wall = time.monotonic()
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        return cls(cpu_percent=config.get('cpu_percent'),
+                   max_rss_mb=config.get('max_rss_mb'),
+                   recover_after=config.get('recover_after', 3),
+                   headroom=config.get('headroom', 0.8),
+                   interval_factor=config.get('interval_factor', 2),
+                   worker_factor=config.get('worker_factor', 0.5))
+
+    @property
+    def enabled(self):
+        return bool(self.cpu_percent or self.max_rss_mb)
+
+    @property
+    def optional_collectors(self):
+        return self.level < WITHOUT_OPTIONAL
+
+    @property
+    def interval_factor(self):
+        return self.level_interval_factor if self.level >= LONGER_INTERVAL else 1
+
+    @property
+    def worker_factor(self):
+        return self.level_worker_factor if self.level >= FEWER_WORKERS else 1
+
+    def measure(self):
+        """Returns the percent of one core used since the last measure and the resident set size in MB."""
+        cpu = time.process_time()
+        wall = time.monotonic()
+        cpu_percent = (cpu - self._cpu) * 100 / (wall - self._wall) if wall > self._wall else 0.0
+        self._cpu, self._wall = cpu, wall
+        return cpu_percent, rss_bytes() / 1024 ** 2
+
+    def update(self, cpu_percent, rss_mb):
+        """Moves between levels for the measured usage and returns the previous level if the level changed."""
+        over = [f'{name} {value:.1f}{unit} exceeds the budget of {budget}{unit}'
+                for name, value, budget, unit in (('cpu', cpu_percent, self.cpu_percent, '%'),
+                                                  ('rss', rss_mb, self.max_rss_mb, 'MB'))
+                if budget and value > budget]
+        previous = self.level
+        if over:
+            self._within = 0
+            if self.level == FEWER_WORKERS:
+                logger.warning(f'{", ".join(over)}, already running at the lowest level')
+                return None
+            self.level += 1
+            logger.warning(f'{", ".join(over)}, degrading to level {self.level} ({LEVEL_NAMES[self.level]})')
+            return previous
+
+        if (self.cpu_percent and cpu_percent > self.cpu_percent * self.headroom) or \
+                (self.max_rss_mb and rss_mb > self.max_rss_mb * self.headroom):
+            self._within = 0
+            return None
+        self._within += 1
+        if self.level == NORMAL or self._within < self.recover_after:
+            return None
+        self._within = 0
+        self.level -= 1
+        logger.info(f'cpu {cpu_percent:.1f}% and rss {rss_mb:.1f}MB within budget for {self.recover_after} polls, '
+                    f'recovering to level {self.level} ({LEVEL_NAMES[self.level]})')
+        return previous
+
+    def event(self, previous, cpu_percent, rss_mb):
+        """Describes a change of level as the attributes of a self metrics event."""
+        return {'metric': 'governor', 'level': self.level, 'levelName': LEVEL_NAMES[self.level],
+                'previousLevel': previous, 'cpuPercent': cpu_percent, 'rssMb': rss_mb,
+                'cpuBudgetPercent': self.cpu_percent, 'rssBudgetMb': self.max_rss_mb,
+                'intervalFactor': self.interval_factor, 'workerFactor': self.worker_factor}
@@ -2,6 +2,7 @@ import requests
 from requests.adapters import HTTPAdapter, Retry
 
 DEFAULT_TIMEOUT = 5  # seconds
+DEFAULT_POOL_SIZE = 10  # connections kept alive per host
 
 
 class TimeoutHTTPAdapter(HTTPAdapter):
@@ -23,7 +24,16 @@ def new_retry_session(retries=3,
                       backoff_factor=3,
                       status_forcelist=(500, 502, 504),
                       session=None,
+                      timeout=DEFAULT_TIMEOUT,
+                      pool_size=DEFAULT_POOL_SIZE,
+                      pool_hosts=None,
                       ):
+    """
+    Creates a session with a keep-alive connection pool of pool_size connections per host, for up to
+    pool_hosts hosts (pool_size by default). The session is meant to be long-lived and shared by the
+    scheduler and collector threads; urllib3 connection pools are thread safe and the session is only used
+    for plain requests without cookies.
+    """
     session = session or requests.Session()
     max_retries = Retry(
         total=retries,
@@ -32,7 +42,8 @@ def new_retry_session(retries=3,
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
     )
-    adapter = TimeoutHTTPAdapter(max_retries=max_retries)
+    adapter = TimeoutHTTPAdapter(max_retries=max_retries, timeout=timeout,
+                                 pool_connections=max(pool_size, pool_hosts or 0), pool_maxsize=pool_size)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
@@ -1,12 +1,30 @@
+import contextlib
 import json
 import logging
 import os
 import sys
+import threading
+import time
 
 import requests
 
+import codec
+from batcher import Attributes, EventBatcher
+from cluster import ClusterRegistry
+from collector import CollectionEngine, CollectionTask
+from deltas import CounterCache, add_deltas
+from filters import EventFilter
+from governor import ResourceGovernor
 from newrelic import NewRelic
+from projection import Projector
 from http_session import new_retry_session
+from metrics import MetricAggregator
+from jsonstream import iter_json_array
+from sender import AsyncSender
+from spool import open_spool
+from streaming import progress_event
+from tasks import TASK_SUMMARY_QUANTILES, TaskSketch, stage_tasks_event, straggler_event
+from telemetry import SELF_METRICS_EVENT_TYPE, spark_endpoint, telemetry
 
 logger = logging.getLogger('nri-databricks')
 
@@ -47,10 +65,38 @@ stream_stat_keys = {'batchDuration': 'batchDuration', 'numReceivers': 'numReceiv
                     'avgSchedulingDelay': 'avgSchedulingDelay', 'avgProcessingTime': 'avgProcessingTime',
                     'avgTotalDelay': 'avgTotalDelay'}
 
+# cumulative executor counters that are also reported as per poll deltas and per second rates
+executor_counters = ('totalDuration', 'totalGCTime', 'totalInputBytes', 'totalShuffleRead', 'totalShuffleWrite',
+                     'completedTasks', 'failedTasks', 'totalTasks')
 
-def execute_spark_request(url):
+# fields aggregated into metric API metrics when the metrics output is enabled
+executor_gauges = ('memoryUsed', 'diskUsed', 'maxMemory', 'rddBlocks', 'totalCores', 'maxTasks', 'activeTasks',
+                   'usedOnHeapStorageMemory', 'usedOffHeapStorageMemory', 'totalOnHeapStorageMemory',
+                   'totalOffHeapStorageMemory')
+job_summaries = ('numTasks', 'numCompletedTasks', 'numSkippedTasks', 'numFailedTasks', 'numKilledTasks',
+                 'numCompletedStages', 'numSkippedStages', 'numFailedStages')
+stage_summaries = ('numTasks', 'numFailedTasks', 'executorRunTime', 'executorCpuTime', 'inputBytes', 'inputRecords',
+                   'outputBytes', 'outputRecords', 'shuffleReadBytes', 'shuffleReadRecords', 'shuffleWriteBytes',
+                   'shuffleWriteRecords', 'memoryBytesSpilled', 'diskBytesSpilled')
+# the fields of a stage that task collection needs, taken from the listing before any field list or drop rule
+task_stage_fields = ('stageId', 'attemptId', 'status', 'numTasks')
+
+output_modes = ('events', 'metrics', 'both')
+
+# share of a single-shot run's deadline kept for delivering the collected events
+DELIVERY_SHARE = 0.2
+
+# spark REST status filters used for incremental collection
+open_job_statuses = 'status=running'
+terminal_job_statuses = 'status=succeeded&status=failed&status=unknown'
+open_stage_statuses = 'status=active&status=pending'
+terminal_stage_statuses = 'status=complete&status=failed&status=skipped'
+
+
+def execute_spark_request(session, url):
     try:
-        response = requests.get(url)
+        with telemetry.timer('spark_request_seconds', spark_endpoint(url)):
+            response = session.get(url)
         if response.status_code != 200:
             error_message = f'spark ui request failed. ' \
                             f'url:{url}, ' \
@@ -64,17 +110,48 @@ def execute_spark_request(url):
         logger.exception(f"error executing spark request to url {url}")
 
 
-# def post_metrics(nr_metrics):
-#     nr_session = new_retry_session()
-#     max_metrics = 2000
-#     metric_batches = [nr_metrics[i:i + max_metrics] for i in range(0, len(nr_metrics), max_metrics)]
-#
-#     for metric_batch in metric_batches:
-#         status_code = NewRelic.post_events(nr_session, metric_batch)
-#         if status_code != 200:
-#             logger.error(f'newrelic metric collector responded with status code {status_code}')
-#         else:
-#             logger.info(f'{len(metric_batch)} metrics sent to newrelic metric collector')
+class SparkApiException(Exception):
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def fetch_spark_json(session, url):
+    """Returns the parsed response of url, raising SparkApiException with its status code if it failed."""
+    try:
+        with telemetry.timer('spark_request_seconds', spark_endpoint(url)):
+            response = session.get(url)
+        if response.status_code != 200:
+            raise SparkApiException(f'spark ui request failed. '
+                                    f'url:{url}, '
+                                    f'status-code:{response.status_code}, '
+                                    f'reason: {response.reason} '
+                                    f'response: {response.text} ', response.status_code)
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        raise SparkApiException(f'error executing spark request to url {url}: {e!r}') from e
+
+
+def execute_spark_stream(session, url, chunk_size=64 * 1024):
+    """
+    Yields the elements of the JSON array returned by url as they are parsed from the response body. Closing
+    the generator early closes the connection without downloading the rest of the response. The request is
+    timed up to the response headers, the body is read at the pace of the consumer.
+    """
+    try:
+        with telemetry.timer('spark_request_seconds', spark_endpoint(url)):
+            response = session.get(url, stream=True)
+        with response:
+            if response.status_code != 200:
+                raise SparkApiException(f'spark ui request failed. '
+                                        f'url:{url}, '
+                                        f'status-code:{response.status_code}, '
+                                        f'reason: {response.reason} '
+                                        f'response: {response.text} ', response.status_code)
+            yield from iter_json_array(response.iter_content(chunk_size=chunk_size))
+    except (requests.exceptions.RequestException, ValueError) as e:
+        raise SparkApiException(f'error executing spark request to url {url}: {e!r}') from e
 
 
 class Integration:
@@ -82,6 +159,8 @@ class Integration:
     def __init__(self, config):
         if 'spark' in config:
             spark_config = config['spark']
+        elif config.get('clusters') or config.get('clusters_file'):
+            spark_config = {}
         else:
             logger.error(f'config file is missing "spark" section')
             sys.exit(f'config file is missing "spark" section')
@@ -102,152 +181,455 @@ class Integration:
             logger.error(
                 f'Ignoring NEWRELIC_TAGS due to a ValueError', exc_info=True)
 
-        self.driver_host = spark_config['driver_host']
-        self.spark_conf_ui_port = spark_config['conf_ui_port']
-        self.spark_master_ui_port = spark_config['master_ui_port']
-        cluster_name = spark_config['cluster_name']
-
-        self.labels['driverHost'] = self.driver_host
-        self.labels['clusterName'] = cluster_name
+        self.poll_interval = config.get('poll_interval', 30)
+        self.clusters = ClusterRegistry(
+            config, lambda: CounterCache(executor_counters, max_idle=self.poll_interval * 10))
+        self.active_count = 0
 
         newrelic_account_id = newrelic_config['account_id']
         newrelic_api_endpoint = newrelic_config['api_endpoint']
 
+        self.integration_attributes = Attributes(self.labels)
+
         NewRelic.events_api_key = newrelic_config['api_key']
         NewRelic.set_api_endpoint(newrelic_api_endpoint, newrelic_account_id)
 
-    def run(self):
-        logger.debug("Executing integration")
-        if self.spark_master_ui_port == '<<MASTER_UI_PORT>>':
+        self.output = newrelic_config.get('output', 'events')
+        if self.output not in output_modes:
+            logger.error(f'invalid newrelic output "{self.output}", expected one of {output_modes}')
+            sys.exit(f'invalid newrelic output "{self.output}"')
+        metrics_api_endpoint = newrelic_config.get('metrics_api_endpoint') or \
+            NewRelic.region_metrics_api_endpoint(newrelic_api_endpoint)
+        if metrics_api_endpoint is not None:
+            NewRelic.set_metrics_api_endpoint(metrics_api_endpoint)
+        elif self.output != 'events':
+            logger.error(f'the region of api_endpoint {newrelic_api_endpoint} is not known, '
+                         f'config file is missing newrelic "metrics_api_endpoint"')
+            sys.exit(f'config file is missing newrelic "metrics_api_endpoint"')
+        try:
+            filters = EventFilter.from_config(config.get('filters'))
+        except ValueError as e:
+            logger.error(f'invalid filters: {e}')
+            sys.exit(f'invalid filters: {e}')
+        self.job_projector = Projector('SparkJob', job_keys, event_filter=filters.pop('SparkJob', None))
+        self.stage_projector = Projector('SparkStage', stage_keys, event_filter=filters.pop('SparkStage', None))
+        self.executor_projector = Projector('SparkExecutor', executor_keys, flatten=('memoryMetrics',),
+                                            event_filter=filters.pop('SparkExecutor', None))
+        self.stream_stat_projector = Projector('SparkStreamingStatistics', stream_stat_keys,
+                                               event_filter=filters.pop('SparkStreamingStatistics', None))
+
+        codec.set_json_backend(newrelic_config.get('json_backend', 'auto'))
+        compression_level = newrelic_config.get('compression_level', codec.DEFAULT_COMPRESSION_LEVEL)
+        # zlib would only reject an invalid level on the first flush, in a sender thread
+        if not isinstance(compression_level, int) or isinstance(compression_level, bool) or \
+                not 0 <= compression_level <= 9:
+            logger.error(f'invalid newrelic compression_level "{compression_level}", expected 0 to 9')
+            sys.exit(f'invalid newrelic compression_level "{compression_level}"')
+        self.metrics = MetricAggregator(compression_level) if self.output != 'events' else None
+
+        self.self_metrics_interval = config.get('self_metrics_interval', 60)
+
+        tasks_config = config.get('tasks') or {}
+        self.task_collection = tasks_config.get('enabled', False)
+        self.task_top_n = tasks_config.get('top_n', 5)
+        self.task_max_stages = tasks_config.get('max_stages', 10)
+        self.task_max_tasks = tasks_config.get('max_tasks', 10000)
+
+        streaming_config = config.get('streaming') or {}
+        self.dstream_statistics = streaming_config.get('dstreams', False)
+        self.self_metrics_emitted = time.monotonic()
+
+        self.governor = ResourceGovernor.from_config(config.get('resources'))
+
+        collection_workers = config.get('collection_workers', 8)
+        self.collection_workers = collection_workers
+        self.collector = CollectionEngine(collection_workers,
+                                          config.get('poll_deadline', self.poll_interval))
+
+        # long-lived keep-alive pools shared by all collector and scheduler threads and all clusters
+        self.spark_session = new_retry_session(retries=spark_config.get('retries', 1),
+                                               backoff_factor=spark_config.get('backoff_factor', 0.5),
+                                               timeout=spark_config.get('timeout', 10),
+                                               pool_size=spark_config.get('pool_size', collection_workers),
+                                               pool_hosts=spark_config.get('pool_hosts', len(self.clusters)))
+        self.nr_session = new_retry_session(retries=newrelic_config.get('retries', 3),
+                                            backoff_factor=newrelic_config.get('backoff_factor', 3),
+                                            timeout=newrelic_config.get('timeout', 5),
+                                            pool_size=newrelic_config.get('pool_size', 4))
+
+        spool = None
+        spool_config = config.get('spool') or {}
+        if spool_config:
+            spool_dir = spool_config.get('dir', '/tmp/nri-databricks-spool')
             try:
-                with open('/tmp/master-params', mode='rt', encoding='utf-8') as f:
-                    data = f.read()
-                    tokens = data.split(' ')
-                    if len(tokens) > 1:
-                        logger.info(
-                            f"setting spark master_ui_port = {tokens[1]}")
-                    self.spark_master_ui_port = tokens[1]
+                spool = open_spool(spool_dir,
+                                   max_bytes=spool_config.get('max_bytes', 100 * 1024 * 1024),
+                                   segment_bytes=spool_config.get('segment_bytes', 4 * 1024 * 1024))
             except OSError:
-                logger.info(
-                    'error opening /tmp/master-params file - cluster in single node mode', exc_info=True)
-            except IndexError:
-                logger.info(
-                    'error reading /tmp/master-params file - cluster in single node mode', exc_info=True)
-
-        if self.driver_host == '<<CONF_PUBLIC_DNS>>' or self.spark_conf_ui_port == '<<CONF_UI_PORT>>':
-            with open('/tmp/driver-env.sh', mode='rt', encoding='utf-8') as f:
-                lines = f.readlines()
-                for line in lines:
-                    tokens = line.split("=")
-                    if len(tokens) > 1:
-                        if tokens[0].strip() == 'CONF_PUBLIC_DNS':
-                            self.driver_host = tokens[1].strip()
-                            logger.info(
-                                f"extracting driver_host = {self.driver_host}")
-                        elif tokens[0].strip() == 'CONF_UI_PORT':
-                            self.spark_conf_ui_port = tokens[1].strip()
-                            logger.info(
-                                f"extracting conf_public_dns = {self.spark_conf_ui_port}")
-
-        if self.spark_master_ui_port != '<<MASTER_UI_PORT>>':
+                logger.exception(f'error opening spool {spool_dir}, running without a spool')
+        self.sender = AsyncSender(self.nr_session,
+                                  queue_size=newrelic_config.get('queue_size', 100),
+                                  workers=newrelic_config.get('sender_workers', 2),
+                                  full_policy=newrelic_config.get('queue_full_policy', 'drop_oldest'),
+                                  spool=spool,
+                                  replay_rate=spool_config.get('replay_rate', 2.0))
+        # events that are not projected from spark entities are filtered by the batcher
+        self.batcher = EventBatcher(self.sender.submit, compression_level=compression_level, filters=filters)
+
+    @property
+    def attributes(self):
+        """
+        Attributes of the integration's own events. They are those of the only cluster if there is just one,
+        looked up on every use as the cluster replaces them when its endpoint is resolved.
+        """
+        if self.clusters.multi_cluster:
+            return self.integration_attributes
+        return next(iter(self.clusters)).attributes
+
+    def run(self):
+        with telemetry.timer('poll_seconds'):
+            self.poll()
+        self.govern()
+        if self.self_metrics_interval and \
+                time.monotonic() - self.self_metrics_emitted >= self.self_metrics_interval:
+            self.emit_self_metrics()
+
+    @property
+    def interval_factor(self):
+        """Factor the resource governor applies to the poll interval."""
+        return self.governor.interval_factor
+
+    def govern(self):
+        """Records the process's CPU and memory usage of the last poll and degrades or recovers accordingly."""
+        cpu_percent, rss_mb = self.governor.measure()
+        telemetry.record('cpu_percent', cpu_percent)
+        telemetry.record('rss_mb', rss_mb)
+        if not self.governor.enabled:
+            return
+        previous = self.governor.update(cpu_percent, rss_mb)
+        if previous is None:
+            return
+        self.collector.resize(max(1, int(self.collection_workers * self.governor.worker_factor)))
+        self.batcher.add({'eventType': SELF_METRICS_EVENT_TYPE, **self.governor.event(previous, cpu_percent, rss_mb)},
+                         self.attributes)
+        self.batcher.flush()
+
+    def emit_self_metrics(self):
+        """Posts the integration's own timings, payload sizes and counters as NriDatabricksSelfMetrics events."""
+        self.self_metrics_emitted = time.monotonic()
+        attributes = {'pollInterval': self.poll_interval, 'selfMetricsInterval': self.self_metrics_interval,
+                      'governorLevel': self.governor.level}
+        nr_events = telemetry.to_events(attributes)
+        sender_stats = {f'sender.{name}': value for name, value in self.sender.stats().items()}
+        nr_events.append({'eventType': SELF_METRICS_EVENT_TYPE, 'metric': 'sender', **sender_stats, **attributes})
+        self.batcher.add_all(nr_events, self.attributes)
+        self.batcher.flush()
+
+    def poll(self):
+        """Collects once from every cluster. Returns False if the applications of a cluster could not be listed."""
+        logger.debug("Executing integration")
+        self.clusters.refresh()
+        clusters = list(self.clusters)
+        if len(clusters) == 1:
+            listings = [self.list_apps(clusters[0])]
+        else:
+            listings = self.collector.map(self.list_apps, clusters)
+        self.collect_apps([(cluster, app_ids) for cluster, app_ids in zip(clusters, listings) if app_ids is not None])
+        return all(app_ids is not None for app_ids in listings)
+
+    def list_apps(self, cluster):
+        """
+        Returns the ids of the active applications of the cluster, or None if they could not be listed. The
+        ids are cached by the cluster, and a failed listing makes the cluster resolve its endpoint again.
+        """
+        cluster.resolve()
+        now = time.monotonic()
+        app_ids = cluster.cached_app_ids(now)
+        if app_ids is None:
+            app_ids = self.request_app_ids(cluster)
+            if app_ids is None:
+                cluster.invalidate()
+            else:
+                cluster.cache_app_ids(app_ids, now)
+        return app_ids
+
+    def request_app_ids(self, cluster):
+        if cluster.multi_node:
             logger.info(
-                f"cluster is running in multi node mode - port: {self.spark_master_ui_port}")
-            master_json_url = f'http://{self.driver_host}:{self.spark_master_ui_port}/json/'
-            master_json = execute_spark_request(master_json_url)
-            if master_json:
-                for active_app in master_json['activeapps']:
-                    print(active_app['id'])
-                    self.get_jobs_for_app(active_app['id'])
-                    self.get_stages_for_app(active_app['id'])
-                    self.get_executors_for_app(active_app['id'])
-                    # self.get_statistics_for_app(active_app['id'])
+                f"cluster is running in multi node mode - port: {cluster.spark_master_ui_port}")
+            master_json_url = f'http://{cluster.driver_host}:{cluster.spark_master_ui_port}/json/'
+            master_json = execute_spark_request(self.spark_session, master_json_url)
+            if master_json is not None:
+                return [active_app['id'] for active_app in master_json['activeapps']]
         else:
             logger.info(
-                f"cluster is running in single node mode - port: {self.spark_conf_ui_port}")
-            applications_json_url = f'http://{self.driver_host}:{self.spark_conf_ui_port}/api/v1/applications'
-            applications_json = execute_spark_request(applications_json_url)
-            if applications_json:
-                for application in applications_json:
-                    self.get_jobs_for_app(application['id'])
-                    self.get_stages_for_app(application['id'])
-                    self.get_executors_for_app(application['id'])
-                    # self.get_statistics_for_app(application['id'])
-
-    def get_jobs_for_app(self, app_id):
-        nr_events = []
-        url = f'http://{self.driver_host}:{self.spark_conf_ui_port}/api/v1/applications/{app_id}/jobs'
-        jobs_json = execute_spark_request(url)
+                f"cluster is running in single node mode - port: {cluster.spark_conf_ui_port}")
+            applications_json_url = f'{cluster.conf_ui_url}/api/v1/applications'
+            applications_json = execute_spark_request(self.spark_session, applications_json_url)
+            if applications_json is not None:
+                return [application['id'] for application in applications_json]
+        return None
+
+    def collect_apps(self, listings):
+        """Collects the applications of every (cluster, application ids) listing in one shared collection run."""
+        tasks = []
+        optional = self.governor.optional_collectors
+        for cluster, app_ids in listings:
+            cluster.watermarks.retain(set(app_ids))
+            cluster.executor_samples.evict(keep=set(app_ids))
+            for app_id in app_ids:
+                tasks.append(CollectionTask(app_id, 'jobs', self.get_jobs_for_app, cluster))
+                tasks.append(CollectionTask(app_id, 'stages', self.get_stages_for_app, cluster))
+                tasks.append(CollectionTask(app_id, 'executors', self.get_executors_for_app, cluster))
+                if self.dstream_statistics and optional:
+                    tasks.append(CollectionTask(app_id, 'statistics', self.get_statistics_for_app, cluster))
+            if cluster.progress_tail is not None and optional:
+                tasks.append(CollectionTask(None, 'streaming', self.get_streaming_progress, cluster))
+        self.collector.run(tasks)
+        self.batcher.flush()
+        if self.metrics:
+            for payload, count in self.metrics.harvest(self.labels):
+                self.sender.submit(payload, count, NewRelic.METRICS)
+        self.active_count = sum(cluster.watermarks.open_count() for cluster in self.clusters)
+        logger.info(f'sender stats {self.sender.stats()}')
+
+    def get_jobs_for_app(self, cluster, app_id):
+        url = f'{cluster.conf_ui_url}/api/v1/applications/{app_id}/jobs'
         logger.debug("Processing jobs")
-        for job in jobs_json:
-            logger.debug(job)
-            nr_event = {key: value for key,
-                        value in job.items() if key in job_keys}
-            nr_event['eventType'] = 'SparkJob'
-            nr_event.update(self.labels)
-            nr_events.append(nr_event)
-        if nr_events:
-            self.post_events(nr_events)
-
-    def get_stages_for_app(self, app_id):
-        nr_events = []
-        url = f'http://{self.driver_host}:{self.spark_conf_ui_port}/api/v1/applications/{app_id}/stages'
-        stages_json = execute_spark_request(url)
+        self.collect_incremental(cluster, app_id, 'jobs', url,
+                                 open_job_statuses, terminal_job_statuses,
+                                 self.job_projector, lambda job: (job['jobId'], job['jobId']),
+                                 'spark.job', job_summaries)
+
+    def get_stages_for_app(self, cluster, app_id):
+        url = f'{cluster.conf_ui_url}/api/v1/applications/{app_id}/stages'
         logger.debug("Processing stages")
-        for stage in stages_json:
-            logger.debug(stage)
-            nr_event = {key: value for key,
-                        value in stage.items() if key in stage_keys}
-            nr_event['eventType'] = 'SparkStage'
-            nr_event.update(self.labels)
-            nr_events.append(nr_event)
-        if nr_events:
-            self.post_events(nr_events)
-
-    def get_executors_for_app(self, app_id):
-        nr_events = []
-        url = f'http://{self.driver_host}:{self.spark_conf_ui_port}/api/v1/applications/{app_id}/executors'
-        executors_json = execute_spark_request(url)
+        emitted = [] if self.task_collection and self.governor.optional_collectors else None
+        if self.collect_incremental(cluster, app_id, 'stages', url,
+                                    open_stage_statuses, terminal_stage_statuses,
+                                    self.stage_projector,
+                                    lambda stage: (stage['stageId'], (stage['stageId'], stage['attemptId'])),
+                                    'spark.stage', stage_summaries, emitted, task_stage_fields) and emitted:
+            self.collect_tasks(cluster, app_id, emitted)
+
+    def collect_incremental(self, cluster, app_id, kind, url, open_statuses, terminal_statuses, projector, identify,
+                            metric_prefix, summaries, emitted=None, emitted_fields=()):
+        """
+        Emits every open (running/pending) entity and only those completed entities that were not emitted by
+        a previous poll. Both listings are streamed, and the terminal listing is closed as soon as the rest of
+        it is known to have been emitted already. The watermark is only advanced when both listings were read
+        successfully, in which case True is returned. If a listing fails part way, the completed entities
+        emitted before the failure are still committed, so the next poll does not emit them again. With the
+        metrics output, completed entities are also aggregated into metrics. For every emitted event, the
+        emitted_fields of the spark entity are appended to emitted as a dict if it is given.
+        """
+        watermark = cluster.watermarks.get(app_id, kind)
+        attributes = cluster.attributes
+        debug = logger.isEnabledFor(logging.DEBUG)
+        project = projector.project
+        add = self.batcher.add
+        update = watermark.begin()
+        try:
+            with contextlib.closing(execute_spark_stream(self.spark_session, f'{url}?{open_statuses}')) as items:
+                for item in items:
+                    if debug:
+                        logger.debug(item)
+                    entity_id, key = identify(item)
+                    update.observe_open(entity_id, key)
+                    nr_event = project(item)
+                    if nr_event is None:
+                        telemetry.increment('events_filtered', projector.event_type)
+                        continue
+                    add(nr_event, attributes)
+                    if emitted is not None:
+                        emitted.append({name: item.get(name) for name in emitted_fields})
+            with contextlib.closing(execute_spark_stream(self.spark_session, f'{url}?{terminal_statuses}')) as items:
+                for item in items:
+                    entity_id, key = identify(item)
+                    if update.exhausted(entity_id):
+                        break
+                    if update.observe_completed(entity_id, key):
+                        if debug:
+                            logger.debug(item)
+                        nr_event = project(item)
+                        if nr_event is None:
+                            telemetry.increment('events_filtered', projector.event_type)
+                            continue
+                        add(nr_event, attributes)
+                        if emitted is not None:
+                            emitted.append({name: item.get(name) for name in emitted_fields})
+                        if self.metrics:
+                            self.record_completed(cluster, app_id, item, metric_prefix, summaries)
+        except SparkApiException:
+            logger.exception(f'error collecting {projector.event_type} events')
+            cluster.invalidate()
+            watermark.commit(update, complete=False)
+            return False
+        watermark.commit(update)
+        return True
+
+    def collect_tasks(self, cluster, app_id, stages):
+        """
+        Emits a SparkStageTasks event with the p50/p95/p99/max of the task metrics and SparkTaskStraggler events
+        for the slowest tasks of the active and newly completed stage attempts, active ones first. The
+        quantiles come from the taskSummary endpoint; where spark does not serve it, up to max_tasks tasks of
+        the taskList are folded into quantile sketches instead.
+        """
+        stages = [stage for stage in stages
+                  if stage.get('status') in ('ACTIVE', 'COMPLETE', 'FAILED') and stage.get('numTasks')]
+        stages.sort(key=lambda stage: stage.get('status') != 'ACTIVE')
+        if len(stages) > self.task_max_stages:
+            logger.debug(f'sampling tasks of {self.task_max_stages} of {len(stages)} stages of app {app_id}')
+            del stages[self.task_max_stages:]
+        for stage in stages:
+            url = f'{cluster.conf_ui_url}/api/v1/applications/{app_id}/stages/{stage["stageId"]}/{stage["attemptId"]}'
+            try:
+                nr_events = self.summarize_tasks(cluster, url, stage)
+            except SparkApiException:
+                logger.exception(f'error collecting tasks of stage {stage["stageId"]} of app {app_id}')
+                continue
+            self.batcher.add_all(nr_events, cluster.attributes)
+
+    def summarize_tasks(self, cluster, url, stage):
+        if cluster.task_summary:
+            try:
+                summary = fetch_spark_json(self.spark_session, f'{url}/taskSummary?quantiles={TASK_SUMMARY_QUANTILES}')
+            except SparkApiException as e:
+                # spark versions without the endpoint answer 404, or 400 for the quantiles parameter
+                if e.status_code in (400, 404):
+                    logger.info(f'taskSummary is not available on cluster {cluster}, folding task lists instead')
+                    cluster.task_summary = False
+                else:
+                    # possibly transient, the endpoint is used again for the next stage
+                    logger.warning(f'error requesting the taskSummary of {url}, folding its task list instead: {e}')
+                summary = None
+            if summary is not None:
+                nr_events = [stage_tasks_event(stage, summary)]
+                if self.task_top_n:
+                    slowest = execute_spark_request(self.spark_session,
+                                                    f'{url}/taskList?length={self.task_top_n}&sortBy=-runtime')
+                    nr_events.extend(straggler_event(stage, task, rank)
+                                     for rank, task in enumerate(slowest or (), 1))
+                return nr_events
+
+        sketch = TaskSketch(self.task_top_n)
+        with contextlib.closing(execute_spark_stream(self.spark_session,
+                                                     f'{url}/taskList?length={self.task_max_tasks}')) as tasks:
+            for task in tasks:
+                sketch.add(task)
+        nr_events = [sketch.event(stage)]
+        nr_events.extend(straggler_event(stage, task, rank) for rank, task in enumerate(sketch.stragglers(), 1))
+        return nr_events
+
+    def get_executors_for_app(self, cluster, app_id):
+        url = f'{cluster.conf_ui_url}/api/v1/applications/{app_id}/executors'
+        executors_json = execute_spark_request(self.spark_session, url)
+        if executors_json is None:
+            cluster.invalidate()
+            return
         logger.debug("Processing executors")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        now = time.monotonic()
         for executor in executors_json:
-            logger.debug(executor)
-            nr_event = {key: value for key,
-                        value in executor.items() if key in executor_keys}
-            nr_event['eventType'] = 'SparkExecutor'
-            nr_event.update(self.labels)
-            for k, v in executor['memoryMetrics'].items():
-                nr_event[k] = v
-            nr_events.append(nr_event)
-        if nr_events:
-            self.post_events(nr_events)
-
-    def get_statistics_for_app(self, app_id):
-        nr_events = []
-        url = f'http://{self.driver_host}:{self.spark_conf_ui_port}/api/v1/applications/{app_id}/streaming/statistics'
-        stream_stats_json = execute_spark_request(url)
+            if debug:
+                logger.debug(executor)
+            # counters are sampled and aggregated from the listing, whatever the executor filter keeps
+            deltas = cluster.executor_samples.deltas((app_id, executor.get('id')), executor, now)
+            if self.metrics:
+                self.record_executor(cluster, app_id, executor, deltas)
+            if self.output == 'metrics':
+                continue
+            nr_event = self.executor_projector(executor)
+            if nr_event is None:
+                telemetry.increment('events_filtered', 'SparkExecutor')
+                continue
+            add_deltas(nr_event, deltas)
+            self.batcher.add(nr_event, cluster.attributes)
+
+    def record_executor(self, cluster, app_id, executor, deltas):
+        """Aggregates an executor as listed by spark, its memoryMetrics included, and its counter deltas."""
+        attributes = {**cluster.dimensions, 'appId': app_id, 'executorId': executor.get('id')}
+        memory_metrics = executor.get('memoryMetrics') or {}
+        for name in executor_gauges:
+            value = executor.get(name, memory_metrics.get(name))
+            if isinstance(value, (int, float)):
+                self.metrics.gauge(f'spark.executor.{name}', value, attributes)
+        for name, (delta, _) in deltas.items():
+            self.metrics.count(f'spark.executor.{name}', delta, attributes)
+
+    def record_completed(self, cluster, app_id, item, metric_prefix, summaries):
+        """Aggregates a completed job or stage as listed by spark, whatever fields its event was projected to."""
+        attributes = {**cluster.dimensions, 'appId': app_id, 'status': item.get('status')}
+        self.metrics.count(f'{metric_prefix}.completed', 1, attributes)
+        for name in summaries:
+            value = item.get(name)
+            if isinstance(value, (int, float)):
+                self.metrics.summary(f'{metric_prefix}.{name}', value, attributes)
+
+    def get_statistics_for_app(self, cluster, app_id):
+        """Legacy DStream statistics; the endpoint returns a single object for the application's streaming context."""
+        url = f'{cluster.conf_ui_url}/api/v1/applications/{app_id}/streaming/statistics'
+        stream_stats = execute_spark_request(self.spark_session, url)
+        if not isinstance(stream_stats, dict):
+            return
         logger.debug("Processing streaming statistics")
-        for stream_stats in stream_stats_json:
-            logger.debug(stream_stats)
-            nr_event = {key: value for key,
-                        value in stream_stats.items() if key in stream_stat_keys}
-            nr_event['eventType'] = 'SparkStreamingStatistics'
-            nr_event.update(self.labels)
-            nr_events.append(nr_event)
-        if nr_events:
-            self.post_events(nr_events)
-
-    def post_events(self, nr_events):
-        nr_session = new_retry_session()
-        # since the max number of events that can be posted in a single payload to New Relic is 2000
-        max_events = 2000
-        events_batches = [nr_events[i:i + max_events]
-                          for i in range(0, len(nr_events), max_events)]
-
-        for events_batch in events_batches:
-            status_code = NewRelic.post_events(
-                nr_session, events_batch, self.labels)
-            if status_code != 200:
-                logger.error(
-                    f'newrelic events collector responded with status code {status_code}')
-            else:
-                logger.info(
-                    f"{len(events_batch)} events posted to newrelic event collector")
+        logger.debug(stream_stats)
+        nr_event = self.stream_stat_projector(stream_stats)
+        if nr_event is not None:
+            self.batcher.add(nr_event, cluster.attributes)
+
+    def get_streaming_progress(self, cluster, app_id=None):
+        """
+        Emits one SparkStreamingQueryProgress event per structured streaming micro-batch appended to the
+        cluster's event logs since the last poll. Every batch is emitted once, also when several batches
+        completed within one poll interval.
+        """
+        for progress in cluster.progress_tail.read():
+            cluster.progress.offer(progress)
+        batches, dropped = cluster.progress.drain()
+        for query_id, count in dropped.items():
+            logger.warning(f'dropped {count} batches of streaming query {query_id} exceeding the progress history')
+            telemetry.increment('streaming_batches_dropped', value=count)
+        logger.debug(f'Processing {len(batches)} streaming query progress reports')
+        for progress in batches:
+            self.batcher.add(progress_event(progress), cluster.attributes)
+
+    def run_once(self, deadline):
+        """
+        Collects once and delivers the events within deadline seconds, for single-shot runs. Collection stops
+        waiting for the spark UI once all but the DELIVERY_SHARE of the deadline has passed, and the events
+        collected by then are flushed together and delivered within the rest. Returns False if the
+        collection failed or did not finish in time, or if events were not delivered.
+        """
+        end = time.monotonic() + deadline
+        self.collector.until = end - deadline * DELIVERY_SHARE
+        failed = []
+
+        def poll():
+            try:
+                if not self.poll():
+                    failed.append(True)
+            except Exception:
+                logger.exception('error collecting events')
+                failed.append(True)
+
+        # the listing of a single cluster does not go through the collector, the poll is bounded as a whole
+        thread = threading.Thread(target=poll, name='nri-databricks-poll', daemon=True)
+        with telemetry.timer('poll_seconds'):
+            thread.start()
+            thread.join(max(0, self.collector.until - time.monotonic()))
+        if thread.is_alive():
+            logger.warning(f'collection did not finish within the deadline of {deadline}s, '
+                           f'delivering the events collected so far')
+        delivered = self.close(timeout=max(0, end - time.monotonic()))
+        if not delivered:
+            logger.error(f'events were not delivered within the deadline of {deadline}s')
+        return delivered and not thread.is_alive() and not failed
+
+    def close(self, timeout=None):
+        """
+        Flushes buffered events and waits up to timeout seconds for their delivery. Returns False if events
+        were lost or not delivered in time.
+        """
+        self.batcher.flush()
+        return self.sender.close(timeout)
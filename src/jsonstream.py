@@ -0,0 +1,48 @@
+import codecs
+import json
+import re
+
+_SKIP = re.compile(r'[\s,]*')
+_WHITESPACE = re.compile(r'\s*')
+# what may follow a complete element of an array
+_DELIMITERS = frozenset(',] \t\n\r')
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally parses a JSON array from an iterable of byte chunks and yields its elements one at a time,
+    so only the element being parsed and the current chunk are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    started = False
+    for chunk in chunks:
+        buffer = buffer[pos:] + text_decoder.decode(chunk)
+        pos = 0
+        if not started:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                continue
+            if buffer[pos] != '[':
+                raise ValueError(f'expected a JSON array but found {buffer[pos:pos + 20]!r}')
+            started = True
+            pos += 1
+        while True:
+            pos = _SKIP.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            if buffer[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the element continues in the next chunk
+                break
+            if not isinstance(item, (dict, list, str)) and (end == len(buffer) or buffer[end] not in _DELIMITERS):
+                # a number or literal may continue in the next chunk, like -2500 of -2500.0
+                break
+            yield item
+            pos = end
+    raise ValueError('truncated JSON array')
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import codec
+
+# metrics per metric API payload
+MAX_METRICS = 2000
+
+
+class MetricAggregator:
+    """
+    Aggregates values into dimensional metrics over one interval: gauges keep the last value, counts add up
+    and summaries keep count, sum, min and max. harvest() returns the interval as metric API payloads in the
+    common block format, with the shared attributes (labels) in the common block.
+    """
+
+    def __init__(self, compression_level=codec.DEFAULT_COMPRESSION_LEVEL):
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._gauges = {}
+        self._counts = {}
+        self._summaries = {}
+
+    def gauge(self, name, value, attributes):
+        key = (name, tuple(sorted(attributes.items())))
+        with self._lock:
+            self._gauges[key] = (value, time.time())
+
+    def count(self, name, value, attributes):
+        key = (name, tuple(sorted(attributes.items())))
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + value
+
+    def summary(self, name, value, attributes):
+        key = (name, tuple(sorted(attributes.items())))
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                self._summaries[key] = {'count': 1, 'sum': value, 'min': value, 'max': value}
+            else:
+                summary['count'] += 1
+                summary['sum'] += value
+                if value < summary['min']:
+                    summary['min'] = value
+                if value > summary['max']:
+                    summary['max'] = value
+
+    def harvest(self, common_attributes=None):
+        """Returns the gzip compressed payloads of the current interval and its metric count, and starts a new interval."""
+        now = time.time()
+        with self._lock:
+            start, self._start = self._start, now
+            gauges, self._gauges = self._gauges, {}
+            counts, self._counts = self._counts, {}
+            summaries, self._summaries = self._summaries, {}
+
+        metrics = []
+        for (name, attributes), (value, timestamp) in gauges.items():
+            metrics.append({'name': name, 'type': 'gauge', 'value': value, 'timestamp': int(timestamp * 1000),
+                            'attributes': dict(attributes)})
+        for (name, attributes), value in counts.items():
+            metrics.append({'name': name, 'type': 'count', 'value': value, 'attributes': dict(attributes)})
+        for (name, attributes), value in summaries.items():
+            metrics.append({'name': name, 'type': 'summary', 'value': value, 'attributes': dict(attributes)})
+
+        common = {'timestamp': int(start * 1000), 'interval.ms': max(1, int((now - start) * 1000))}
+        if common_attributes:
+            common['attributes'] = common_attributes
+        payloads = []
+        for i in range(0, len(metrics), MAX_METRICS):
+            batch = metrics[i:i + MAX_METRICS]
+            payload = codec.compress(codec.dumps([{'common': common, 'metrics': batch}]), self.compression_level)
+            payloads.append((payload, len(batch)))
+        return payloads
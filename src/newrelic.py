@@ -1,9 +1,11 @@
-import gzip
-import json
 import logging
+from urllib.parse import urlparse
 
 from requests import RequestException
 
+import codec
+from telemetry import telemetry
+
 logger = logging.getLogger('nri-databricks')
 
 
@@ -14,9 +16,22 @@ class NewRelicApiException(Exception):
 class NewRelic:
     US_EVENTS_ENDPOINT = "https://insights-collector.newrelic.com/v1/accounts/{account_id}/events"
     EU_EVENTS_ENDPOINT = "https://insights-collector.eu01.nr-data.net/v1/accounts/{account_id}/events"
+    US_METRICS_ENDPOINT = "https://metric-api.newrelic.com/metric/v1"
+    EU_METRICS_ENDPOINT = "https://metric-api.eu.newrelic.com/metric/v1"
+    # Metric API endpoint of the region of every Event API host
+    REGION_METRICS_ENDPOINTS = {
+        'insights-collector.newrelic.com': US_METRICS_ENDPOINT,
+        'insights-collector.eu01.nr-data.net': EU_METRICS_ENDPOINT,
+        'gov-insights-collector.newrelic.com': 'https://gov-metric-api.newrelic.com/metric/v1',
+    }
     CONTENT_ENCODING = 'gzip'
 
+    # payload kinds
+    EVENTS = 'events'
+    METRICS = 'metrics'
+
     events_api_endpoint = US_EVENTS_ENDPOINT
+    metrics_api_endpoint = US_METRICS_ENDPOINT
     events_api_key = ''
 
     @classmethod
@@ -28,16 +43,43 @@ class NewRelic:
         NewRelic.events_api_endpoint = api_endpoint.format(account_id=nr_account_id)
         logger.info(f'Setting New Relic API endpoint {NewRelic.events_api_endpoint}')
 
+    @classmethod
+    def region_metrics_api_endpoint(cls, api_endpoint):
+        """Returns the Metric API endpoint of the region of an Event API endpoint, or None if it is not known."""
+        if api_endpoint in ('US', 'EU'):
+            return api_endpoint
+        return cls.REGION_METRICS_ENDPOINTS.get(urlparse(api_endpoint).hostname)
+
+    @classmethod
+    def set_metrics_api_endpoint(cls, api_endpoint):
+        if api_endpoint == "US":
+            api_endpoint = NewRelic.US_METRICS_ENDPOINT
+        elif api_endpoint == "EU":
+            api_endpoint = NewRelic.EU_METRICS_ENDPOINT
+        NewRelic.metrics_api_endpoint = api_endpoint
+        logger.info(f'Setting New Relic metric API endpoint {NewRelic.metrics_api_endpoint}')
+
     @classmethod
     def post_events(cls, session, data, labels):
-        payload = gzip.compress(json.dumps(data).encode())
+        payload = codec.compress(codec.dumps(data))
+        return cls.post_payload(session, payload).status_code
+
+    @classmethod
+    def post_payload(cls, session, payload, kind=EVENTS):
+        """
+        Posts an already gzip compressed payload and returns the response. kind selects the API: a JSON array
+        of events for the event API, or the common block format for the metric API.
+        """
+        endpoint = cls.metrics_api_endpoint if kind == NewRelic.METRICS else cls.events_api_endpoint
         headers = {
             "Api-Key": cls.events_api_key,
             "Content-Encoding": cls.CONTENT_ENCODING,
         }
+        telemetry.record('payload_bytes', len(payload), kind)
         try:
-            r = session.post(cls.events_api_endpoint, data=payload,
-                             headers=headers)
+            with telemetry.timer('ingest_post_seconds', kind):
+                r = session.post(endpoint, data=payload,
+                                 headers=headers)
         except RequestException as e:
             raise NewRelicApiException(repr(e)) from e
-        return r.status_code
+        return r
@@ -0,0 +1,58 @@
+class Projector:
+    """
+    Projects spark REST entities onto New Relic events. The projection is compiled once per event type into
+    a plain function that copies the selected fields, so no per-record key filtering is done.
+
+    fields maps source fields to event attribute names; a source field may be a dotted path into a nested
+    object ('memoryMetrics.usedOnHeapStorageMemory'). All fields of the nested objects listed in flatten are
+    copied onto the event as they are.
+
+    An EventFilter narrows the fields to its include and exclude lists and makes the projection return None
+    for items matching its drop rules or left out by its sampling, before the event is built. Drop rules and
+    sampling keys refer to the top level fields of the item.
+    """
+
+    def __init__(self, event_type, fields, flatten=(), event_filter=None):
+        self.event_type = event_type
+        self.event_filter = event_filter
+        self.fields = dict(fields)
+        if event_filter is not None:
+            self.fields = {source: target for source, target in self.fields.items() if event_filter.keeps(target)}
+        self.flatten = tuple(flatten)
+        self.project = self._compile()
+
+    def __call__(self, item):
+        return self.project(item)
+
+    def _compile(self):
+        lines = ['def project(item):',
+                 '    get = item.get']
+        if self.event_filter is not None:
+            lines.extend(f'    {line}' for line in self.event_filter.condition_lines('get'))
+        lines.append('    event = {"eventType": event_type}')
+        for source, target in self.fields.items():
+            path = source.split('.')
+            if len(path) == 1:
+                lines.append(f'    if {source!r} in item:')
+                lines.append(f'        event[{target!r}] = item[{source!r}]')
+                continue
+            lines.append(f'    value = get({path[0]!r})')
+            for part in path[1:-1]:
+                lines.append(f'    value = value.get({part!r}) if isinstance(value, dict) else None')
+            lines.append(f'    if isinstance(value, dict) and {path[-1]!r} in value:')
+            lines.append(f'        event[{target!r}] = value[{path[-1]!r}]')
+        narrowed = self.event_filter is not None and \
+            (self.event_filter.include is not None or self.event_filter.exclude)
+        for name in self.flatten:
+            lines.append(f'    nested = get({name!r})')
+            lines.append(f'    if nested:')
+            if narrowed:
+                lines.append(f'        event.update((key, value) for key, value in nested.items() if keeps(key))')
+            else:
+                lines.append(f'        event.update(nested)')
+        lines.append('    return event')
+        namespace = {'event_type': self.event_type}
+        if self.event_filter is not None:
+            namespace.update(self.event_filter.compiled_globals())
+        exec('\n'.join(lines), namespace)
+        return namespace['project']
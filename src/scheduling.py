@@ -0,0 +1,98 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
+from apscheduler.triggers.base import BaseTrigger
+
+logger = logging.getLogger('nri-databricks')
+
+JOB_ID = 'nri-databricks'
+
+
+class AdaptiveTrigger(BaseTrigger):
+    """
+    Schedules the next poll max_interval seconds out. Every completed poll replaces that with the time
+    derived from the current interval, so the trigger only decides when a poll fails to reschedule itself.
+    """
+
+    __slots__ = 'poller',
+
+    def __init__(self, poller):
+        self.poller = poller
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        if previous_fire_time is None:
+            return now
+        return previous_fire_time + timedelta(seconds=self.poller.max_interval)
+
+
+class AdaptivePoller:
+    """
+    Polls every min_interval seconds while the cluster has running jobs or active/pending stages and backs
+    off exponentially up to max_interval seconds while it is idle. A poll that runs past its interval makes
+    the poller skip the missed cycles instead of starting overlapping runs.
+    """
+
+    def __init__(self, scheduler, integration, min_interval=5, max_interval=300, backoff=2.0):
+        self.scheduler = scheduler
+        self.integration = integration
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.interval = min_interval
+
+    def start(self):
+        self.scheduler.add_job(self.poll, trigger=AdaptiveTrigger(self), id=JOB_ID,
+                               max_instances=1, coalesce=True)
+
+    def poll(self):
+        start = datetime.now(timezone.utc)
+        try:
+            self.integration.run()
+        finally:
+            self.update(self.integration.active_count)
+            self.reschedule(start)
+
+    def update(self, active_count):
+        previous = self.interval
+        if active_count:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        if self.interval != previous:
+            logger.info(f'{active_count} active jobs and stages, poll interval is now {self.interval}s')
+
+    def reschedule(self, start):
+        # the resource governor lengthens the interval of a degraded integration
+        interval = self.interval * self.integration.interval_factor
+        elapsed = (datetime.now(timezone.utc) - start).total_seconds()
+        cycles = int(elapsed // interval) + 1
+        if cycles > 1:
+            logger.warning(f'poll took {elapsed:.3f}s, longer than the {interval}s interval, '
+                           f'skipping {cycles - 1} cycles')
+        self.scheduler.modify_job(JOB_ID, next_run_time=start + timedelta(seconds=interval * cycles))
+
+
+class FixedPoller:
+    """
+    Polls every interval seconds, multiplied by the factor the resource governor applies while the
+    integration is degraded.
+    """
+
+    def __init__(self, scheduler, integration, interval):
+        self.scheduler = scheduler
+        self.integration = integration
+        self.interval = interval
+        self.factor = 1
+
+    def start(self):
+        self.scheduler.add_job(self.poll, trigger='interval', seconds=self.interval, id=JOB_ID)
+
+    def poll(self):
+        try:
+            self.integration.run()
+        finally:
+            factor = self.integration.interval_factor
+            if factor != self.factor:
+                self.factor = factor
+                logger.info(f'poll interval is now {self.interval * factor}s')
+                self.scheduler.reschedule_job(JOB_ID, trigger='interval', seconds=self.interval * factor)
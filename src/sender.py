@@ -0,0 +1,212 @@
+import collections
+import logging
+import threading
+import time
+
+from newrelic import NewRelic, NewRelicApiException
+
+logger = logging.getLogger('nri-databricks')
+
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+
+class AsyncSender:
+    """
+    Delivers compressed event payloads to New Relic from background threads so that collection never waits
+    for the collector. Payloads are kept in a bounded in-memory queue; when it is full the oldest payload is
+    dropped (drop_oldest) or the producer waits for room (block).
+
+    With a spool, payloads that can not be delivered, are dropped from a full queue or are still queued on
+    close are written to disk instead of being lost. They are replayed in order, at most replay_rate payloads
+    per second, while deliveries succeed.
+    """
+
+    def __init__(self, session, queue_size=100, workers=2, full_policy=DROP_OLDEST, spool=None, replay_rate=2.0):
+        if full_policy not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f'unknown sender queue full policy {full_policy}')
+        self.session = session
+        self.queue_size = queue_size
+        self.full_policy = full_policy
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._closed = False
+        # payloads taken from the queue and not yet handled, and payloads lost since the last drain
+        self._in_flight = 0
+        self._lost = 0
+        self.counters = collections.Counter()
+        self.spool = spool
+        self.replay_rate = replay_rate
+        self._healthy = threading.Event()
+        self._healthy.set()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name=f'nri-databricks-sender-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if spool is not None:
+            self._replayer = threading.Thread(target=self._replay, name='nri-databricks-replay', daemon=True)
+            self._replayer.start()
+
+    def submit(self, payload, count, kind=NewRelic.EVENTS):
+        """
+        Queues a payload for delivery. Returns False if the sender is closed, also while waiting for room in a
+        full queue; the payload is spooled then if there is a spool, and dropped otherwise.
+        """
+        with self._lock:
+            while not self._closed and len(self._queue) >= self.queue_size:
+                if self.full_policy == BLOCK:
+                    self._not_full.wait()
+                else:
+                    oldest, dropped, dropped_kind = self._queue.popleft()
+                    if self.spool is not None:
+                        self._spool(oldest, dropped, dropped_kind)
+                        continue
+                    self.counters['payloads_dropped'] += 1
+                    self.counters[f'{dropped_kind}_dropped'] += dropped
+                    self._lost += 1
+                    logger.warning(f'sender queue is full, dropping the oldest payload of {dropped} {dropped_kind}')
+            if self._closed:
+                if self.spool is not None:
+                    self._spool(payload, count, kind)
+                else:
+                    self.counters['payloads_dropped'] += 1
+                    self.counters[f'{kind}_dropped'] += count
+                    self._lost += 1
+                    logger.warning(f'sender is closed, dropping a payload of {count} {kind}')
+                return False
+            self._queue.append((payload, count, kind))
+            self.counters['payloads_queued'] += 1
+            self._not_empty.notify()
+            return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['queue_depth'] = len(self._queue)
+        if self.spool is not None:
+            stats['spool_bytes'] = self.spool.size()
+        return stats
+
+    def drain(self, timeout=None):
+        """
+        Waits up to timeout seconds until every submitted payload was delivered, rejected by New Relic or
+        spooled. Returns False if it timed out or if payloads were lost since the previous drain.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._queue or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+            lost, self._lost = self._lost, 0
+        return not lost
+
+    def close(self, timeout=None):
+        """
+        Stops accepting payloads and waits up to timeout seconds for the queue to drain. Returns False if
+        payloads were lost, or are still being sent when the timeout expires.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            # producers waiting for room in a full queue give up
+            self._not_full.notify_all()
+        self._healthy.set()
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        with self._lock:
+            remaining = list(self._queue)
+            self._queue.clear()
+            if self.spool is not None:
+                for payload, count, kind in remaining:
+                    self._spool(payload, count, kind)
+            else:
+                self._lost += len(remaining)
+            delivered = not self._lost and not self._in_flight
+        if self.spool is not None:
+            self.spool.close()
+        elif remaining:
+            logger.warning(f'sender closed with {len(remaining)} undelivered payloads')
+        return delivered
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._closed:
+                    self._not_empty.wait()
+                if not self._queue:
+                    return
+                payload, count, kind = self._queue.popleft()
+                self._in_flight += 1
+                self._not_full.notify()
+            sent = self._send(payload, count, kind)
+            with self._lock:
+                if not sent:
+                    if self.spool is not None:
+                        self._spool(payload, count, kind)
+                    else:
+                        self._lost += 1
+                self._in_flight -= 1
+                if not self._queue and not self._in_flight:
+                    self._idle.notify_all()
+
+    def _replay(self):
+        while not self._closed:
+            self._healthy.wait()
+            record = self.spool.peek() if not self._closed else None
+            if record is None:
+                time.sleep(1)
+                continue
+            payload, count, kind = record
+            if self._send(payload, count, kind, replay=True):
+                self.spool.advance()
+                self._count(payloads_replayed=1)
+            time.sleep(1 / self.replay_rate)
+
+    def _spool(self, payload, count, kind):
+        try:
+            self.spool.append(payload, count, kind)
+            self.counters['payloads_spooled'] += 1
+        except OSError:
+            logger.exception(f'error spooling {count} {kind}, dropping them')
+            self.counters['payloads_dropped'] += 1
+            self.counters[f'{kind}_dropped'] += count
+            self._lost += 1
+
+    def _send(self, payload, count, kind, replay=False):
+        """Returns False if the payload could not be delivered and should be retried later."""
+        try:
+            response = NewRelic.post_payload(self.session, payload, kind)
+        except NewRelicApiException:
+            logger.exception(f'error posting {count} {kind} to newrelic')
+            self._count(payloads_failed=1, **{f'{kind}_failed': count})
+            self._healthy.clear()
+            return False
+        retries = response.raw.retries
+        if retries is not None and retries.history:
+            self._count(retries=len(retries.history))
+        # the event API answers 200, the metric API 202
+        if not 200 <= response.status_code < 300:
+            logger.error(
+                f'newrelic {kind} collector responded with status code {response.status_code}')
+            self._count(payloads_failed=1, **{f'{kind}_failed': count})
+            if response.status_code == 429 or response.status_code >= 500:
+                self._healthy.clear()
+                return False
+            # the collector rejected the payload itself, sending it again would not help
+            return True
+        logger.info(
+            f"{count} {kind} {'replayed' if replay else 'posted'} to newrelic {kind} collector")
+        self._count(payloads_sent=1, bytes_sent=len(payload), **{f'{kind}_sent': count})
+        self._healthy.set()
+        return True
+
+    def _count(self, **values):
+        with self._lock:
+            self.counters.update(values)
@@ -0,0 +1,49 @@
+import math
+
+
+class QuantileSketch:
+    """
+    Streaming quantile sketch with logarithmically sized buckets. Quantiles of positive values are returned
+    within relative_accuracy of the exact value, using memory proportional to the logarithm of the value range
+    rather than the number of values. Zero and negative values are counted in a single bucket.
+    """
+
+    __slots__ = 'gamma', 'log_gamma', 'buckets', 'zero_count', 'count', 'sum', 'min', 'max'
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        # nearest rank, so high quantiles of a few values report the largest of them
+        rank = max(0, math.ceil(q * self.count) - 1)
+        if rank < self.zero_count:
+            return min(self.min, 0)
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return max(self.min, min(self.max, value))
+        return self.max
@@ -0,0 +1,226 @@
+import fcntl
+import logging
+import os
+import struct
+import threading
+
+logger = logging.getLogger('nri-databricks')
+
+# record header: payload length, event count, payload kind
+_HEADER = struct.Struct('>IIB')
+_KINDS = ('events', 'metrics')
+_SEGMENT_SUFFIX = '.seg'
+_CURSOR_FILE = 'cursor'
+_LOCK_FILE = 'lock'
+
+
+class DiskSpool:
+    """
+    Append-only, size capped spool of undelivered gzip payloads. Records are appended to numbered segment
+    files; a cursor file holds the segment and offset of the next record to replay. Segments that have been
+    fully replayed are deleted, and when the spool grows beyond max_bytes the oldest segments are discarded.
+
+    A spool is owned by one process at a time, which holds an exclusive lock on the lock file of the
+    directory; BlockingIOError is raised if another process owns it. See open_spool for processes sharing a
+    directory.
+    """
+
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024, segment_bytes=4 * 1024 * 1024, private=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.private = private
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, _LOCK_FILE), 'ab')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise
+
+        self._segments = sorted(int(name[:-len(_SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                                if name.endswith(_SEGMENT_SUFFIX))
+        self._cursor = self._read_cursor()
+        for segment in [segment for segment in self._segments if segment < self._cursor[0]]:
+            # replayed before a restart but not yet removed
+            self._segments.remove(segment)
+            self._remove(segment)
+        if self._segments and self._cursor[0] != self._segments[0]:
+            self._cursor = (self._segments[0], 0)
+        self._writer = None
+        if not private:
+            self._adopt()
+        if self._segments:
+            logger.info(f'spool {directory} holds {self.size()} bytes of undelivered payloads')
+
+    def append(self, payload, count, kind='events'):
+        with self._lock:
+            if self._writer is None or self._writer.tell() >= self.segment_bytes:
+                self._roll()
+            self._writer.write(_HEADER.pack(len(payload), count, _KINDS.index(kind)))
+            self._writer.write(payload)
+            self._writer.flush()
+            self._enforce_limit()
+
+    def peek(self):
+        """Returns the next (payload, count, kind) record to replay without consuming it, or None."""
+        with self._lock:
+            while self._segments:
+                segment, offset = self._cursor
+                record = self._read_record(segment, offset)
+                if record is not None:
+                    return record[:3]
+                if segment == self._segments[-1]:
+                    return None
+                # a record truncated by a crash, the rest of the segment can not be read
+                self._next_segment()
+            return None
+
+    def advance(self):
+        """Consumes the record returned by the last peek."""
+        with self._lock:
+            segment, offset = self._cursor
+            record = self._read_record(segment, offset)
+            if record is None:
+                return
+            self._cursor = (segment, record[3])
+            if segment != self._segments[-1] and self._read_record(*self._cursor) is None:
+                self._next_segment()
+            self._write_cursor()
+
+    def empty(self):
+        return self.peek() is None
+
+    def size(self):
+        total = 0
+        for segment in self._segments:
+            try:
+                total += os.path.getsize(self._path(segment))
+            except OSError:
+                pass
+        return total - self._cursor[1]
+
+    def close(self):
+        """Releases the spool. The directory of an empty private spool is removed."""
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        if self.private and self.empty():
+            for name in os.listdir(self.directory):
+                self._remove_file(name)
+            try:
+                os.rmdir(self.directory)
+            except OSError:
+                logger.warning(f'error removing spool directory {self.directory}', exc_info=True)
+        self._lock_file.close()
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f'{segment:012d}{_SEGMENT_SUFFIX}')
+
+    def _roll(self):
+        if self._writer is not None:
+            self._writer.close()
+        segment = self._segments[-1] + 1 if self._segments else 0
+        self._segments.append(segment)
+        if len(self._segments) == 1:
+            self._cursor = (segment, 0)
+            self._write_cursor()
+        self._writer = open(self._path(segment), 'ab')
+
+    def _next_segment(self):
+        segment = self._segments.pop(0)
+        self._remove(segment)
+        if self._segments:
+            self._cursor = (self._segments[0], 0)
+        else:
+            self._cursor = (segment + 1, 0)
+        self._write_cursor()
+
+    def _enforce_limit(self):
+        while len(self._segments) > 1 and self.size() > self.max_bytes:
+            dropped = self._segments[0]
+            logger.warning(f'spool exceeds {self.max_bytes} bytes, discarding segment {self._path(dropped)}')
+            self._next_segment()
+
+    def _read_record(self, segment, offset):
+        try:
+            with open(self._path(segment), 'rb') as f:
+                f.seek(offset)
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return None
+                length, count, kind = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return None
+                return payload, count, _KINDS[kind], offset + _HEADER.size + length
+        except FileNotFoundError:
+            return None
+
+    def _adopt(self):
+        """Moves the records of the private spools of exited processes into this spool."""
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.isdigit() or not os.path.isdir(path):
+                continue
+            try:
+                orphan = DiskSpool(path, self.max_bytes, self.segment_bytes, private=True)
+            except BlockingIOError:
+                # its process is still running
+                continue
+            except OSError:
+                logger.warning(f'error opening spool {path}', exc_info=True)
+                continue
+            adopted = 0
+            record = orphan.peek()
+            while record is not None:
+                self.append(*record)
+                orphan.advance()
+                adopted += 1
+                record = orphan.peek()
+            orphan.close()
+            if adopted:
+                logger.info(f'adopted {adopted} undelivered payloads of spool {path}')
+
+    def _remove(self, segment):
+        try:
+            os.remove(self._path(segment))
+        except OSError:
+            logger.warning(f'error removing spool segment {self._path(segment)}', exc_info=True)
+
+    def _remove_file(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            logger.warning(f'error removing spool file {os.path.join(self.directory, name)}', exc_info=True)
+
+    def _read_cursor(self):
+        try:
+            with open(os.path.join(self.directory, _CURSOR_FILE), 'rt') as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except (OSError, ValueError):
+            return (self._segments[0] if self._segments else 0), 0
+
+    def _write_cursor(self):
+        path = os.path.join(self.directory, _CURSOR_FILE)
+        with open(f'{path}.tmp', 'wt') as f:
+            f.write(f'{self._cursor[0]} {self._cursor[1]}')
+        os.replace(f'{path}.tmp', path)
+
+
+def open_spool(directory, **kwargs):
+    """
+    Opens the spool in directory for this process. The service, single-shot runs and backfill workers may
+    share a spool directory: a process that finds the spool owned by another one spools to a private spool
+    in a subdirectory named by its pid instead. The private spool is removed when it is closed empty, and
+    otherwise taken over by the next process that owns the spool of the directory.
+    """
+    try:
+        return DiskSpool(directory, **kwargs)
+    except BlockingIOError:
+        private = os.path.join(directory, str(os.getpid()))
+        logger.info(f'spool {directory} is in use by another process, spooling to {private}')
+        return DiskSpool(private, private=True, **kwargs)
@@ -0,0 +1,190 @@
+import collections
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+logger = logging.getLogger('nri-databricks')
+
+STREAMING_QUERY_PROGRESS_EVENT_TYPE = 'SparkStreamingQueryProgress'
+
+DEFAULT_EVENT_LOG_DIR = '/databricks/driver/eventlogs'
+
+QUERY_PROGRESS_EVENT = b'org.apache.spark.sql.streaming.StreamingQueryListener$QueryProgressEvent'
+
+# event logs that are compressed can not be tailed, they are read by the backfill
+COMPRESSED_SUFFIXES = ('.gz', '.lz4', '.lzf', '.snappy', '.zstd', '.zst')
+
+
+def parse_timestamp(value):
+    """Returns the epoch milliseconds of a streaming progress timestamp like 2024-01-01T00:00:00.000Z."""
+    if not value:
+        return None
+    try:
+        return int(datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc).timestamp() * 1000)
+    except ValueError:
+        return None
+
+
+def progress_event(progress):
+    """Builds the SparkStreamingQueryProgress event of one micro-batch from a StreamingQueryProgress."""
+    event = {'eventType': STREAMING_QUERY_PROGRESS_EVENT_TYPE, 'queryId': progress.get('id'),
+             'runId': progress.get('runId'), 'queryName': progress.get('name'), 'batchId': progress.get('batchId')}
+    for key in ('batchDuration', 'numInputRows', 'inputRowsPerSecond', 'processedRowsPerSecond'):
+        if key in progress:
+            event[key] = progress[key]
+    for phase, duration in (progress.get('durationMs') or {}).items():
+        event[f'{phase}Ms'] = duration
+
+    timestamp = parse_timestamp(progress.get('timestamp'))
+    if timestamp is not None:
+        # the batch time, not the time it was collected
+        event['timestamp'] = timestamp
+        event_time = progress.get('eventTime') or {}
+        watermark = parse_timestamp(event_time.get('watermark'))
+        if watermark:
+            event['watermarkLagMs'] = timestamp - watermark
+        latest = parse_timestamp(event_time.get('max'))
+        if latest:
+            event['eventTimeLagMs'] = timestamp - latest
+
+    operators = progress.get('stateOperators') or []
+    if operators:
+        event['stateOperators'] = len(operators)
+        for key, name in (('numRowsTotal', 'stateRowsTotal'), ('numRowsUpdated', 'stateRowsUpdated'),
+                          ('memoryUsedBytes', 'stateMemoryUsedBytes'),
+                          ('numRowsDroppedByWatermark', 'stateRowsDroppedByWatermark')):
+            values = [operator[key] for operator in operators if isinstance(operator.get(key), (int, float))]
+            if values:
+                event[name] = sum(values)
+    sources = progress.get('sources') or []
+    if sources:
+        event['sources'] = ','.join(str(source.get('description')) for source in sources)
+    sink = progress.get('sink') or {}
+    if 'description' in sink:
+        event['sink'] = sink['description']
+    return event
+
+
+class _Query:
+    __slots__ = 'ring', 'run_id', 'high', 'dropped'
+
+    def __init__(self, history):
+        self.ring = collections.deque(maxlen=history)
+        self.run_id = None
+        self.high = -1
+        self.dropped = 0
+
+
+class QueryProgressBuffer:
+    """
+    Bounded per query history of micro-batch progress. offer() accepts every batch once per query run, no
+    matter how many batches completed since the last poll or how often the same progress is read again, and
+    drain() returns the accepted batches in order. At most history batches are kept per query between two
+    drains; older ones are counted as dropped. At most max_queries queries are remembered.
+    """
+
+    def __init__(self, history=100, max_queries=1000):
+        self.history = history
+        self.max_queries = max_queries
+        self._queries = collections.OrderedDict()
+
+    def offer(self, progress):
+        query_id = progress.get('id')
+        batch_id = progress.get('batchId')
+        if query_id is None or not isinstance(batch_id, int):
+            return False
+        query = self._queries.pop(query_id, None)
+        if query is None:
+            query = _Query(self.history)
+        self._queries[query_id] = query
+        while len(self._queries) > self.max_queries:
+            self._queries.popitem(last=False)
+
+        run_id = progress.get('runId')
+        if run_id != query.run_id:
+            # a restarted query continues from its checkpoint under a new run id
+            query.run_id = run_id
+            query.high = -1
+        if batch_id <= query.high:
+            return False
+        query.high = batch_id
+        if len(query.ring) == query.ring.maxlen:
+            query.dropped += 1
+        query.ring.append(progress)
+        return True
+
+    def drain(self):
+        """Returns the batches accepted since the last drain and the number dropped per query id."""
+        drained = []
+        dropped = {}
+        for query_id, query in self._queries.items():
+            drained.extend(query.ring)
+            query.ring.clear()
+            if query.dropped:
+                dropped[query_id] = query.dropped
+                query.dropped = 0
+        return drained, dropped
+
+
+class EventLogTail:
+    """
+    Follows the uncompressed spark event logs below directory and returns the StreamingQueryProgress of every
+    QueryProgressEvent appended since the last read. Files that exist when the tail starts are followed from
+    their end, files that appear later from their start. A file that was replaced or truncated, as happens
+    when the log is rolled, is read again from its start. Only complete lines are parsed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}
+        self._started = False
+
+    def read(self):
+        progress = []
+        seen = set()
+        for path in self._log_files():
+            seen.add(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            inode, offset = self._files.get(path, (stat.st_ino, stat.st_size if not self._started else 0))
+            if inode != stat.st_ino or stat.st_size < offset:
+                inode, offset = stat.st_ino, 0
+            if stat.st_size > offset:
+                offset = self._read_file(path, offset, progress)
+            self._files[path] = inode, offset
+        for path in [path for path in self._files if path not in seen]:
+            del self._files[path]
+        self._started = True
+        return progress
+
+    def _log_files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith(('appstatus', '.')) or name.endswith(COMPRESSED_SUFFIXES):
+                    continue
+                yield os.path.join(root, name)
+
+    @staticmethod
+    def _read_file(path, offset, progress):
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # the rest of this line has not been written yet
+                        break
+                    offset += len(line)
+                    if QUERY_PROGRESS_EVENT not in line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                        if event['Event'].endswith('$QueryProgressEvent'):
+                            progress.append(event['progress'])
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        logger.warning(f'ignoring malformed streaming query progress in {path}')
+        except OSError:
+            logger.exception(f'error reading event log {path}')
+        return offset
@@ -0,0 +1,115 @@
+import heapq
+
+from sketch import QuantileSketch
+
+STAGE_TASKS_EVENT_TYPE = 'SparkStageTasks'
+TASK_STRAGGLER_EVENT_TYPE = 'SparkTaskStraggler'
+
+# quantiles requested from taskSummary and their attribute suffixes, 1.0 being the maximum
+QUANTILES = ((0.5, 'P50'), (0.95, 'P95'), (0.99, 'P99'), (1.0, 'Max'))
+TASK_SUMMARY_QUANTILES = ','.join(str(quantile) for quantile, _ in QUANTILES)
+
+
+def _get(item, *path):
+    for part in path:
+        if not isinstance(item, dict):
+            return None
+        item = item.get(part)
+    return item
+
+
+def _sum(*values):
+    values = [value for value in values if isinstance(value, (int, float))]
+    return sum(values) if values else None
+
+
+# task metrics summarized per stage: (attribute, taskSummary path, TaskData extractor)
+task_metrics = (
+    ('duration', ('duration',), lambda task: task.get('duration')),
+    ('executorRunTime', ('executorRunTime',), lambda task: _get(task, 'taskMetrics', 'executorRunTime')),
+    ('jvmGcTime', ('jvmGcTime',), lambda task: _get(task, 'taskMetrics', 'jvmGcTime')),
+    ('inputBytes', ('inputMetrics', 'bytesRead'), lambda task: _get(task, 'taskMetrics', 'inputMetrics', 'bytesRead')),
+    ('shuffleReadBytes', ('shuffleReadMetrics', 'readBytes'),
+     lambda task: _sum(_get(task, 'taskMetrics', 'shuffleReadMetrics', 'remoteBytesRead'),
+                       _get(task, 'taskMetrics', 'shuffleReadMetrics', 'localBytesRead'))),
+    ('shuffleWriteBytes', ('shuffleWriteMetrics', 'writeBytes'),
+     lambda task: _get(task, 'taskMetrics', 'shuffleWriteMetrics', 'bytesWritten')),
+)
+
+
+def _add_skew(event):
+    # how much longer the slowest task ran than the median task
+    median = event.get('durationP50')
+    maximum = event.get('durationMax')
+    if isinstance(median, (int, float)) and isinstance(maximum, (int, float)) and median > 0:
+        event['durationSkew'] = maximum / median
+    return event
+
+
+def stage_tasks_event(stage, summary):
+    """Builds the SparkStageTasks event of a stage attempt from the quantiles of the taskSummary endpoint."""
+    event = {'eventType': STAGE_TASKS_EVENT_TYPE, 'stageId': stage.get('stageId'),
+             'attemptId': stage.get('attemptId'), 'status': stage.get('status'), 'source': 'taskSummary'}
+    for name, path, _ in task_metrics:
+        values = _get(summary, *path)
+        if not isinstance(values, list) or len(values) != len(QUANTILES):
+            continue
+        for (_, suffix), value in zip(QUANTILES, values):
+            event[f'{name}{suffix}'] = value
+    return _add_skew(event)
+
+
+def straggler_event(stage, task, rank):
+    event = {'eventType': TASK_STRAGGLER_EVENT_TYPE, 'stageId': stage.get('stageId'),
+             'attemptId': stage.get('attemptId'), 'rank': rank}
+    for key in ('taskId', 'index', 'attempt', 'executorId', 'host', 'status', 'taskLocality', 'speculative'):
+        if key in task:
+            event[key] = task[key]
+    for name, _, extract in task_metrics:
+        value = extract(task)
+        if value is not None:
+            event[name] = value
+    return event
+
+
+class TaskSketch:
+    """
+    Folds the tasks of one stage attempt into a quantile sketch per task metric and keeps the top_n tasks
+    with the longest duration, for spark versions without the taskSummary endpoint.
+    """
+
+    def __init__(self, top_n=5):
+        self.top_n = top_n
+        self.sketches = {name: QuantileSketch() for name, _, _ in task_metrics}
+        self.count = 0
+        self._slowest = []
+
+    def add(self, task):
+        self.count += 1
+        for name, _, extract in task_metrics:
+            value = extract(task)
+            if isinstance(value, (int, float)):
+                self.sketches[name].add(value)
+        duration = task.get('duration')
+        if self.top_n and isinstance(duration, (int, float)):
+            # the count breaks ties, so tasks themselves are never compared
+            entry = (duration, self.count, task)
+            if len(self._slowest) < self.top_n:
+                heapq.heappush(self._slowest, entry)
+            elif entry > self._slowest[0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def event(self, stage):
+        event = {'eventType': STAGE_TASKS_EVENT_TYPE, 'stageId': stage.get('stageId'),
+                 'attemptId': stage.get('attemptId'), 'status': stage.get('status'), 'source': 'taskList',
+                 'sampledTasks': self.count}
+        for name, sketch in self.sketches.items():
+            if not sketch.count:
+                continue
+            for quantile, suffix in QUANTILES:
+                event[f'{name}{suffix}'] = sketch.max if quantile == 1.0 else sketch.quantile(quantile)
+        return _add_skew(event)
+
+    def stragglers(self):
+        """The top_n tasks with the longest duration, slowest first."""
+        return [task for _, _, task in sorted(self._slowest, reverse=True)]
@@ -0,0 +1,80 @@
+import collections
+import contextlib
+import threading
+import time
+from urllib.parse import urlparse
+
+from sketch import QuantileSketch
+
+SELF_METRICS_EVENT_TYPE = 'NriDatabricksSelfMetrics'
+
+
+class Telemetry:
+    """
+    In-process histograms and counters describing the cost of the integration itself. Values are kept per
+    metric name and optional dimension (for example the spark endpoint) until they are collected.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = collections.Counter()
+
+    def record(self, name, value, dimension=None):
+        with self._lock:
+            histogram = self._histograms.get((name, dimension))
+            if histogram is None:
+                histogram = self._histograms[(name, dimension)] = QuantileSketch()
+            histogram.add(value)
+
+    def increment(self, name, dimension=None, value=1):
+        with self._lock:
+            self._counters[(name, dimension)] += value
+
+    @contextlib.contextmanager
+    def timer(self, name, dimension=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, dimension)
+
+    def collect(self):
+        """Returns and resets the histograms and counters recorded since the last collect."""
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+            counters, self._counters = self._counters, collections.Counter()
+        return histograms, counters
+
+    def to_events(self, attributes=None):
+        """Collects the recorded values as NriDatabricksSelfMetrics events, one per histogram plus one for all counters."""
+        histograms, counters = self.collect()
+        events = []
+        for (name, dimension), histogram in sorted(histograms.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+            event = {'eventType': SELF_METRICS_EVENT_TYPE, 'metric': name, 'count': histogram.count,
+                     'sum': histogram.sum, 'min': histogram.min, 'max': histogram.max,
+                     'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95),
+                     'p99': histogram.quantile(0.99)}
+            if dimension is not None:
+                event['dimension'] = dimension
+            event.update(attributes or {})
+            events.append(event)
+        if counters:
+            event = {'eventType': SELF_METRICS_EVENT_TYPE, 'metric': 'counters'}
+            for (name, dimension), value in counters.items():
+                event[name if dimension is None else f'{name}.{dimension}'] = value
+            event.update(attributes or {})
+            events.append(event)
+        return events
+
+
+def spark_endpoint(url):
+    """Names a spark REST url by its last non-id path segment, e.g. 'stages' or 'executors'."""
+    parts = [part for part in urlparse(url).path.split('/') if part]
+    for part in reversed(parts):
+        if not part.isdigit() and not part.startswith(('app-', 'local-', 'application_')):
+            return part
+    return 'root'
+
+
+telemetry = Telemetry()
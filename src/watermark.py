@@ -0,0 +1,127 @@
+import threading
+
+# stage ids below the high watermark within which new attempts of a stage are still looked for
+STAGE_RETRY_WINDOW = 100
+
+
+class WatermarkUpdate:
+    """Changes to a watermark observed during one poll, applied by Watermark.commit."""
+
+    def __init__(self, high, open_keys, recent, window):
+        self.base_high = high
+        self.base_open = open_keys
+        self.recent = recent
+        self.window = window
+        self.high = high
+        self.opened = {}
+        self.closed = set()
+        self.seen = set()
+        self.emitted = {}
+
+    def observe_open(self, entity_id, key):
+        self.opened[key] = entity_id
+        self.seen.add(key)
+
+    def observe_completed(self, entity_id, key):
+        """Returns True if the completed entity has not been reported yet and should be emitted."""
+        self.seen.add(key)
+        if entity_id > self.high:
+            self.high = entity_id
+        if key in self.opened:
+            # completed between the open and the terminal listing
+            del self.opened[key]
+            self.closed.add(key)
+        elif key in self.base_open:
+            self.closed.add(key)
+        elif entity_id <= self.base_high - self.window or key in self.recent or key in self.emitted:
+            return False
+        self.emitted[key] = entity_id
+        return True
+
+    def exhausted(self, entity_id):
+        """
+        Spark lists jobs and stages in descending id order, the attempts of a stage in descending attempt
+        order. Once an id is below the retry window under the high watermark and below every open entity,
+        nothing further down the list can be new.
+        """
+        if entity_id > self.base_high - self.window:
+            return False
+        return not self.base_open or entity_id < min(self.base_open.values())
+
+
+class Watermark:
+    """
+    Tracks which entities of one kind (jobs or stages) of a single spark application have already been
+    reported, so that completed entities are emitted exactly once.
+
+    Spark assigns job and stage ids in increasing order, so everything at or below the high watermark that
+    is not tracked as open has already been emitted. Open (running/pending) entities are tracked by key until
+    they are seen in a terminal state.
+
+    Spark resubmits a stage under its old id with a new attempt id, for example after a fetch failure, so a
+    stage attempt can start and complete between two polls below the high watermark. The keys emitted
+    within window ids below the high watermark are therefore remembered, and completed keys in that window
+    that were not emitted yet are emitted as well. Jobs are not retried and have no window.
+    """
+
+    def __init__(self, window=0):
+        self._lock = threading.Lock()
+        self.window = window
+        self.high = -1
+        self.open = {}
+        # completed keys emitted within the window, and above the high watermark after a partial commit
+        self.recent = {}
+
+    def begin(self):
+        with self._lock:
+            return WatermarkUpdate(self.high, dict(self.open), frozenset(self.recent), self.window)
+
+    def commit(self, update, complete=True):
+        """
+        Applies an update once the events it produced have been accepted. Open entities that showed up in
+        neither listing have been evicted by spark (spark.ui.retainedJobs/retainedStages) and are dropped.
+
+        An update of a poll whose listings failed part way is committed with complete False: the completed
+        entities it emitted are remembered so that they are not emitted again, but the high watermark stays
+        where it was and no open entity is considered evicted.
+        """
+        with self._lock:
+            if complete and update.high > self.high:
+                self.high = update.high
+            for key in update.closed:
+                self.open.pop(key, None)
+            if complete:
+                for key in [key for key in update.base_open if key not in update.seen]:
+                    self.open.pop(key, None)
+            self.open.update(update.opened)
+            self.recent.update(update.emitted)
+            low = self.high - self.window
+            for key in [key for key, entity_id in self.recent.items() if entity_id <= low]:
+                del self.recent[key]
+
+
+class WatermarkStore:
+    """Per application job and stage watermarks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._apps = {}
+
+    def get(self, app_id, kind):
+        with self._lock:
+            app = self._apps.get(app_id)
+            if app is None:
+                app = self._apps[app_id] = {'jobs': Watermark(), 'stages': Watermark(STAGE_RETRY_WINDOW)}
+            return app[kind]
+
+    def retain(self, app_ids):
+        """Drops the watermarks of applications that are no longer listed by spark."""
+        with self._lock:
+            for app_id in [app_id for app_id in self._apps if app_id not in app_ids]:
+                del self._apps[app_id]
+
+    def open_count(self):
+        """Number of running jobs and active or pending stages seen by the last polls."""
+        with self._lock:
+            apps = list(self._apps.values())
+        return sum(len(watermark.open) for app in apps for watermark in app.values())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the integration runs as src/__main__.py with its modules importable from src
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
@@ -0,0 +1,211 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from backfill import Backfill, EventLogReplay, find_groups, parse_until
+
+START = 1700000000000
+
+
+def line(event):
+    return (json.dumps(event, separators=(',', ':')) + '\n').encode()
+
+
+def application(app_id='app-1', jobs=1):
+    """Returns the event log lines of an application running jobs of two stages, the second one skipped."""
+    events = [{'Event': 'SparkListenerLogStart', 'Spark Version': '3.5'},
+              {'Event': 'SparkListenerApplicationStart', 'App ID': app_id, 'Timestamp': START},
+              {'Event': 'SparkListenerExecutorAdded', 'Executor ID': '1', 'Timestamp': START,
+               'Executor Info': {'Total Cores': 4}}]
+    for job_id in range(jobs):
+        time = START + job_id * 1000
+        stage = {'Stage ID': 2 * job_id, 'Stage Attempt ID': 0, 'Stage Name': 'count', 'Number of Tasks': 2,
+                 'Submission Time': time}
+        events.append({'Event': 'SparkListenerJobStart', 'Job ID': job_id, 'Submission Time': time,
+                       'Stage Infos': [stage, {'Stage ID': 2 * job_id + 1, 'Stage Name': 'skipped',
+                                               'Number of Tasks': 3}]})
+        events.append({'Event': 'SparkListenerStageSubmitted', 'Stage Info': stage})
+        for task in range(2):
+            events.append({'Event': 'SparkListenerTaskEnd', 'Stage ID': 2 * job_id, 'Stage Attempt ID': 0,
+                           'Task Info': {'Executor ID': '1', 'Launch Time': time, 'Finish Time': time + 50,
+                                         'Failed': task == 1},
+                           'Task Metrics': {'Executor Run Time': 40, 'Input Metrics': {'Bytes Read': 10}}})
+        events.append({'Event': 'SparkListenerStageCompleted', 'Stage Info': {**stage, 'Completion Time': time + 60}})
+        events.append({'Event': 'SparkListenerJobEnd', 'Job ID': job_id, 'Completion Time': time + 70,
+                       'Job Result': {'Result': 'JobSucceeded'}})
+    return [line(event) for event in events]
+
+
+def application_end():
+    return [line({'Event': 'SparkListenerExecutorRemoved', 'Executor ID': '1', 'Timestamp': START + 99000}),
+            line({'Event': 'SparkListenerApplicationEnd', 'Timestamp': START + 100000})]
+
+
+def replay(lines, state=None):
+    """Feeds the lines to a replay and returns the (kind, entity, timestamp, app id) it emitted and its state."""
+    emitted = []
+    event_log_replay = EventLogReplay(lambda *args: emitted.append(args), state)
+    for event_line in lines:
+        event_log_replay.feed(event_line)
+    return emitted, event_log_replay.state
+
+
+class Projector:
+
+    def __init__(self, event_type):
+        self.event_type = event_type
+
+    def __call__(self, entity):
+        return {'eventType': self.event_type, **entity}
+
+
+class Integration:
+    """Stands in for the integration: collects the batched events, and drains successfully unless told not to."""
+
+    def __init__(self):
+        self.job_projector = Projector('SparkJob')
+        self.stage_projector = Projector('SparkStage')
+        self.executor_projector = Projector('SparkExecutor')
+        self.attributes = {'clusterName': 'c'}
+        self.clusters = []
+        self.events = []
+        self.delivered = True
+        self.batcher = self
+        self.sender = self
+
+    def add(self, event, attributes):
+        self.events.append({**event, **attributes})
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        return self.delivered
+
+
+def backfill(tmp_path, until=None):
+    integration = Integration()
+    backfill = Backfill(integration, str(tmp_path / 'checkpoints'), until)
+    backfill.run(find_groups(str(tmp_path / 'logs')))
+    return [(event['eventType'], event.get('jobId', event.get('stageId', event.get('id')))) for event in
+            integration.events], integration
+
+
+def write(path, lines, mode='wb'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode) as f:
+        f.write(b''.join(lines))
+
+
+def test_replay_rebuilds_jobs_stages_and_executors():
+    emitted, state = replay(application() + application_end())
+    entities = {(kind, entity.get('status')): (entity, timestamp, app_id)
+                for kind, entity, timestamp, app_id in emitted}
+    assert sorted(entities) == [('executors', None), ('jobs', 'SUCCEEDED'), ('stages', 'COMPLETE'),
+                                ('stages', 'SKIPPED')]
+    stage, timestamp, app_id = entities['stages', 'COMPLETE']
+    assert (timestamp, app_id) == (START + 60, 'app-1')
+    assert (stage['numCompleteTasks'], stage['numFailedTasks'], stage['executorRunTime'], stage['inputBytes']) == \
+        (1, 1, 80, 20)
+    job, timestamp, _ = entities['jobs', 'SUCCEEDED']
+    assert timestamp == START + 70
+    assert (job['numTasks'], job['numCompletedTasks'], job['numFailedTasks'], job['numCompletedStages'],
+            job['numSkippedStages'], job['numSkippedTasks']) == (5, 1, 1, 1, 1, 3)
+    executor, timestamp, _ = entities['executors', None]
+    assert timestamp == START + 99000
+    assert (executor['isActive'], executor['totalTasks'], executor['failedTasks'], executor['totalCores']) == \
+        (False, 2, 1, 4)
+    assert state['ended']
+
+
+def test_replay_continues_from_its_state():
+    lines = application(jobs=2)
+    whole, _ = replay(lines)
+    first, state = replay(lines[:7])
+    rest, _ = replay(lines[7:], json.loads(json.dumps(state)))
+    assert first + rest == whole
+
+
+def test_malformed_events_are_ignored():
+    emitted, _ = replay([b'{"Event":"SparkListenerJobEnd","Job ID":', b'not json\n'] + application())
+    assert [kind for kind, _, _, _ in emitted] == ['stages', 'stages', 'jobs']
+
+
+def test_backfill_does_not_post_replayed_events_again(tmp_path):
+    write(tmp_path / 'logs' / 'app-1', application())
+    events, integration = backfill(tmp_path)
+    assert events == [('SparkStage', 0), ('SparkStage', 1), ('SparkJob', 0)]
+    assert integration.events[0]['appId'] == 'app-1'
+    assert integration.events[0]['timestamp'] == START + 60
+    assert integration.events[0]['clusterName'] == 'c'
+    assert backfill(tmp_path)[0] == []
+
+
+def test_backfill_replays_the_lines_appended_since_the_last_run(tmp_path):
+    lines = application(jobs=2)
+    path = tmp_path / 'logs' / 'ctx' / 'eventlog'
+    # the last line is only partly written yet
+    write(path, lines[:9] + [lines[9][:10]])
+    assert backfill(tmp_path)[0] == [('SparkStage', 0), ('SparkStage', 1), ('SparkJob', 0)]
+    write(path, [lines[9][10:]] + lines[10:] + application_end(), 'ab')
+    assert backfill(tmp_path)[0] == [('SparkStage', 2), ('SparkStage', 3), ('SparkJob', 1), ('SparkExecutor', '1')]
+
+
+def test_backfill_follows_a_rolled_log(tmp_path):
+    lines = application(jobs=2)
+    directory = tmp_path / 'logs' / 'ctx'
+    write(directory / 'eventlog', lines[:9])
+    backfill(tmp_path)
+    os.remove(directory / 'eventlog')
+    with gzip.open(directory / 'eventlog-2023-11-14--22-00.gz', 'wb') as f:
+        f.write(b''.join(lines[:11]))
+    write(directory / 'eventlog', lines[11:])
+    assert backfill(tmp_path)[0] == [('SparkStage', 2), ('SparkStage', 3), ('SparkJob', 1)]
+
+
+def test_undelivered_events_keep_the_previous_checkpoint(tmp_path):
+    write(tmp_path / 'logs' / 'app-1', application())
+    integration = Integration()
+    integration.delivered = False
+    Backfill(integration, str(tmp_path / 'checkpoints')).run(find_groups(str(tmp_path / 'logs')))
+    assert len(integration.events) == 3
+    assert not os.listdir(tmp_path / 'checkpoints')
+    assert len(backfill(tmp_path)[0]) == 3
+
+
+def test_entities_ending_at_or_after_until_are_left_to_the_live_collection(tmp_path):
+    write(tmp_path / 'logs' / 'app-1', application(jobs=2))
+    assert backfill(tmp_path, until=START + 1000)[0] == [('SparkStage', 0), ('SparkStage', 1), ('SparkJob', 0)]
+
+
+def test_find_groups(tmp_path):
+    write(tmp_path / 'ctx' / 'eventlog', [])
+    write(tmp_path / 'ctx' / 'eventlog-2023-11-14--22-00.gz', [])
+    write(tmp_path / 'eventlog_v2_app-3' / 'events_1_app-3', [])
+    write(tmp_path / 'eventlog_v2_app-3' / 'appstatus_app-3.inprogress', [])
+    write(tmp_path / 'app-1', [])
+    write(tmp_path / 'app-2.inprogress', [])
+    groups = {os.path.relpath(group.key, tmp_path): group for group in find_groups(str(tmp_path))}
+    assert sorted(groups) == ['app-1', 'app-2', 'ctx', 'eventlog_v2_app-3']
+    assert groups['ctx'].names == ['eventlog-2023-11-14--22-00.gz', 'eventlog']
+    assert groups['eventlog_v2_app-3'].names == ['events_1_app-3']
+    assert {key for key, group in groups.items() if group.in_progress} == {'app-2', 'eventlog_v2_app-3'}
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, None),
+    ('2023-11-14T22:13:20Z', START),
+    ('2023-11-14T22:13:20', START),
+    ('2023-11-14T23:13:20+01:00', START),
+    (START // 1000, START),
+])
+def test_parse_until(value, expected):
+    assert parse_until(value) == expected
+
+
+@pytest.mark.parametrize('value', ['yesterday', True, [1]])
+def test_invalid_until(value):
+    with pytest.raises(ValueError):
+        parse_until(value)
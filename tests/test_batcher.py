@@ -0,0 +1,16 @@
+import json
+
+from batcher import Attributes, serialize
+
+
+def test_attributes_are_appended_to_the_event():
+    assert json.loads(serialize({'eventType': 'SparkJob', 'jobId': 1}, Attributes({'env': 'prod'}))) == \
+        {'eventType': 'SparkJob', 'jobId': 1, 'env': 'prod'}
+    assert json.loads(serialize({}, Attributes({'env': 'prod'}))) == {'env': 'prod'}
+    assert json.loads(serialize({'jobId': 1}, Attributes({}))) == {'jobId': 1}
+
+
+def test_label_named_like_a_field_takes_precedence_once():
+    data = serialize({'eventType': 'SparkJob', 'status': 'SUCCEEDED'}, Attributes({'status': 'label'}))
+    assert data.count(b'"status"') == 1
+    assert json.loads(data) == {'eventType': 'SparkJob', 'status': 'label'}
@@ -0,0 +1,79 @@
+from deltas import CounterCache, add_deltas
+
+COUNTERS = ('totalTasks', 'totalShuffleRead')
+
+
+def test_first_sample_has_no_deltas():
+    cache = CounterCache(COUNTERS)
+    assert cache.deltas(('app', '1'), {'totalTasks': 10}, now=0) == {}
+
+
+def test_delta_and_per_second_rate():
+    cache = CounterCache(COUNTERS)
+    cache.deltas(('app', '1'), {'totalTasks': 10, 'totalShuffleRead': 100}, now=0)
+    assert cache.deltas(('app', '1'), {'totalTasks': 30, 'totalShuffleRead': 100}, now=10) == {
+        'totalTasks': (20, 2.0), 'totalShuffleRead': (0, 0.0)}
+    assert cache.deltas(('app', '1'), {'totalTasks': 35, 'totalShuffleRead': 150}, now=15) == {
+        'totalTasks': (5, 1.0), 'totalShuffleRead': (50, 10.0)}
+
+
+def test_keys_are_sampled_separately():
+    cache = CounterCache(COUNTERS)
+    cache.deltas(('app', '1'), {'totalTasks': 10}, now=0)
+    cache.deltas(('app', '2'), {'totalTasks': 100}, now=0)
+    assert cache.deltas(('app', '1'), {'totalTasks': 15}, now=5) == {'totalTasks': (5, 1.0)}
+    assert cache.deltas(('app', '2'), {'totalTasks': 150}, now=5) == {'totalTasks': (50, 10.0)}
+
+
+def test_reset_counter_takes_its_current_value_as_delta():
+    cache = CounterCache(COUNTERS)
+    cache.deltas(('app', '1'), {'totalTasks': 500}, now=0)
+    assert cache.deltas(('app', '1'), {'totalTasks': 20}, now=10) == {'totalTasks': (20, 2.0)}
+
+
+def test_no_rate_without_elapsed_time():
+    cache = CounterCache(COUNTERS)
+    cache.deltas(('app', '1'), {'totalTasks': 10}, now=5)
+    assert cache.deltas(('app', '1'), {'totalTasks': 12}, now=5) == {'totalTasks': (2, None)}
+
+
+def test_missing_and_non_numeric_counters_are_ignored():
+    cache = CounterCache(COUNTERS)
+    cache.deltas(('app', '1'), {'totalTasks': True, 'totalShuffleRead': 100}, now=0)
+    assert cache.deltas(('app', '1'), {'totalTasks': 3, 'totalShuffleRead': '200'}, now=1) == {}
+
+
+def test_add_deltas_adds_only_counters_of_the_event():
+    event = {'eventType': 'SparkExecutor', 'totalTasks': 30}
+    add_deltas(event, {'totalTasks': (20, 2.0), 'totalShuffleRead': (5, 0.5)})
+    assert event == {'eventType': 'SparkExecutor', 'totalTasks': 30, 'totalTasksDelta': 20,
+                     'totalTasksPerSecond': 2.0}
+    event = {'totalTasks': 30}
+    add_deltas(event, {'totalTasks': (2, None)})
+    assert event == {'totalTasks': 30, 'totalTasksDelta': 2}
+
+
+def test_idle_keys_are_evicted():
+    cache = CounterCache(COUNTERS, max_idle=60)
+    cache.deltas(('app', '1'), {'totalTasks': 10}, now=0)
+    cache.deltas(('app', '2'), {'totalTasks': 10}, now=50)
+    cache.evict(now=100)
+    assert cache.deltas(('app', '1'), {'totalTasks': 20}, now=100) == {}
+    assert cache.deltas(('app', '2'), {'totalTasks': 20}, now=100) == {'totalTasks': (10, 0.2)}
+
+
+def test_keys_of_finished_applications_are_evicted():
+    cache = CounterCache(COUNTERS)
+    cache.deltas(('done', '1'), {'totalTasks': 10}, now=0)
+    cache.deltas(('running', '1'), {'totalTasks': 10}, now=0)
+    cache.evict(now=1, keep={'running'})
+    assert cache.deltas(('done', '1'), {'totalTasks': 20}, now=2) == {}
+    assert cache.deltas(('running', '1'), {'totalTasks': 20}, now=2) == {'totalTasks': (10, 5.0)}
+
+
+def test_least_recently_sampled_keys_are_evicted_beyond_max_entries():
+    cache = CounterCache(COUNTERS, max_entries=2)
+    for executor in ('1', '2', '3'):
+        cache.deltas(('app', executor), {'totalTasks': 10}, now=0)
+    assert cache.deltas(('app', '1'), {'totalTasks': 20}, now=1) == {}
+    assert cache.deltas(('app', '3'), {'totalTasks': 20}, now=1) == {'totalTasks': (10, 10.0)}
@@ -0,0 +1,97 @@
+import pytest
+
+from filters import EventFilter
+from projection import Projector
+
+FIELDS = {'stageId': 'stageId', 'status': 'stageStatus', 'numTasks': 'numTasks', 'executorRunTime': 'runTime'}
+
+
+def project(event_filter, items, flatten=()):
+    """Projects the items through a projector compiled with the filter and returns the events it keeps."""
+    projector = Projector('SparkStage', FIELDS, flatten, event_filter)
+    return [event for event in map(projector, items) if event is not None]
+
+
+def test_include_keeps_only_the_listed_attributes():
+    event_filter = EventFilter('SparkStage', include=['stageId'])
+    assert project(event_filter, [{'stageId': 1, 'status': 'COMPLETE'}]) == [
+        {'eventType': 'SparkStage', 'stageId': 1}]
+
+
+def test_exclude_removes_the_listed_attributes():
+    event_filter = EventFilter('SparkStage', exclude=['runTime'])
+    assert project(event_filter, [{'stageId': 1, 'executorRunTime': 10}]) == [
+        {'eventType': 'SparkStage', 'stageId': 1}]
+
+
+def test_include_and_exclude_apply_to_flattened_fields():
+    event_filter = EventFilter('SparkStage', exclude=['peakMemory'])
+    items = [{'stageId': 1, 'metrics': {'peakMemory': 10, 'spill': 2}}]
+    assert project(event_filter, items, flatten=['metrics']) == [
+        {'eventType': 'SparkStage', 'stageId': 1, 'spill': 2}]
+
+
+def test_items_matching_all_fields_of_a_drop_rule_are_dropped():
+    event_filter = EventFilter('SparkStage', drop=[{'status': ['SKIPPED', 'PENDING'], 'numTasks': 0}])
+    items = [{'stageId': 1, 'status': 'SKIPPED', 'numTasks': 0},
+             {'stageId': 2, 'status': 'PENDING', 'numTasks': 0},
+             {'stageId': 3, 'status': 'SKIPPED', 'numTasks': 4},
+             {'stageId': 4, 'status': 'COMPLETE', 'numTasks': 0}]
+    assert [event['stageId'] for event in project(event_filter, items)] == [3, 4]
+
+
+def test_any_drop_rule_drops_an_item():
+    event_filter = EventFilter('SparkStage', drop=[{'status': 'SKIPPED'}, {'numTasks': 0}])
+    items = [{'stageId': 1, 'status': 'SKIPPED', 'numTasks': 4},
+             {'stageId': 2, 'status': 'COMPLETE', 'numTasks': 0},
+             {'stageId': 3, 'status': 'COMPLETE', 'numTasks': 4}]
+    assert [event['stageId'] for event in project(event_filter, items)] == [3]
+
+
+def test_drop_rule_values_without_valid_source_compile():
+    event_filter = EventFilter('SparkStage', drop=[{'executorRunTime': [float('inf'), float('nan')]}])
+    items = [{'stageId': 1, 'executorRunTime': float('inf')}, {'stageId': 2, 'executorRunTime': 10}]
+    assert [event['stageId'] for event in project(event_filter, items)] == [2]
+
+
+def test_sampling_keeps_the_same_entities():
+    event_filter = EventFilter('SparkStage', sample={'rate': 0.25, 'key': ['stageId']})
+    items = [{'stageId': i} for i in range(2000)]
+    kept = [event['stageId'] for event in project(event_filter, items)]
+    assert kept == [event['stageId'] for event in project(event_filter, items)]
+    assert 400 < len(kept) < 600
+
+
+def test_sampling_rates_of_zero_and_one():
+    items = [{'stageId': i} for i in range(100)]
+    assert project(EventFilter('SparkStage', sample={'rate': 0, 'key': ['stageId']}), items) == []
+    assert len(project(EventFilter('SparkStage', sample={'rate': 1}), items)) == 100
+
+
+def test_apply_matches_the_compiled_projection():
+    event_filter = EventFilter('SparkStage', exclude=['numTasks'], drop=[{'stageStatus': 'SKIPPED'}],
+                               sample={'rate': 0.5, 'key': ['stageId']})
+    events = [{'eventType': 'SparkStage', 'stageId': i, 'stageStatus': status, 'numTasks': 1}
+              for i in range(100) for status in ('SKIPPED', 'COMPLETE')]
+    applied = [event for event in map(event_filter.apply, events) if event is not None]
+    assert all(event['stageStatus'] == 'COMPLETE' and 'numTasks' not in event for event in applied)
+    assert [event['stageId'] for event in applied] == \
+        [i for i in range(100) if event_filter.sampled(i)]
+
+
+def test_from_config_builds_a_filter_per_event_type():
+    filters = EventFilter.from_config({'SparkStage': {'include': ['stageId']}, 'SparkJob': None})
+    assert filters['SparkStage'].include == {'stageId'}
+    assert filters['SparkJob'].keeps('jobId')
+
+
+@pytest.mark.parametrize('rules', [
+    {'drop': [{}]},
+    {'drop': ['status']},
+    {'drop': [{'status': {'nested': 1}}]},
+    {'sample': {'rate': 1.5, 'key': ['stageId']}},
+    {'sample': {'rate': 0.5}},
+])
+def test_invalid_rules_are_rejected(rules):
+    with pytest.raises(ValueError):
+        EventFilter.from_config({'SparkStage': rules})
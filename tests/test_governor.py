@@ -0,0 +1,75 @@
+from governor import FEWER_WORKERS, LONGER_INTERVAL, NORMAL, WITHOUT_OPTIONAL, ResourceGovernor
+
+
+def levels(governor, usage):
+    """Updates the governor with each (cpu percent, rss MB) measurement and returns the level after each."""
+    result = []
+    for cpu_percent, rss_mb in usage:
+        governor.update(cpu_percent, rss_mb)
+        result.append(governor.level)
+    return result
+
+
+def test_each_poll_over_budget_degrades_one_level():
+    governor = ResourceGovernor(cpu_percent=10, max_rss_mb=100)
+    assert levels(governor, [(20, 50), (5, 200), (20, 200), (20, 50)]) == \
+        [WITHOUT_OPTIONAL, LONGER_INTERVAL, FEWER_WORKERS, FEWER_WORKERS]
+
+
+def test_update_returns_the_previous_level_on_a_change():
+    governor = ResourceGovernor(cpu_percent=10, recover_after=1)
+    assert governor.update(5, 0) is None
+    assert governor.update(20, 0) == NORMAL
+    assert governor.update(20, 0) == WITHOUT_OPTIONAL
+    assert governor.update(5, 0) == LONGER_INTERVAL
+    assert governor.level == WITHOUT_OPTIONAL
+
+
+def test_recovers_one_level_after_polls_below_headroom():
+    governor = ResourceGovernor(cpu_percent=10, recover_after=3)
+    levels(governor, [(20, 0), (20, 0)])
+    assert levels(governor, [(5, 0)] * 6) == \
+        [LONGER_INTERVAL, LONGER_INTERVAL, WITHOUT_OPTIONAL, WITHOUT_OPTIONAL, WITHOUT_OPTIONAL, NORMAL]
+
+
+def test_usage_within_headroom_holds_the_level():
+    governor = ResourceGovernor(cpu_percent=10, recover_after=2, headroom=0.8)
+    levels(governor, [(20, 0)])
+    assert levels(governor, [(5, 0), (9, 0), (5, 0), (5, 0)]) == \
+        [WITHOUT_OPTIONAL, WITHOUT_OPTIONAL, WITHOUT_OPTIONAL, NORMAL]
+
+
+def test_poll_over_budget_restarts_the_recovery():
+    governor = ResourceGovernor(max_rss_mb=100, recover_after=2)
+    levels(governor, [(0, 200)])
+    assert levels(governor, [(0, 50), (0, 200), (0, 50), (0, 50)]) == \
+        [WITHOUT_OPTIONAL, LONGER_INTERVAL, LONGER_INTERVAL, WITHOUT_OPTIONAL]
+
+
+def test_levels_set_the_collection_factors():
+    governor = ResourceGovernor(cpu_percent=10, interval_factor=3, worker_factor=0.25)
+    factors = []
+    for _ in range(4):
+        factors.append((governor.optional_collectors, governor.interval_factor, governor.worker_factor))
+        governor.update(20, 0)
+    assert factors == [(True, 1, 1), (False, 1, 1), (False, 3, 1), (False, 3, 0.25)]
+
+
+def test_governor_without_budgets_is_disabled():
+    governor = ResourceGovernor.from_config(None)
+    assert not governor.enabled
+    assert levels(governor, [(1000, 100000)]) == [NORMAL]
+    assert ResourceGovernor.from_config({'max_rss_mb': 200}).enabled
+
+
+def test_level_change_event():
+    governor = ResourceGovernor(cpu_percent=10, interval_factor=2)
+    previous = None
+    for _ in range(2):
+        previous = governor.update(20, 30)
+    event = governor.event(previous, 20, 30)
+    assert event['level'] == LONGER_INTERVAL
+    assert event['levelName'] == 'longer interval'
+    assert event['previousLevel'] == WITHOUT_OPTIONAL
+    assert event['intervalFactor'] == 2
+    assert event['workerFactor'] == 1
@@ -0,0 +1,58 @@
+import json
+import random
+
+import pytest
+
+from jsonstream import iter_json_array
+
+DOCUMENTS = [
+    '[]',
+    ' [ ] ',
+    '[-2500.0]',
+    '[1, -2.5e-3, 1E+10, 0, true, false, null]',
+    '["a", "b,]", "\\u00e9\\"", "ü€"]',
+    '[{"stageId": 3, "attemptId": 1, "executorRunTime": -2500.0, "name": "x ]"}, [1, [2.0e1]], 12345678901234567890]',
+    '[\n  {"a": 1},\n  {"b": [true, null]}\n]\n',
+]
+
+
+def chunked(data, sizes):
+    pos = 0
+    for size in sizes:
+        if pos >= len(data):
+            return
+        yield data[pos:pos + size]
+        pos += size
+    if pos < len(data):
+        yield data[pos:]
+
+
+@pytest.mark.parametrize('document', DOCUMENTS)
+def test_one_byte_chunks(document):
+    data = document.encode('utf-8')
+    assert list(iter_json_array(data[i:i + 1] for i in range(len(data)))) == json.loads(document)
+
+
+@pytest.mark.parametrize('document', DOCUMENTS)
+def test_every_chunk_boundary(document):
+    data = document.encode('utf-8')
+    for split in range(len(data) + 1):
+        assert list(iter_json_array([data[:split], data[split:]])) == json.loads(document)
+
+
+def test_random_chunk_sizes():
+    generator = random.Random(0)
+    for _ in range(200):
+        items = [generator.choice([generator.randint(-10 ** 6, 10 ** 6), generator.uniform(-1e4, 1e4),
+                                   generator.random() * 10 ** generator.randint(-30, 30), 'value', True, None,
+                                   {'id': generator.randint(0, 100), 'duration': -2500.0}])
+                 for _ in range(generator.randint(0, 20))]
+        data = json.dumps(items).encode('utf-8')
+        sizes = [generator.randint(1, 8) for _ in range(len(data))]
+        assert list(iter_json_array(chunked(data, sizes))) == items
+
+
+@pytest.mark.parametrize('document', ['[1, 2', '[-2500.0', '[{"a": 1}', '{"a": 1}'])
+def test_invalid_or_truncated_arrays_raise(document):
+    with pytest.raises(ValueError):
+        list(iter_json_array([document.encode('utf-8')]))
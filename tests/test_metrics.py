@@ -0,0 +1,81 @@
+import gzip
+import json
+
+import metrics
+from metrics import MetricAggregator
+
+
+def harvest(aggregator, common_attributes=None):
+    """Returns the decoded payloads of a harvest and the metric counts reported for them."""
+    payloads = aggregator.harvest(common_attributes)
+    return [json.loads(gzip.decompress(payload)) for payload, _ in payloads], [count for _, count in payloads]
+
+
+def test_harvest_uses_the_common_block_format():
+    aggregator = MetricAggregator()
+    aggregator.gauge('spark.executor.memoryUsed', 10, {'executorId': '1'})
+    aggregator.count('spark.job.completed', 1, {})
+    (payload,), counts = harvest(aggregator, {'clusterName': 'c'})
+    assert counts == [2]
+    assert len(payload) == 1
+    common = payload[0]['common']
+    assert common['attributes'] == {'clusterName': 'c'}
+    assert isinstance(common['timestamp'], int)
+    assert common['interval.ms'] >= 1
+    gauge, count = payload[0]['metrics']
+    assert gauge['name'] == 'spark.executor.memoryUsed'
+    assert gauge['type'] == 'gauge'
+    assert gauge['value'] == 10
+    assert gauge['attributes'] == {'executorId': '1'}
+    assert isinstance(gauge['timestamp'], int)
+    assert count == {'name': 'spark.job.completed', 'type': 'count', 'value': 1, 'attributes': {}}
+
+
+def test_no_common_attributes():
+    aggregator = MetricAggregator()
+    aggregator.count('spark.job.completed', 1, {})
+    (payload,), _ = harvest(aggregator)
+    assert 'attributes' not in payload[0]['common']
+
+
+def test_values_are_aggregated_per_name_and_attributes():
+    aggregator = MetricAggregator()
+    aggregator.gauge('memory', 10, {'executorId': '1'})
+    aggregator.gauge('memory', 20, {'executorId': '1'})
+    aggregator.gauge('memory', 5, {'executorId': '2'})
+    aggregator.count('tasks', 3, {'executorId': '1'})
+    aggregator.count('tasks', 4, {'executorId': '1'})
+    for value in (7, 2, 9):
+        aggregator.summary('duration', value, {'stageId': 1})
+    (payload,), counts = harvest(aggregator)
+    assert counts == [4]
+    values = {(metric['name'], tuple(metric['attributes'].values())): metric['value']
+              for metric in payload[0]['metrics']}
+    assert values == {
+        ('memory', ('1',)): 20,
+        ('memory', ('2',)): 5,
+        ('tasks', ('1',)): 7,
+        ('duration', (1,)): {'count': 3, 'sum': 18, 'min': 2, 'max': 9},
+    }
+
+
+def test_harvest_starts_a_new_interval():
+    aggregator = MetricAggregator()
+    aggregator.count('tasks', 3, {})
+    (first,), _ = harvest(aggregator)
+    assert harvest(aggregator) == ([], [])
+    aggregator.count('tasks', 1, {})
+    (second,), _ = harvest(aggregator)
+    assert second[0]['metrics'][0]['value'] == 1
+    assert second[0]['common']['timestamp'] >= first[0]['common']['timestamp']
+
+
+def test_metrics_are_split_into_payloads_of_max_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, 'MAX_METRICS', 2)
+    aggregator = MetricAggregator()
+    for i in range(5):
+        aggregator.count('tasks', 1, {'executorId': str(i)})
+    payloads, counts = harvest(aggregator, {'clusterName': 'c'})
+    assert counts == [2, 2, 1]
+    assert [len(payload[0]['metrics']) for payload in payloads] == counts
+    assert all(payload[0]['common'] == payloads[0][0]['common'] for payload in payloads)
@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from scheduling import JOB_ID, AdaptivePoller, AdaptiveTrigger, FixedPoller
+
+
+class Scheduler:
+    """Records the jobs added and the changes made to them."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.changes = []
+
+    def add_job(self, func, trigger, id, **kwargs):
+        self.jobs[id] = (func, trigger, kwargs)
+
+    def modify_job(self, job_id, **changes):
+        self.changes.append((job_id, changes))
+
+    def reschedule_job(self, job_id, **changes):
+        self.changes.append((job_id, changes))
+
+
+class Integration:
+
+    def __init__(self, active_counts=(), interval_factor=1):
+        self.active_counts = list(active_counts)
+        self.active_count = 0
+        self.interval_factor = interval_factor
+        self.runs = 0
+
+    def run(self):
+        self.runs += 1
+        self.active_count = self.active_counts.pop(0) if self.active_counts else 0
+
+
+def intervals(poller, active_counts):
+    """Runs a poll per active count and returns the poll interval after each one."""
+    poller.integration.active_counts = list(active_counts)
+    result = []
+    for _ in active_counts:
+        poller.poll()
+        result.append(poller.interval)
+    return result
+
+
+def next_run_delay(scheduler, start):
+    job_id, changes = scheduler.changes[-1]
+    assert job_id == JOB_ID
+    return (changes['next_run_time'] - start).total_seconds()
+
+
+def test_idle_cluster_backs_off_up_to_max_interval():
+    poller = AdaptivePoller(Scheduler(), Integration(), min_interval=5, max_interval=30)
+    assert intervals(poller, [0, 0, 0, 0]) == [10, 20, 30, 30]
+
+
+def test_active_cluster_resets_to_min_interval():
+    poller = AdaptivePoller(Scheduler(), Integration(), min_interval=5, max_interval=300, backoff=3)
+    assert intervals(poller, [0, 0, 2, 0]) == [15, 45, 5, 15]
+
+
+def test_max_interval_is_at_least_min_interval():
+    poller = AdaptivePoller(Scheduler(), Integration(), min_interval=60, max_interval=10)
+    assert intervals(poller, [0]) == [60]
+
+
+def test_poll_reschedules_the_next_run_one_interval_out():
+    scheduler = Scheduler()
+    poller = AdaptivePoller(scheduler, Integration(), min_interval=5)
+    poller.update(1)
+    start = datetime.now(timezone.utc)
+    poller.reschedule(start)
+    assert next_run_delay(scheduler, start) == 5
+
+
+def test_slow_poll_skips_the_missed_cycles():
+    scheduler = Scheduler()
+    poller = AdaptivePoller(scheduler, Integration(), min_interval=5)
+    start = datetime.now(timezone.utc) - timedelta(seconds=12)
+    poller.reschedule(start)
+    assert next_run_delay(scheduler, start) == 15
+
+
+def test_interval_factor_lengthens_the_interval():
+    scheduler = Scheduler()
+    poller = AdaptivePoller(scheduler, Integration(interval_factor=2), min_interval=5)
+    start = datetime.now(timezone.utc)
+    poller.reschedule(start)
+    assert next_run_delay(scheduler, start) == 10
+
+
+def test_failed_poll_still_reschedules():
+    class Failing(Integration):
+        def run(self):
+            raise RuntimeError('spark is down')
+
+    scheduler = Scheduler()
+    poller = AdaptivePoller(scheduler, Failing(), min_interval=5)
+    with pytest.raises(RuntimeError):
+        poller.poll()
+    assert poller.interval == 10
+    assert len(scheduler.changes) == 1
+
+
+def test_adaptive_poller_job_does_not_overlap():
+    scheduler = Scheduler()
+    poller = AdaptivePoller(scheduler, Integration())
+    poller.start()
+    func, trigger, kwargs = scheduler.jobs[JOB_ID]
+    assert func == poller.poll
+    assert isinstance(trigger, AdaptiveTrigger)
+    assert kwargs == {'max_instances': 1, 'coalesce': True}
+
+
+def test_trigger_fires_at_once_then_falls_back_to_max_interval():
+    trigger = AdaptiveTrigger(AdaptivePoller(Scheduler(), Integration(), max_interval=300))
+    now = datetime.now(timezone.utc)
+    assert trigger.get_next_fire_time(None, now) == now
+    assert trigger.get_next_fire_time(now, now) == now + timedelta(seconds=300)
+
+
+def test_fixed_poller_follows_the_interval_factor():
+    scheduler = Scheduler()
+    integration = Integration()
+    poller = FixedPoller(scheduler, integration, interval=15)
+    poller.start()
+    assert scheduler.jobs[JOB_ID][2] == {'seconds': 15}
+    poller.poll()
+    assert scheduler.changes == []
+    integration.interval_factor = 2
+    poller.poll()
+    poller.poll()
+    integration.interval_factor = 1
+    poller.poll()
+    assert scheduler.changes == [(JOB_ID, {'trigger': 'interval', 'seconds': 30}),
+                                 (JOB_ID, {'trigger': 'interval', 'seconds': 15})]
+    assert integration.runs == 4
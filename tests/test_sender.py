@@ -0,0 +1,163 @@
+import threading
+import time
+
+import pytest
+
+from newrelic import NewRelic, NewRelicApiException
+from sender import BLOCK, DROP_OLDEST, AsyncSender
+from spool import DiskSpool
+
+
+class Response:
+
+    class raw:
+        retries = None
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class Collector:
+    """Stands in for the New Relic APIs: records the posted payloads, optionally held back until released."""
+
+    def __init__(self, status_code=200, error=False, held=False):
+        self.status_code = status_code
+        self.error = error
+        self.posted = []
+        self.released = threading.Event()
+        if not held:
+            self.released.set()
+
+    def post_payload(self, session, payload, kind=NewRelic.EVENTS):
+        self.released.wait(5)
+        if self.error:
+            raise NewRelicApiException('connection refused')
+        self.posted.append(payload)
+        return Response(self.status_code)
+
+
+@pytest.fixture
+def collector(monkeypatch):
+    collector = Collector()
+    monkeypatch.setattr(NewRelic, 'post_payload', collector.post_payload)
+    return collector
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_payloads_are_delivered_in_order(collector):
+    sender = AsyncSender(None, workers=1)
+    for i in range(5):
+        assert sender.submit(b'%d' % i, 1)
+    assert sender.close(timeout=5)
+    assert collector.posted == [b'0', b'1', b'2', b'3', b'4']
+    assert sender.counters['payloads_sent'] == 5
+
+
+def test_drop_oldest_drops_the_oldest_queued_payload(collector):
+    collector.released.clear()
+    sender = AsyncSender(None, queue_size=2, workers=1, full_policy=DROP_OLDEST)
+    sender.submit(b'sending', 1)
+    wait_until(lambda: sender._in_flight == 1)
+    for payload in (b'a', b'b', b'c'):
+        sender.submit(payload, 1)
+    collector.released.set()
+    assert not sender.drain(timeout=5)
+    assert collector.posted == [b'sending', b'b', b'c']
+    assert sender.counters['payloads_dropped'] == 1
+    assert sender.close(timeout=5)
+
+
+def test_block_waits_for_room_in_the_queue(collector):
+    collector.released.clear()
+    sender = AsyncSender(None, queue_size=1, workers=1, full_policy=BLOCK)
+    sender.submit(b'sending', 1)
+    wait_until(lambda: sender._in_flight == 1)
+    sender.submit(b'queued', 1)
+    producer = threading.Thread(target=sender.submit, args=(b'blocked', 1))
+    producer.start()
+    producer.join(0.1)
+    assert producer.is_alive()
+    collector.released.set()
+    producer.join(5)
+    assert not producer.is_alive()
+    assert sender.drain(timeout=5)
+    assert collector.posted == [b'sending', b'queued', b'blocked']
+    assert sender.close(timeout=5)
+
+
+def test_close_releases_a_producer_blocked_on_a_full_queue(collector):
+    collector.released.clear()
+    sender = AsyncSender(None, queue_size=1, workers=1, full_policy=BLOCK)
+    sender.submit(b'sending', 1)
+    wait_until(lambda: sender._in_flight == 1)
+    sender.submit(b'queued', 1)
+    results = []
+    producer = threading.Thread(target=lambda: results.append(sender.submit(b'blocked', 1)))
+    producer.start()
+    producer.join(0.1)
+    assert not sender.close(timeout=0.1)
+    producer.join(5)
+    assert not producer.is_alive()
+    assert results == [False]
+    assert sender.counters['payloads_dropped'] == 1
+    collector.released.set()
+
+
+def test_submit_after_close_returns_false(collector):
+    sender = AsyncSender(None)
+    assert sender.close(timeout=5)
+    assert not sender.submit(b'late', 1)
+
+
+def test_drain_waits_for_payloads_being_sent(collector):
+    collector.released.clear()
+    sender = AsyncSender(None, workers=2)
+    sender.submit(b'a', 1)
+    sender.submit(b'b', 1)
+    assert not sender.drain(timeout=0.1)
+    collector.released.set()
+    assert sender.drain(timeout=5)
+    assert sorted(collector.posted) == [b'a', b'b']
+    assert sender.close(timeout=5)
+
+
+def test_drain_reports_payloads_lost_since_the_previous_drain(monkeypatch):
+    collector = Collector(error=True)
+    monkeypatch.setattr(NewRelic, 'post_payload', collector.post_payload)
+    sender = AsyncSender(None, workers=1)
+    sender.submit(b'a', 1)
+    assert not sender.drain(timeout=5)
+    collector.error = False
+    sender.submit(b'b', 1)
+    assert sender.drain(timeout=5)
+    assert sender.counters['payloads_failed'] == 1
+    assert sender.close(timeout=5)
+
+
+def test_rejected_payloads_are_not_retried(monkeypatch):
+    collector = Collector(status_code=413)
+    monkeypatch.setattr(NewRelic, 'post_payload', collector.post_payload)
+    sender = AsyncSender(None, workers=1)
+    sender.submit(b'too large', 1)
+    assert sender.drain(timeout=5)
+    assert sender.counters['payloads_failed'] == 1
+    assert sender.close(timeout=5)
+
+
+def test_undelivered_payloads_are_spooled(monkeypatch, tmp_path):
+    collector = Collector(status_code=503)
+    monkeypatch.setattr(NewRelic, 'post_payload', collector.post_payload)
+    spool = DiskSpool(str(tmp_path / 'spool'))
+    sender = AsyncSender(None, workers=1, spool=spool)
+    sender.submit(b'payload', 3)
+    assert sender.drain(timeout=5)
+    assert sender.close(timeout=5)
+    spool = DiskSpool(str(tmp_path / 'spool'))
+    assert spool.peek() == (b'payload', 3, 'events')
+    spool.close()
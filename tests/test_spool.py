@@ -0,0 +1,129 @@
+import os
+
+import pytest
+
+from spool import DiskSpool, open_spool
+
+
+def replay(spool):
+    """Consumes the spool and returns its (payload, count, kind) records in order."""
+    records = []
+    record = spool.peek()
+    while record is not None:
+        records.append(record)
+        spool.advance()
+        record = spool.peek()
+    return records
+
+
+def segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.seg'))
+
+
+def test_records_are_replayed_in_order(tmp_path):
+    spool = DiskSpool(str(tmp_path))
+    spool.append(b'a', 1)
+    spool.append(b'b', 2, 'metrics')
+    assert spool.peek() == (b'a', 1, 'events')
+    assert spool.peek() == (b'a', 1, 'events')
+    assert replay(spool) == [(b'a', 1, 'events'), (b'b', 2, 'metrics')]
+    assert spool.empty()
+    spool.close()
+
+
+def test_replay_resumes_at_the_cursor_after_a_restart(tmp_path):
+    spool = DiskSpool(str(tmp_path))
+    for payload in (b'a', b'b', b'c'):
+        spool.append(payload, 1)
+    spool.peek()
+    spool.advance()
+    spool.close()
+    spool = DiskSpool(str(tmp_path))
+    assert replay(spool) == [(b'b', 1, 'events'), (b'c', 1, 'events')]
+    spool.close()
+
+
+def test_replayed_segments_are_removed(tmp_path):
+    spool = DiskSpool(str(tmp_path), segment_bytes=1)
+    for payload in (b'a', b'b', b'c'):
+        spool.append(payload, 1)
+    assert len(segments(tmp_path)) == 3
+    replay(spool)
+    assert len(segments(tmp_path)) == 1
+    assert spool.size() == 0
+    spool.close()
+
+
+def test_truncated_record_is_skipped_after_a_crash(tmp_path):
+    spool = DiskSpool(str(tmp_path), segment_bytes=1)
+    spool.append(b'lost' * 10, 1)
+    spool.append(b'kept', 1)
+    spool.close()
+    first = os.path.join(tmp_path, segments(tmp_path)[0])
+    os.truncate(first, os.path.getsize(first) - 5)
+    spool = DiskSpool(str(tmp_path))
+    assert replay(spool) == [(b'kept', 1, 'events')]
+    spool.close()
+
+
+def test_truncated_last_record_is_not_replayed(tmp_path):
+    spool = DiskSpool(str(tmp_path))
+    spool.append(b'kept', 1)
+    spool.append(b'lost' * 10, 1)
+    spool.close()
+    last = os.path.join(tmp_path, segments(tmp_path)[-1])
+    os.truncate(last, os.path.getsize(last) - 5)
+    spool = DiskSpool(str(tmp_path))
+    assert replay(spool) == [(b'kept', 1, 'events')]
+    spool.close()
+
+
+def test_oldest_segments_are_discarded_beyond_max_bytes(tmp_path):
+    spool = DiskSpool(str(tmp_path), max_bytes=250, segment_bytes=1)
+    for payload in (b'a', b'b', b'c'):
+        spool.append(payload * 100, 1)
+    assert spool.size() <= 250
+    assert [payload[:1] for payload, _, _ in replay(spool)] == [b'b', b'c']
+    spool.close()
+
+
+def test_spool_is_owned_by_one_process(tmp_path):
+    spool = DiskSpool(str(tmp_path))
+    with pytest.raises(BlockingIOError):
+        DiskSpool(str(tmp_path))
+    spool.close()
+    DiskSpool(str(tmp_path)).close()
+
+
+def test_open_spool_falls_back_to_a_private_spool(tmp_path):
+    owner = open_spool(str(tmp_path))
+    private = open_spool(str(tmp_path))
+    assert private.private
+    assert private.directory == os.path.join(tmp_path, str(os.getpid()))
+    private.close()
+    assert not os.path.exists(private.directory)
+    owner.close()
+
+
+def test_private_spool_is_adopted_by_the_next_owner(tmp_path):
+    owner = open_spool(str(tmp_path))
+    private = open_spool(str(tmp_path))
+    private.append(b'undelivered', 3, 'metrics')
+    private.close()
+    owner.close()
+    assert os.path.isdir(private.directory)
+    owner = open_spool(str(tmp_path))
+    assert replay(owner) == [(b'undelivered', 3, 'metrics')]
+    owner.close()
+    assert not os.path.exists(private.directory)
+
+
+def test_private_spool_of_a_running_process_is_not_adopted(tmp_path):
+    owner = open_spool(str(tmp_path))
+    private = open_spool(str(tmp_path))
+    private.append(b'in use', 1)
+    owner.close()
+    owner = open_spool(str(tmp_path))
+    assert owner.empty()
+    owner.close()
+    private.close()
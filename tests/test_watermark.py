@@ -0,0 +1,85 @@
+from watermark import STAGE_RETRY_WINDOW, Watermark, WatermarkStore
+
+
+def poll(watermark, running=(), completed=(), complete=True):
+    """
+    Runs one poll over listings of (id, attempt) keys, running first, and returns the completed keys it
+    emitted. Listings are passed in the descending order spark returns them in.
+    """
+    update = watermark.begin()
+    for stage_id, attempt in running:
+        update.observe_open(stage_id, (stage_id, attempt))
+    emitted = []
+    for stage_id, attempt in completed:
+        if update.exhausted(stage_id):
+            break
+        if update.observe_completed(stage_id, (stage_id, attempt)):
+            emitted.append((stage_id, attempt))
+    watermark.commit(update, complete)
+    return emitted
+
+
+def test_completed_stages_are_emitted_once():
+    watermark = Watermark(STAGE_RETRY_WINDOW)
+    assert poll(watermark, completed=[(2, 0), (1, 0), (0, 0)]) == [(2, 0), (1, 0), (0, 0)]
+    assert poll(watermark, completed=[(2, 0), (1, 0), (0, 0)]) == []
+    assert poll(watermark, completed=[(3, 0), (2, 0), (1, 0), (0, 0)]) == [(3, 0)]
+
+
+def test_running_stage_is_emitted_when_it_completes():
+    watermark = Watermark(STAGE_RETRY_WINDOW)
+    assert poll(watermark, running=[(1, 0)], completed=[(0, 0)]) == [(0, 0)]
+    assert poll(watermark, completed=[(1, 0), (0, 0)]) == [(1, 0)]
+    assert watermark.open == {}
+
+
+def test_retried_attempt_completing_between_polls_is_emitted():
+    watermark = Watermark(STAGE_RETRY_WINDOW)
+    assert poll(watermark, completed=[(5, 0), (4, 0), (3, 0)]) == [(5, 0), (4, 0), (3, 0)]
+    # stage 4 is resubmitted as attempt 1 and completes before the next poll
+    assert poll(watermark, completed=[(5, 0), (4, 1), (4, 0), (3, 0)]) == [(4, 1)]
+    assert poll(watermark, completed=[(5, 0), (4, 1), (4, 0), (3, 0)]) == []
+
+
+def test_listing_is_not_cut_off_before_retried_attempts_of_older_ids():
+    watermark = Watermark(STAGE_RETRY_WINDOW)
+    poll(watermark, completed=[(9, 0), (8, 0), (1, 0), (0, 0)])
+    assert poll(watermark, completed=[(9, 0), (8, 0), (1, 1), (1, 0), (0, 0)]) == [(1, 1)]
+
+
+def test_stages_below_the_window_end_the_listing():
+    watermark = Watermark(2)
+    poll(watermark, completed=[(10, 0), (9, 0), (8, 0), (7, 0)])
+    update = watermark.begin()
+    assert not update.exhausted(9)
+    assert update.exhausted(8)
+
+
+def test_emitted_keys_are_forgotten_below_the_window():
+    watermark = Watermark(2)
+    poll(watermark, completed=[(3, 0), (2, 0), (1, 0), (0, 0)])
+    assert set(watermark.recent) == {(3, 0), (2, 0)}
+
+
+def test_jobs_have_no_window():
+    watermark = Watermark()
+    poll(watermark, completed=[(1, 0), (0, 0)])
+    assert poll(watermark, completed=[(1, 0), (0, 1), (0, 0)]) == []
+    assert watermark.recent == {}
+
+
+def test_partial_commit_remembers_emitted_keys():
+    watermark = Watermark(STAGE_RETRY_WINDOW)
+    poll(watermark, running=[(1, 0)], completed=[(0, 0)])
+    # the listing fails after stage 3 was emitted, stage 1 was not listed
+    assert poll(watermark, completed=[(3, 0)], complete=False) == [(3, 0)]
+    assert watermark.high == 0
+    assert watermark.open == {(1, 0): 1}
+    assert poll(watermark, completed=[(3, 0), (2, 0), (1, 0), (0, 0)]) == [(2, 0), (1, 0)]
+    assert watermark.high == 3
+
+
+def test_store_gives_stages_a_retry_window():
+    store = WatermarkStore()
+    assert store.get('app', 'stages').window == STAGE_RETRY_WINDOW
+    assert store.get('app', 'jobs').window == 0